@@ -1,38 +1,37 @@
 import os
-import requests
 import json
-import chromadb
+import hashlib
+import logging
 import re  # Added to clean AI response
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime
 from dotenv import load_dotenv
+from providers import mistral
+from telemetry import span
+
+log = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv("./.env")
 
 # Set Mistral AI API credentials
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
 
-# ChromaDB Configuration
-CHROMA_API_KEY = os.getenv("CHROMA_API_KEY")
-CHROMA_TENANT = os.getenv("CHROMA_TENANT")
+# Bump whenever the crisis plan prompt or model settings change, so plans
+# cached under the old prompt aren't served for the new one.
+PROMPT_VERSION = "1"
+
+# How long a generated crisis plan is reused for identical inputs
+CRISIS_PLAN_TTL = float(os.getenv("CRISIS_PLAN_TTL", "3600"))
+CRISIS_PLAN_CACHE_SIZE = int(os.getenv("CRISIS_PLAN_CACHE_SIZE", "256"))
 
-# Validate API keys
+# Checked when a plan is requested rather than at import, so a worker that
+# never generates plans can start without the key.
 if not MISTRAL_API_KEY:
-    raise ValueError("MISTRAL_API_KEY is missing from .env")
-if not CHROMA_API_KEY:
-    raise ValueError("CHROMA_API_KEY is missing from .env")
-
-try:
-    chroma_client = chromadb.HttpClient(
-        ssl=True,
-        host="api.trychroma.com",
-        tenant=CHROMA_TENANT,
-        database="Treehacks25",
-        headers={"x-chroma-token": CHROMA_API_KEY},
-    )
-except Exception as e:
-    print("Error initializing ChromaDB:", e)
+    log.warning("MISTRAL_API_KEY is missing from .env; crisis plans will fail")
 
 # Function to generate a crisis plan using Mistral AI
 def generate_crisis_plan(biometric_data, behavioral_summary):
@@ -44,6 +43,9 @@ def generate_crisis_plan(biometric_data, behavioral_summary):
     :return: AI-generated recommendations in JSON format.
     """
 
+    if not MISTRAL_API_KEY:
+        return {"error": "MISTRAL_API_KEY is missing from .env"}
+
     headers = {
         "Authorization": f"Bearer {MISTRAL_API_KEY}",
         "Content-Type": "application/json",
@@ -109,10 +111,10 @@ Respond in a **structured JSON format** without additional explanations.
     }
 
     try:
-        response = requests.post(MISTRAL_API_URL, headers=headers, json=payload)
+        response = mistral.post("/chat/completions", headers=headers, json=payload)
         response_data = response.json()
 
-        print("Full API Response:", response_data)  # Debugging print
+        log.debug("Crisis plan response: %s", response_data)
 
         if "choices" in response_data and response_data["choices"]:
             ai_output = response_data["choices"][0]["message"]["content"]
@@ -129,10 +131,66 @@ Respond in a **structured JSON format** without additional explanations.
             return {"error": "Failed to generate a crisis plan."}
 
     except Exception as e:
-        print("Error during API call:", str(e))
+        log.exception("Crisis plan request failed: %s", e)
         return {"error": str(e)}
 
 
+def crisis_plan_key(biometric_data, behavioral_summary) -> str:
+    """Canonical hash of everything that determines a generated plan."""
+    payload = {
+        "biometric_data": biometric_data,
+        "behavioral_summary": (behavioral_summary or "").strip(),
+        "prompt_version": PROMPT_VERSION,
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+_plans: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+_in_flight: dict[str, Future] = {}
+_plans_lock = threading.Lock()
+
+
+def get_crisis_plan(biometric_data, behavioral_summary) -> tuple[dict, bool]:
+    """generate_crisis_plan, memoized for CRISIS_PLAN_TTL seconds.
+
+    Concurrent calls with the same inputs share one upstream request. Error
+    results are returned to every waiter but not cached. Returns the plan and
+    whether it came from the cache; a call that waited for another's request
+    got a freshly generated plan, so that's a miss.
+    """
+    key = crisis_plan_key(biometric_data, behavioral_summary)
+    with _plans_lock:
+        entry = _plans.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _plans.move_to_end(key)
+            return entry[1], True
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+
+    if not leader:
+        return future.result(), False
+
+    with span("generate_crisis_plan") as current:
+        try:
+            plan = generate_crisis_plan(biometric_data, behavioral_summary)
+        except Exception as e:
+            plan = {"error": str(e)}
+        current.failed = isinstance(plan, dict) and "error" in plan
+
+    with _plans_lock:
+        if not (isinstance(plan, dict) and "error" in plan):
+            _plans[key] = (time.monotonic() + CRISIS_PLAN_TTL, plan)
+            _plans.move_to_end(key)
+            while len(_plans) > CRISIS_PLAN_CACHE_SIZE:
+                _plans.popitem(last=False)
+        del _in_flight[key]
+    future.set_result(plan)
+    return plan, False
+
+
 # Main execution block (Testing Mode)
 if __name__ == "__main__":
     # Define dictionary instead of reading JSON files
@@ -0,0 +1,113 @@
+"""Decode uploaded audio into the float32 samples Whisper expects.
+
+Uploads are decoded in memory and handed to the model as an array, so nothing
+touches the disk. Plain PCM WAV, which is what the watch records, is parsed
+directly; anything else is piped through ffmpeg over stdin/stdout.
+"""
+
+import io
+import subprocess
+import wave
+
+import numpy as np
+
+# Whisper models are trained on 16 kHz mono audio.
+SAMPLE_RATE = 16000
+
+
+class AudioDecodeError(Exception):
+    """Raised when uploaded bytes can't be decoded as audio."""
+
+
+def decode_audio(data: bytes, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """Return mono float32 samples in [-1, 1] at ``sr`` Hz."""
+    if not data:
+        raise AudioDecodeError("empty audio upload")
+
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        try:
+            return _decode_wav(data, sr)
+        except (wave.Error, EOFError, ValueError):
+            # Float, extensible or otherwise unusual WAV: let ffmpeg handle it.
+            pass
+
+    return _decode_ffmpeg(data, sr)
+
+
+def _decode_wav(data: bytes, sr: int) -> np.ndarray:
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        ints = (
+            raw[:, 0].astype(np.int32)
+            | (raw[:, 1].astype(np.int32) << 8)
+            | (raw[:, 2].astype(np.int32) << 16)
+        )
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints.astype(np.float32) / 8388608
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"unsupported sample width: {width}")
+
+    if channels > 1:
+        samples = samples[: len(samples) - len(samples) % channels]
+        samples = samples.reshape(-1, channels).mean(axis=1)
+
+    return _resample(samples, rate, sr)
+
+
+def _resample(samples: np.ndarray, src: int, dst: int) -> np.ndarray:
+    if src == dst or len(samples) == 0:
+        return np.ascontiguousarray(samples, dtype=np.float32)
+
+    if src > dst and src % dst == 0:
+        # Integer decimation (48k/32k -> 16k): average each group of samples,
+        # which doubles as a simple anti-aliasing filter.
+        factor = src // dst
+        usable = len(samples) - len(samples) % factor
+        return samples[:usable].reshape(-1, factor).mean(axis=1).astype(np.float32)
+
+    if src > dst:
+        # Box-filter before interpolating so content above the new Nyquist
+        # frequency doesn't fold back into the speech band.
+        width = int(round(src / dst))
+        kernel = np.ones(width, dtype=np.float32) / width
+        samples = np.convolve(samples, kernel, mode="same")
+
+    duration = len(samples) / src
+    positions = np.arange(int(duration * dst)) * (src / dst)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def _decode_ffmpeg(data: bytes, sr: int) -> np.ndarray:
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sr),
+        "pipe:1",
+    ]
+    try:
+        out = subprocess.run(cmd, input=data, capture_output=True, check=True).stdout
+    except FileNotFoundError as e:
+        raise AudioDecodeError("ffmpeg is not installed") from e
+    except subprocess.CalledProcessError as e:
+        raise AudioDecodeError(
+            f"ffmpeg failed to decode audio: {e.stderr.decode(errors='ignore')}"
+        ) from e
+
+    return np.frombuffer(out, dtype=np.int16).astype(np.float32) / 32768
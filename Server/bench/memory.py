@@ -0,0 +1,146 @@
+"""Per-worker memory with and without a preloaded, fork-shared Whisper model.
+
+Run from the Server directory (Linux only, it reads /proc):
+
+    python -m bench.memory --workers 4
+
+Each mode runs in a fresh interpreter that forks ``--workers`` children the
+way gunicorn does. In ``independent`` mode every child loads its own model,
+which is what separate workers without ``preload_app`` do. In ``preload``
+mode the parent loads it once (``TranscriptionService.preload``) and the
+children share it. Every child then transcribes ``test_audio.wav`` once and
+reports its memory from ``/proc/<pid>/smaps_rollup``:
+
+RSS
+    resident pages, shared ones counted in full in every process
+PSS
+    shared pages split evenly between the processes mapping them; the sum over
+    all processes is the real footprint
+private
+    pages only this process uses
+
+``--random-weights`` builds the model with the real architecture but random
+weights, for machines without the checkpoint cached; sizes are unaffected.
+"""
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# whisper.ModelDimensions of the released checkpoints
+MODEL_DIMS = {
+    "tiny": dict(n_audio_state=384, n_audio_head=6, n_audio_layer=4, n_text_state=384, n_text_head=6, n_text_layer=4),
+    "base": dict(n_audio_state=512, n_audio_head=8, n_audio_layer=6, n_text_state=512, n_text_head=8, n_text_layer=6),
+    "small": dict(n_audio_state=768, n_audio_head=12, n_audio_layer=12, n_text_state=768, n_text_head=12, n_text_layer=12),
+}
+
+
+def memory(pid: int) -> dict:
+    """RSS, PSS and private memory of ``pid`` in MiB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    return {
+        "rss": fields["Rss"] / 1024,
+        "pss": fields["Pss"] / 1024,
+        "private": (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024,
+    }
+
+
+def use_random_weights(model_name: str) -> None:
+    import whisper
+    from whisper.model import ModelDimensions, Whisper
+
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_vocab=51865, n_text_ctx=448, **MODEL_DIMS[model_name])
+    whisper.load_model = lambda *args, **kwargs: Whisper(dims).eval()
+
+
+def run_mode(mode: str, workers: int, model_name: str) -> dict:
+    """Fork the workers and measure them (runs inside a fresh interpreter)."""
+    sys.path.insert(0, SERVER_DIR)
+    os.environ["TRANSCRIBE_WORKERS"] = "0"
+    import transcription
+    from audio import decode_audio
+
+    with open(os.path.join(SERVER_DIR, "test_audio.wav"), "rb") as f:
+        audio = decode_audio(f.read())
+
+    service = transcription.TranscriptionService(model_name=model_name, workers=0)
+    if mode == "preload":
+        service.preload()
+        gc.freeze()
+
+    children = []
+    for _ in range(workers):
+        ready_r, ready_w = os.pipe()
+        go_r, go_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            os.close(go_w)
+            service.after_fork(torch_threads=1)
+            service.transcribe(audio, timeout=600)
+            gc.collect()
+            os.write(ready_w, b"1")
+            os.read(go_r, 1)  # stay alive until measured
+            os._exit(0)
+        os.close(ready_w)
+        os.close(go_r)
+        children.append((pid, ready_r, go_w))
+
+    for _, ready_r, _ in children:
+        os.read(ready_r, 1)
+    result = {"parent": memory(os.getpid()), "workers": [memory(pid) for pid, _, _ in children]}
+    for pid, _, go_w in children:
+        os.write(go_w, b"1")
+        os.waitpid(pid, 0)
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model", default=os.getenv("WHISPER_MODEL", "base"))
+    parser.add_argument("--random-weights", action="store_true", help="skip the checkpoint; same tensor sizes")
+    parser.add_argument("--mode", choices=["independent", "preload"], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.mode:
+        if args.random_weights:
+            use_random_weights(args.model)
+        print(json.dumps(run_mode(args.mode, args.workers, args.model)))
+        return 0
+
+    print(f"Whisper {args.model}, {args.workers} workers{' (random weights)' if args.random_weights else ''}")
+    header = f"{'mode':<13}{'worker RSS':>12}{'worker PSS':>12}{'private':>10}{'parent PSS':>12}{'total PSS':>11}"
+    print(header + "   (MiB, worker columns are means)")
+    print("-" * len(header))
+    for mode in ("independent", "preload"):
+        command = [sys.executable, "-m", "bench.memory", "--mode", mode, "--workers", str(args.workers), "--model", args.model]
+        if args.random_weights:
+            command.append("--random-weights")
+        output = subprocess.run(command, cwd=SERVER_DIR, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        workers = result["workers"]
+
+        def mean(key):
+            return sum(worker[key] for worker in workers) / len(workers)
+
+        total = result["parent"]["pss"] + sum(worker["pss"] for worker in workers)
+        print(
+            f"{mode:<13}{mean('rss'):>12.0f}{mean('pss'):>12.0f}{mean('private'):>10.0f}"
+            f"{result['parent']['pss']:>12.0f}{total:>11.0f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""Offline load test: many synthetic watches against a fully stubbed server.
+
+Run from the Server directory:
+
+    python -m bench.run --watches 50 --duration 60
+
+The server is imported in-process with every external dependency replaced by a
+local stand-in (see ``bench/stubs.py``): Mistral, Gemini and ElevenLabs are
+served by a stub HTTP server, the document store is the embedded SQLite
+backend behind a wrapper that adds remote-database latency, and Twilio is a
+fake. All state goes to a temporary directory. Whisper runs for real unless
+``--stub-whisper`` is given (the real model needs its weights cached locally).
+
+Each watch replays ``heart_rate.json`` every ``--interval`` seconds (with some
+noise), sleep and activity samples less often, a buffered batch upload now
+and then, a profile read, and every so often a full spoken assessment with
+``test_audio.wav``. At the end the run prints throughput and p50/p95/p99
+latency per endpoint; ``--json`` also writes them to a file for comparison
+between builds.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+import requests
+from werkzeug.serving import make_server
+
+from bench.stubs import Behavior, FakeTwilio, ProviderStub, SlowStore
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(SERVER_DIR, name)) as f:
+        return json.load(f)
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def timed(self, label: str, call) -> Optional[requests.Response]:
+        started = time.perf_counter()
+        try:
+            response = call()
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[label].append(elapsed)
+            if not ok:
+                self.errors[label] += 1
+        return response
+
+    def report(self, duration: float) -> dict:
+        summary = {}
+        for label in sorted(self.latencies):
+            samples = np.array(self.latencies[label]) * 1000
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            summary[label] = {
+                "requests": len(samples),
+                "errors": self.errors[label],
+                "rps": len(samples) / duration,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(samples.max()),
+            }
+        return summary
+
+
+def print_report(summary: dict) -> None:
+    header = f"{'endpoint':<28}{'reqs':>8}{'errs':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for label, row in summary.items():
+        print(
+            f"{label:<28}{row['requests']:>8}{row['errors']:>7}{row['rps']:>9.1f}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}"
+        )
+
+
+class Watch(threading.Thread):
+    """One synthetic patient's watch."""
+
+    def __init__(self, index: int, base_url: str, args, recorder: Recorder, deadline: float, fixtures):
+        super().__init__(name=f"watch-{index}", daemon=True)
+        self.base_url = base_url
+        self.args = args
+        self.recorder = recorder
+        self.deadline = deadline
+        self.fixtures = fixtures
+        self.email = f"watch{index}@bench.local"
+        self.name_ = f"Watch {index}"
+        self.session = requests.Session()
+
+    def sample(self, fixture: str) -> dict:
+        data = dict(self.fixtures[fixture])
+        data.update(userEmail=self.email, userName=self.name_)
+        for key, value in data.items():
+            if isinstance(value, float):
+                data[key] = round(value * random.uniform(0.8, 1.2), 3)
+        return data
+
+    def post(self, label: str, path: str, **kwargs):
+        return self.recorder.timed(
+            label, lambda: self.session.post(f"{self.base_url}{path}", timeout=120, **kwargs)
+        )
+
+    def assessment(self) -> None:
+        form = {
+            "num": "0",
+            "history": "[]",
+            "question": "",
+            "question_text": "Hello, I'm an AI behavioral psychologist. How are you feeling?",
+            "end": "false",
+            "metadata": json.dumps({"name": self.name_, "email": self.email}),
+        }
+        for _ in range(3):
+            files = {"answer_audio": ("answer.wav", self.fixtures["audio"], "audio/wav")}
+            response = self.post("POST /assessment", "/assessment", data=form, files=files)
+            if response is None or response.status_code >= 400:
+                return
+            body = response.json()
+            if body.get("end"):
+                return
+            # Later turns only send the answer
+            form = {"session_id": body["session_id"], "end": "false"}
+
+    def run(self) -> None:
+        args = self.args
+        user_id = None
+        iteration = 0
+        # Spread the fleet out instead of having every watch fire at once
+        time.sleep(random.uniform(0, args.interval))
+        while time.time() < self.deadline:
+            iteration += 1
+            self.post("POST /alert_status", "/alert_status?audio=json", json=self.sample("heart_rate"))
+
+            if iteration % args.metrics_every == 0:
+                self.post("POST /health-metrics/sleep", "/api/health-metrics/sleep", json=self.sample("sleep"))
+                self.post(
+                    "POST /health-metrics/activity", "/api/health-metrics/activity", json=self.sample("activity")
+                )
+            if iteration % args.batch_every == 0:
+                samples = [self.sample("heart_rate") for _ in range(args.batch_size)]
+                self.post("POST /alert_status/batch", "/alert_status/batch?audio=json", json=samples)
+            if iteration % args.read_every == 0:
+                if user_id is None:
+                    user_id = self.fixtures["lookup"](self.email, self.name_)
+                if user_id:
+                    self.recorder.timed(
+                        "GET /get-user",
+                        lambda: self.session.get(f"{self.base_url}/get-user/{user_id}", timeout=120),
+                    )
+            if args.assessment_every and iteration % args.assessment_every == 0:
+                self.assessment()
+
+            time.sleep(max(0.0, random.gauss(args.interval, args.interval * 0.1)))
+
+
+def stub_whisper(latency: Behavior) -> None:
+    import whisper
+
+    class FakeModel:
+        def transcribe(self, audio, **kwargs):
+            latency.wait()
+            return {"text": "I have been feeling a bit tired but mostly okay."}
+
+    whisper.load_model = lambda *args, **kwargs: FakeModel()
+
+
+def start_server(args, workdir: str):
+    """Configure the environment, import the server and serve it on a free port."""
+    stub = ProviderStub(
+        mistral=Behavior(args.provider_latency, failure_rate=args.failure_rate),
+        gemini=Behavior(args.provider_latency, failure_rate=args.failure_rate),
+        elevenlabs=Behavior(args.provider_latency, failure_rate=args.failure_rate),
+    )
+    stub_url = stub.start()
+
+    os.environ.update(
+        {
+            "MISTRAL_API_KEY": "bench",
+            "GEMINI_API_KEY": "bench",
+            "ELEVENLABS_API_KEY": "bench",
+            "MISTRAL_API_BASE": f"{stub_url}/mistral/v1",
+            "GEMINI_API_BASE": f"{stub_url}/gemini",
+            "ELEVENLABS_API_BASE": f"{stub_url}/elevenlabs/v1",
+            "STORAGE_BACKEND": "sqlite",
+            "STORAGE_PATH": os.path.join(workdir, "storage.db"),
+            "JOBS_DB": os.path.join(workdir, "jobs.db"),
+            "ROLLUPS_DB": os.path.join(workdir, "rollups.db"),
+            "ANOMALY_DB": os.path.join(workdir, "anomaly.db"),
+            "SEARCH_DB": os.path.join(workdir, "search.db"),
+            "VERSIONS_DB": os.path.join(workdir, "versions.db"),
+            "TIMESERIES_DIR": os.path.join(workdir, "timeseries"),
+            "TTS_CACHE_DIR": os.path.join(workdir, "tts_cache"),
+            "EMBEDDING_MODEL": "hashing",
+            "LOG_LEVEL": "WARNING",
+        }
+    )
+    if args.stub_whisper:
+        stub_whisper(Behavior(args.whisper_latency))
+        # The stub only exists in this process; pool workers must inherit it
+        os.environ["TRANSCRIBE_START_METHOD"] = "fork"
+
+    sys.path.insert(0, SERVER_DIR)
+    import storage
+
+    store_behavior = Behavior(args.store_latency, failure_rate=args.store_failure_rate)
+    storage.open_store = lambda backend=None: SlowStore(storage.SQLiteStore(), store_behavior)
+
+    import server
+
+    server.TWILIO_CLIENT = FakeTwilio(Behavior(args.provider_latency))
+    # Keep model loading out of the measured latencies
+    server.components.wait_ready()
+
+    http = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http.serve_forever, name="bench-server", daemon=True).start()
+    return server, stub, http
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--watches", type=int, default=20, help="concurrent synthetic watches")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between heart-rate posts per watch")
+    parser.add_argument("--metrics-every", type=int, default=10, help="sleep/activity post every N iterations")
+    parser.add_argument("--batch-every", type=int, default=15, help="batch upload every N iterations")
+    parser.add_argument("--batch-size", type=int, default=30, help="samples per batch upload")
+    parser.add_argument("--read-every", type=int, default=10, help="profile read every N iterations")
+    parser.add_argument("--assessment-every", type=int, default=30, help="spoken assessment every N iterations (0 = never)")
+    parser.add_argument("--provider-latency", type=float, default=0.3, help="mean Mistral/Gemini/ElevenLabs latency (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of provider calls that fail")
+    parser.add_argument("--store-latency", type=float, default=0.03, help="mean document store latency (s)")
+    parser.add_argument("--store-failure-rate", type=float, default=0.0, help="fraction of store calls that fail")
+    parser.add_argument("--stub-whisper", action="store_true", help="replace Whisper with a fixed-latency fake")
+    parser.add_argument("--whisper-latency", type=float, default=0.5, help="fake Whisper latency (s)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    os.chdir(SERVER_DIR)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix="treehacks-bench-")
+    server, stub, http = start_server(args, workdir)
+    base_url = f"http://127.0.0.1:{http.server_port}"
+
+    with open(os.path.join(SERVER_DIR, "test_audio.wav"), "rb") as f:
+        audio = f.read()
+    fixtures = {
+        "heart_rate": load_fixture("heart_rate.json"),
+        "sleep": load_fixture("sleep_metrics.json"),
+        "activity": load_fixture("activity_metrics.json"),
+        "audio": audio,
+        "lookup": server.identity_index.lookup,
+    }
+
+    recorder = Recorder()
+    started = time.time()
+    deadline = started + args.duration
+    watches = [Watch(i, base_url, args, recorder, deadline, fixtures) for i in range(args.watches)]
+    print(f"Running {args.watches} watches for {args.duration:.0f}s (state in {workdir})")
+    for watch in watches:
+        watch.start()
+    for watch in watches:
+        watch.join()
+    elapsed = time.time() - started
+
+    server.write_buffer.stop()
+    server.job_queue.stop()
+    http.shutdown()
+    stub.stop()
+
+    summary = recorder.report(elapsed)
+    print_report(summary)
+    print("upstream calls:", stub.calls)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {"args": vars(args), "elapsed_s": elapsed, "endpoints": summary, "upstream_calls": stub.calls},
+                f,
+                indent=2,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Local stand-ins for the services the server depends on.
+
+``ProviderStub`` is one small HTTP server that answers the Mistral, Gemini and
+ElevenLabs calls the server makes (point ``MISTRAL_API_BASE``,
+``GEMINI_API_BASE`` and ``ELEVENLABS_API_BASE`` at it). ``SlowStore`` wraps a
+document store client to play the part of a remote Chroma, and
+``FakeTwilio`` replaces the Twilio client. Each takes a ``Behavior``: a mean
+latency with jitter, and the fraction of calls that fail.
+"""
+
+import itertools
+import json
+import random
+import threading
+import time
+
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
+
+# Roughly 128 kbps MP3 at ~15 characters of speech per second
+FAKE_MP3_BYTES_PER_CHAR = 1000
+FAKE_MP3_CHUNK = 4096
+
+QUESTIONS = [
+    "Thanks for sharing that. How have you been sleeping over the past week?",
+    "That sounds difficult. Have you noticed any changes in your appetite lately?",
+    "How often have you been exercising, and how do you feel afterwards?",
+    "How are things with the people closest to you right now?",
+    "Thank you for your time today, take care. [CONVERSATION ENDED]",
+]
+
+
+class Behavior:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.25, failure_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    def wait(self) -> None:
+        if self.latency > 0:
+            time.sleep(max(0.0, random.gauss(self.latency, self.latency * self.jitter)))
+
+    def fails(self) -> bool:
+        return random.random() < self.failure_rate
+
+
+class ProviderStub:
+    def __init__(self, mistral: Behavior, gemini: Behavior, elevenlabs: Behavior):
+        self.behaviors = {"mistral": mistral, "gemini": gemini, "elevenlabs": elevenlabs}
+        self.calls = {name: 0 for name in self.behaviors}
+        self._lock = threading.Lock()
+        self._questions = itertools.count()
+        self.app = self._build_app()
+        self._server = None
+
+    def _enter(self, name: str):
+        """Count the call and apply its latency; returns an error response if it fails."""
+        with self._lock:
+            self.calls[name] += 1
+        behavior = self.behaviors[name]
+        behavior.wait()
+        if behavior.fails():
+            return Response(json.dumps({"error": "stub failure"}), 503, mimetype="application/json")
+        return None
+
+    def _build_app(self) -> Flask:
+        app = Flask("provider-stub")
+
+        @app.post("/mistral/v1/chat/completions")
+        def mistral_chat():
+            failure = self._enter("mistral")
+            if failure is not None:
+                return failure
+            prompt = json.dumps(request.get_json(silent=True) or {})
+            if "JSON" in prompt:
+                content = json.dumps({"current_state": "stable", "urgency_level": "Low"})
+            else:
+                content = "<p>The patient reports a stable mood with some trouble sleeping.</p>"
+            return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+        @app.post("/gemini/v1beta/models/<model>:streamGenerateContent")
+        def gemini_stream(model):
+            failure = self._enter("gemini")
+            if failure is not None:
+                return failure
+            question = QUESTIONS[next(self._questions) % len(QUESTIONS)]
+            words = question.split(" ")
+            pieces = [" ".join(words[i : i + 4]) + " " for i in range(0, len(words), 4)]
+            behavior = self.behaviors["gemini"]
+
+            def generate():
+                yield "["
+                for i, piece in enumerate(pieces):
+                    if i:
+                        time.sleep(behavior.latency / len(pieces))
+                        yield ","
+                    yield json.dumps(
+                        {"candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}]}
+                    )
+                yield "]"
+
+            return Response(generate(), mimetype="application/json")
+
+        def speech(stream: bool):
+            failure = self._enter("elevenlabs")
+            if failure is not None:
+                return failure
+            text = (request.get_json(silent=True) or {}).get("text", "")
+            size = max(len(text), 1) * FAKE_MP3_BYTES_PER_CHAR
+            audio = b"\xff\xfb" + bytes(size - 2)
+            if not stream:
+                return Response(audio, mimetype="audio/mpeg")
+
+            def generate():
+                for start in range(0, len(audio), FAKE_MP3_CHUNK):
+                    yield audio[start : start + FAKE_MP3_CHUNK]
+
+            return Response(generate(), mimetype="audio/mpeg")
+
+        @app.post("/elevenlabs/v1/text-to-speech/<voice_id>")
+        def elevenlabs_tts(voice_id):
+            return speech(stream=False)
+
+        @app.post("/elevenlabs/v1/text-to-speech/<voice_id>/stream")
+        def elevenlabs_tts_stream(voice_id):
+            return speech(stream=True)
+
+        return app
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve in a background thread; returns the base URL."""
+        self._server = make_server(host, port, self.app, threaded=True)
+        threading.Thread(target=self._server.serve_forever, name="provider-stub", daemon=True).start()
+        return f"http://{host}:{self._server.server_port}"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class SlowCollection:
+    def __init__(self, inner, behavior: Behavior):
+        self._inner = inner
+        self._behavior = behavior
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def _call(self, method: str, *args, **kwargs):
+        self._behavior.wait()
+        if self._behavior.fails():
+            raise ConnectionError(f"stub store failure in {method}")
+        return getattr(self._inner, method)(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        return self._call("add", *args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._call("get", *args, **kwargs)
+
+    def count(self):
+        return self._call("count")
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", *args, **kwargs)
+
+
+class SlowStore:
+    """A document store client with remote-database latency and failures."""
+
+    def __init__(self, inner, behavior: Behavior):
+        self._inner = inner
+        self.behavior = behavior
+
+    def get_or_create_collection(self, name: str, **kwargs) -> SlowCollection:
+        return SlowCollection(self._inner.get_or_create_collection(name, **kwargs), self.behavior)
+
+
+class FakeTwilio:
+    """Stands in for ``twilio.rest.Client``; records the messages it was asked to send."""
+
+    def __init__(self, behavior: Behavior):
+        self.behavior = behavior
+        self.sent: list[dict] = []
+        self.messages = self
+
+    def create(self, **kwargs):
+        self.behavior.wait()
+        if self.behavior.fails():
+            raise ConnectionError("stub Twilio failure")
+        self.sent.append(kwargs)
+        return type("Message", (), {"sid": f"SM{len(self.sent):032d}"})()
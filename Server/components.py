@@ -0,0 +1,183 @@
+"""Lazily built clients and models, and the warm-up phase that builds them.
+
+Anything slow to create (the Chroma connection, the Gemini SDK, the Twilio
+client, the Whisper workers, the search embedder) is registered here with a
+factory instead of being built when the server is imported. A component is
+built the first time it is used, or ahead of traffic by ``warm()``, and only
+ever once per process.
+
+``WARMUP`` picks what the warm-up phase builds: ``all`` (default), ``none``,
+or a comma-separated list of component names. ``all`` leaves out components
+registered with ``warm=False`` (ones no route needs yet, like Twilio), so
+their missing credentials can't hold readiness back; list them by name to
+warm them anyway. A worker that only serves
+dashboard reads can run with ``WARMUP=store`` and skip the speech stack
+entirely, including the speech cache prewarm. The readiness probe reports ready once warm-up has finished and
+everything it built succeeded; ``report()`` gives per-component build times
+for the startup report.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+WARMUP = os.getenv("WARMUP", "all")
+
+# Measured from the first import of this module, i.e. early in server startup
+IMPORTED_AT = time.perf_counter()
+
+log = logging.getLogger(__name__)
+
+
+class Component:
+    def __init__(self, name: str, factory: Callable[[], Any], warm: bool = True):
+        self.name = name
+        self.factory = factory
+        self.warm = warm  # included in WARMUP=all
+        self.state = "pending"
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.instance: Any = None
+        self.lock = threading.Lock()
+
+
+class ComponentRegistry:
+    def __init__(self):
+        self._components: dict[str, Component] = {}
+        self._warm_started: Optional[float] = None
+        self._warm_seconds: Optional[float] = None
+        self._warmed: list[str] = []
+        self._booted: Optional[float] = None
+        self._done = threading.Event()
+
+    def register(self, name: str, factory: Callable[[], Any], warm: bool = True) -> "Lazy":
+        """Add a component; returns a proxy that builds it on first attribute access.
+
+        ``warm=False`` leaves it out of ``WARMUP=all``.
+        """
+        self._components[name] = Component(name, factory, warm)
+        return Lazy(self, name)
+
+    def get(self, name: str) -> Any:
+        """The built component, building it now if needed; re-raises a failed build."""
+        component = self._components[name]
+        if component.state == "ready":
+            return component.instance
+        with component.lock:
+            if component.state != "ready":
+                self._build(component)
+            return component.instance
+
+    def _build(self, component: Component) -> None:
+        component.state = "building"
+        started = time.perf_counter()
+        try:
+            component.instance = component.factory()
+        except Exception as e:
+            component.state = "failed"
+            component.error = str(e)
+            component.seconds = time.perf_counter() - started
+            log.exception("Failed to build %s: %s", component.name, e)
+            raise
+        component.seconds = time.perf_counter() - started
+        component.state = "ready"
+        component.error = None
+        log.info("Built %s in %.3fs", component.name, component.seconds)
+
+    def reset(self, *names: str) -> None:
+        """Forget built instances so they are rebuilt on next use (e.g. after a fork)."""
+        for name in names:
+            component = self._components[name]
+            component.lock = threading.Lock()
+            if component.state in ("ready", "failed"):
+                component.state = "pending"
+                component.instance = None
+                component.seconds = None
+                component.error = None
+
+    def after_fork(self) -> None:
+        """Start a fresh warm-up record in a forked worker."""
+        self._done = threading.Event()
+        self._warmed = []
+        self._warm_seconds = None
+
+    def is_built(self, name: str) -> bool:
+        return self._components[name].state == "ready"
+
+    def resolve(self, spec: str = WARMUP) -> list[str]:
+        """Component names selected by a WARMUP-style spec."""
+        spec = spec.strip().lower()
+        if spec == "all":
+            return [name for name, c in self._components.items() if c.warm]
+        if spec in ("", "none"):
+            return []
+        names = [name.strip() for name in spec.split(",") if name.strip()]
+        unknown = [name for name in names if name not in self._components]
+        if unknown:
+            raise ValueError(f"Unknown WARMUP components: {', '.join(unknown)}")
+        return names
+
+    def warm(self, names: Iterable[str]) -> bool:
+        """Build ``names`` in order; returns False if any of them failed."""
+        self._warmed = list(names)
+        self._warm_started = time.perf_counter()
+        ok = True
+        for name in self._warmed:
+            try:
+                self.get(name)
+            except Exception:
+                ok = False
+        self._warm_seconds = time.perf_counter() - self._warm_started
+        self._done.set()
+        log.info("Startup report", extra={"startup": self.report()})
+        return ok
+
+    def warm_in_background(self, names: Iterable[str]) -> threading.Thread:
+        thread = threading.Thread(target=self.warm, args=(list(names),), name="warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def mark_booted(self) -> None:
+        """Record that the server finished importing and can accept connections."""
+        self._booted = time.perf_counter()
+        log.info("Server booted in %.3fs", self._booted - IMPORTED_AT)
+
+    def ready(self) -> bool:
+        if not self._done.is_set():
+            return False
+        return all(self._components[name].state == "ready" for name in self._warmed)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout) and self.ready()
+
+    def report(self) -> dict:
+        return {
+            "boot_seconds": self._booted - IMPORTED_AT if self._booted is not None else None,
+            "warmup": self._warmed,
+            "warmup_seconds": self._warm_seconds,
+            "warmup_done": self._done.is_set(),
+            "ready": self.ready(),
+            "components": {
+                name: {"state": c.state, "seconds": c.seconds, "error": c.error}
+                for name, c in self._components.items()
+            },
+        }
+
+
+class Lazy:
+    """Stands in for a registered component and forwards to it once built."""
+
+    def __init__(self, registry: ComponentRegistry, name: str):
+        object.__setattr__(self, "_registry", registry)
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, attr: str):
+        return getattr(self._registry.get(self._name), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy {self._name}>"
+
+
+components = ComponentRegistry()
@@ -0,0 +1,209 @@
+"""Per-patient baseline anomaly detection for incoming heart-rate samples.
+
+Each patient has a small, constant-size state: an exponentially weighted mean
+and variance of agitation and HRV. A sample is scored against the baseline
+before it is folded in: how many standard deviations agitation is above its
+mean, plus (weighted) how far HRV has dropped below its mean. An alert starts
+when the score crosses ``ANOMALY_ENTER_SCORE`` and doesn't re-arm until it
+falls back under ``ANOMALY_EXIT_SCORE`` (hysteresis), and at most one alert is
+raised per ``ANOMALY_COOLDOWN_SECONDS``.
+
+Until a patient has ``ANOMALY_WARMUP_SAMPLES`` samples the baseline isn't
+trusted and the old fixed rule (agitation above 50) decides instead, still
+subject to the cooldown.
+
+State lives in SQLite and every update is one write transaction, so it
+survives restarts and is shared by all server processes.
+"""
+
+import math
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from typing import Optional
+
+from timeseries import to_micros
+
+ANOMALY_DB = os.getenv("ANOMALY_DB", "./anomaly.db")
+ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", "0.05"))
+ANOMALY_WARMUP_SAMPLES = int(os.getenv("ANOMALY_WARMUP_SAMPLES", "30"))
+ANOMALY_ENTER_SCORE = float(os.getenv("ANOMALY_ENTER_SCORE", "3.0"))
+ANOMALY_EXIT_SCORE = float(os.getenv("ANOMALY_EXIT_SCORE", "1.5"))
+ANOMALY_COOLDOWN_SECONDS = float(os.getenv("ANOMALY_COOLDOWN_SECONDS", "1800"))
+HRV_WEIGHT = 0.5
+
+# Fixed rule used during warm-up (and if the detector is unavailable)
+AGITATION_THRESHOLD = 50
+
+# Floors on the standard deviation so a very steady patient doesn't turn
+# ordinary jitter into huge scores.
+MIN_STD = {"agitation": 2.0, "hrv": 2.0}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS baselines (
+    user_id TEXT PRIMARY KEY,
+    samples INTEGER NOT NULL,
+    agitation_mean REAL,
+    agitation_var REAL,
+    hrv_mean REAL,
+    hrv_var REAL,
+    alerting INTEGER NOT NULL,
+    last_alert INTEGER,
+    last_sample INTEGER
+);
+"""
+
+FIELDS = ("agitation", "hrv")
+
+
+def threshold_critical(sample: dict) -> bool:
+    agitation = _number(sample.get("agitation"))
+    return agitation is not None and agitation > AGITATION_THRESHOLD
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if math.isnan(value):
+        return None
+    return float(value)
+
+
+def _z(value: Optional[float], mean: Optional[float], var: Optional[float], field: str):
+    if value is None or mean is None:
+        return None
+    return (value - mean) / max(math.sqrt(var or 0.0), MIN_STD[field])
+
+
+def _fold(state: dict, field: str, value: Optional[float]) -> None:
+    """EWMA update of one field's mean and variance.
+
+    The first samples use a plain running average (weight 1/n) so the
+    baseline isn't anchored to whatever the very first reading was.
+    """
+    if value is None:
+        return
+    mean, var = state[f"{field}_mean"], state[f"{field}_var"]
+    if mean is None:
+        state[f"{field}_mean"], state[f"{field}_var"] = value, 0.0
+        return
+    alpha = max(ANOMALY_ALPHA, 1 / (state["samples"] + 1))
+    diff = value - mean
+    increment = alpha * diff
+    state[f"{field}_mean"] = mean + increment
+    state[f"{field}_var"] = (1 - alpha) * (var + diff * increment)
+
+
+class AnomalyDetector:
+    def __init__(self, path: str = ANOMALY_DB):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _fresh(user_id: str) -> dict:
+        return {
+            "user_id": user_id,
+            "samples": 0,
+            "agitation_mean": None,
+            "agitation_var": None,
+            "hrv_mean": None,
+            "hrv_var": None,
+            "alerting": 0,
+            "last_alert": None,
+            "last_sample": None,
+        }
+
+    def _step(self, state: dict, timestamp: datetime, sample: dict, newest: bool = True) -> dict:
+        """Score one sample against the baseline, then fold it in.
+
+        Only the ``newest`` sample of a batch can change the alert state.
+        """
+        values = {field: _number(sample.get(field)) for field in FIELDS}
+        z_agitation = _z(
+            values["agitation"], state["agitation_mean"], state["agitation_var"], "agitation"
+        )
+        z_hrv = _z(values["hrv"], state["hrv_mean"], state["hrv_var"], "hrv")
+
+        now = to_micros(timestamp)
+        # Samples older than what we've already seen (replayed from a buffer)
+        # and all but the newest of a batch still train the baseline but can't
+        # raise an alert.
+        latest = state["last_sample"] is None or now >= state["last_sample"]
+        current = newest and latest
+        warmup = state["samples"] < ANOMALY_WARMUP_SAMPLES
+
+        score = None
+        if z_agitation is not None:
+            score = z_agitation + HRV_WEIGHT * max(-(z_hrv or 0.0), 0.0)
+
+        triggered = False
+        if warmup:
+            triggered = current and threshold_critical(sample)
+        elif score is not None and current:
+            if state["alerting"] and score < ANOMALY_EXIT_SCORE:
+                state["alerting"] = 0
+            elif not state["alerting"] and score >= ANOMALY_ENTER_SCORE:
+                state["alerting"] = 1
+                triggered = True
+
+        cooldown = ANOMALY_COOLDOWN_SECONDS * 1_000_000
+        critical = triggered and (
+            state["last_alert"] is None or now - state["last_alert"] >= cooldown
+        )
+        if critical:
+            state["last_alert"] = now
+
+        for field in FIELDS:
+            _fold(state, field, values[field])
+        state["samples"] += 1
+        if latest:
+            state["last_sample"] = now
+
+        return {
+            "critical": critical,
+            "warmup": warmup,
+            "score": score,
+            "z_agitation": z_agitation,
+            "z_hrv": z_hrv,
+        }
+
+    def observe(self, user_id: str, samples: list[tuple[datetime, dict]]) -> dict:
+        """Update the patient's baseline with ``samples`` (in timestamp order).
+
+        Every sample trains the baseline, but only the newest one is scored
+        for an alert, so a spike that has already passed doesn't raise one.
+        Returns the newest sample's decision: ``critical``, ``warmup``,
+        ``score`` and per-field z-scores.
+        """
+        samples = sorted(samples, key=lambda item: item[0])
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM baselines WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                state = dict(row) if row else self._fresh(user_id)
+                decision = {"critical": False, "warmup": True, "score": None}
+                for index, (timestamp, sample) in enumerate(samples):
+                    decision = self._step(state, timestamp, sample, index == len(samples) - 1)
+                conn.execute(
+                    "INSERT OR REPLACE INTO baselines"
+                    " (user_id, samples, agitation_mean, agitation_var, hrv_mean, hrv_var,"
+                    " alerting, last_alert, last_sample)"
+                    " VALUES (:user_id, :samples, :agitation_mean, :agitation_var, :hrv_mean,"
+                    " :hrv_var, :alerting, :last_alert, :last_sample)",
+                    state,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return decision
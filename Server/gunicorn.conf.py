@@ -0,0 +1,62 @@
+"""Multi-worker serving with one shared copy of the models.
+
+    gunicorn -c gunicorn.conf.py server:app
+
+The app is imported once in the gunicorn parent (``preload_app``) with
+``PREFORK=1``, which loads the Whisper model (and the search embedder) there
+and starts nothing else. Workers are forked from it and share the weights
+copy-on-write; inference only reads them, so those pages stay shared. Each
+worker then re-creates its store and provider connections and starts its own
+background threads in ``post_fork``. Transcription runs in-process on each
+worker (``TRANSCRIBE_WORKERS=0``), so concurrency scales with the worker
+count. With ``TRANSCRIBE_WORKERS>0`` the transcription pools forked from each
+worker share the same pages too, as long as the start method stays ``fork``.
+
+Memory: ``python -m bench.memory --workers 4`` loads the model both ways
+and reports RSS, PSS (shared pages split between their users) and private
+memory per worker. Measured with ``--random-weights`` (Whisper "base"
+architecture, so the same tensor sizes as the checkpoint) on torch 2.14 CPU,
+Python 3.11, Linux, after one transcription per worker:
+
+    MiB          worker RSS   worker PSS   worker private   total PSS (4 workers + parent)
+    independent         743          503              442         2362
+    preload             738          244              119         1347
+
+i.e. each extra worker costs about 120 MiB private instead of about 440.
+
+Re-run it on the target machine before sizing a deployment.
+
+Live feed events (``/api/live``) are relayed between workers through a
+shared SQLite table, so a stream on any worker sees samples stored by all of
+them.
+
+Settings come from the environment: ``BIND``, ``WEB_CONCURRENCY`` (workers),
+``WEB_THREADS`` (threads per worker) and ``TORCH_THREADS`` (torch threads per
+worker; defaults to the CPU count split across workers).
+"""
+
+import os
+
+os.environ.setdefault("PREFORK", "1")
+os.environ.setdefault("TRANSCRIBE_WORKERS", "0")
+# Consecutive turns of an assessment can land on different workers
+os.environ.setdefault("SESSIONS_DB", "./sessions.db")
+
+bind = os.getenv("BIND", "0.0.0.0:8080")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "8"))
+# An open /api/live stream holds a thread for as long as it is connected;
+# leave at least half of each worker's threads for ordinary requests
+os.environ.setdefault("LIVE_MAX_SUBSCRIBERS", str(max(1, threads // 2)))
+preload_app = True
+# Spoken assessments stream for a while; don't kill a worker mid-reply
+timeout = 120
+
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0")) or max(1, (os.cpu_count() or 1) // workers)
+
+
+def post_fork(server, worker):
+    import server as app_module
+
+    app_module.after_fork(torch_threads=TORCH_THREADS)
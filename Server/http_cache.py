@@ -0,0 +1,86 @@
+"""Conditional GETs and compression for the dashboard's JSON reads.
+
+Versioned reads (see versions.py) send a weak ``ETag`` with
+``Cache-Control: no-cache``, so browsers revalidate each poll on their own
+and get an empty ``304 Not Modified`` while nothing has changed. Check
+``not_modified(tag)`` before touching the store so a 304 costs one version
+lookup.
+
+``init_compression(app)`` compresses JSON bodies larger than
+``COMPRESS_MIN_BYTES`` with brotli when the client accepts it and the
+``brotli`` package is installed, and with gzip otherwise. Streamed responses
+(NDJSON, audio) are left alone.
+"""
+
+import gzip
+import os
+from typing import Optional
+
+from flask import Flask, Response, request
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+# Brotli's higher levels are too slow to run per request
+BROTLI_QUALITY = 5
+
+
+def parse_version(value: Optional[str]) -> Optional[int]:
+    """``?since=`` as a version number, or None if it's something else (a timestamp)."""
+    if value and value.isdigit():
+        return int(value)
+    return None
+
+
+def with_etag(response: Response, tag: str) -> Response:
+    response.set_etag(tag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def not_modified(tag: str) -> Optional[Response]:
+    """A 304 response if the client's ``If-None-Match`` already has ``tag``."""
+    if request.if_none_match.contains_weak(tag):
+        return with_etag(Response(status=304), tag)
+    return None
+
+
+def _encoding() -> Optional[str]:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_response(response: Response) -> Response:
+    if (
+        response.status_code != 200
+        or response.is_streamed
+        or response.direct_passthrough
+        or response.mimetype != "application/json"
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+
+    encoding = _encoding()
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return response
+    if encoding == "br":
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_compression(app: Flask) -> None:
+    app.after_request(compress_response)
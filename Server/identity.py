@@ -0,0 +1,164 @@
+"""(email, name) -> user_id resolution for incoming telemetry and uploads.
+
+Patients used to be resolved by scanning the whole ``patients`` collection on
+every write. Instead, each identity is stored once in its own collection under
+a deterministic id derived from (email, name), and mirrored in an in-process
+dict. A lookup is a dict hit; a miss is a single ``get`` by id. Because the id
+is deterministic, two workers racing to create the same patient write the same
+identity record and both read back the same winner.
+
+The identity record is written before the patient's document, so a failure
+in between leaves an identity without a patient. Whoever next reads that
+identity from the store (``resolve`` or ``warm``) writes the missing document.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from typing import Optional
+
+from queries import scan_collection
+
+log = logging.getLogger(__name__)
+
+IDENTITY_COLLECTION = "patient_identities"
+PATIENTS_COLLECTION = "patients"
+
+# Defaults the old linear scan used for patient documents missing a field.
+LEGACY_EMAIL = "jodoe@gmail.com"
+LEGACY_NAME = "John Doe"
+
+
+def identity_key(email: str, name: str) -> str:
+    return hashlib.sha256(f"{email}\x00{name}".encode("utf-8")).hexdigest()
+
+
+class IdentityIndex:
+    def __init__(self, client):
+        self.client = client
+        self._cache: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+
+    def _identities(self):
+        return self.client.get_or_create_collection(name=IDENTITY_COLLECTION)
+
+    def _patients(self):
+        return self.client.get_or_create_collection(name=PATIENTS_COLLECTION)
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def warm(self) -> int:
+        """Load every known identity into memory, backfilling from ``patients``.
+
+        Returns the number of identities cached.
+        """
+        identities = self._identities()
+        records = {
+            row["id"]: row["metadata"]
+            for row in scan_collection(identities)
+            if row["metadata"] and row["metadata"].get("user_id")
+        }
+        cache = {key: record["user_id"] for key, record in records.items()}
+
+        # Patients created before the index existed.
+        missing_ids, missing_metas = [], []
+        patient_ids = set()
+        for row in scan_collection(self._patients()):
+            user_id, document = row["id"], row["document"]
+            patient_ids.add(user_id)
+            email = document.get("email", LEGACY_EMAIL)
+            name = document.get("name", LEGACY_NAME)
+            key = identity_key(email, name)
+            if key in cache:
+                continue
+            cache[key] = user_id
+            missing_ids.append(key)
+            missing_metas.append({"user_id": user_id, "email": email, "name": name})
+
+        if missing_ids:
+            identities.add(
+                ids=missing_ids,
+                documents=[json.dumps(m) for m in missing_metas],
+                metadatas=missing_metas,
+            )
+
+        # Identities whose patient document was never written.
+        for record in records.values():
+            if record["user_id"] not in patient_ids:
+                patient_ids.add(record["user_id"])
+                log.warning("Restoring the missing patient document for %s", record["user_id"])
+                self._add_patient(
+                    record["user_id"],
+                    record.get("email", LEGACY_EMAIL),
+                    record.get("name", LEGACY_NAME),
+                )
+
+        with self._lock:
+            self._cache.update(cache)
+            return len(self._cache)
+
+    def lookup(self, email: str, name: str) -> Optional[str]:
+        """Return the cached user_id for (email, name) without touching the store."""
+        return self._cache.get(identity_key(email, name))
+
+    def resolve(self, email: str, name: str) -> tuple[str, bool]:
+        """Return ``(user_id, created)`` for a patient, creating them if needed."""
+        key = identity_key(email, name)
+        user_id = self._cache.get(key)
+        if user_id:
+            return user_id, False
+
+        with self._key_lock(key):
+            user_id = self._cache.get(key)
+            if user_id:
+                return user_id, False
+
+            identities = self._identities()
+            user_id = self._read(identities, key)
+            if user_id:
+                self._ensure_patient(user_id, email, name)
+                self._cache[key] = user_id
+                return user_id, False
+
+            new_id = f"{uuid.uuid4()}"
+            record = {"user_id": new_id, "email": email, "name": name}
+            identities.add(ids=[key], documents=[json.dumps(record)], metadatas=[record])
+
+            # Another worker may have claimed this identity first; the store
+            # keeps the first record written under a given id.
+            user_id = self._read(identities, key) or new_id
+            if user_id != new_id:
+                self._ensure_patient(user_id, email, name)
+                self._cache[key] = user_id
+                return user_id, False
+
+            # Cached only once the patient exists, so a failure here is
+            # repaired by the next call
+            self._add_patient(new_id, email, name)
+            self._cache[key] = new_id
+            return new_id, True
+
+    def _add_patient(self, user_id: str, email: str, name: str) -> None:
+        self._patients().add(
+            ids=[user_id],
+            documents=[json.dumps({"name": name, "email": email})],
+            metadatas=[{"name": name, "email": email}],
+        )
+
+    def _ensure_patient(self, user_id: str, email: str, name: str) -> None:
+        if not self._patients().get(ids=[user_id], include=[])["ids"]:
+            log.warning("Restoring the missing patient document for %s", user_id)
+            self._add_patient(user_id, email, name)
+
+    @staticmethod
+    def _read(identities, key: str) -> Optional[str]:
+        found = identities.get(ids=[key], include=["metadatas"])
+        for meta in found["metadatas"] or []:
+            if meta and meta.get("user_id"):
+                return meta["user_id"]
+        return None
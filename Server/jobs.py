@@ -0,0 +1,184 @@
+"""Durable background jobs backed by SQLite.
+
+Work that doesn't need to finish before the client gets its response (e.g.
+summarizing and storing a finished conversation) is written to a local SQLite
+table and picked up by worker threads. Jobs survive restarts: a job is claimed
+with a lease, and if its worker dies the lease runs out and another worker
+takes it over. A handler that raises is retried with exponential backoff until
+``max_attempts`` is reached, after which the job is marked ``failed``.
+
+Several server processes can share one database file; claiming a job is a
+single write transaction, so each job runs on one worker at a time.
+"""
+
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+JOBS_DB = os.getenv("JOBS_DB", "./jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_POLL_SECONDS = 1.0
+JOB_BACKOFF_BASE = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, run_at);
+"""
+
+
+class JobQueue:
+    def __init__(
+        self,
+        path: str = JOBS_DB,
+        workers: int = JOB_WORKERS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._handlers: dict[str, Callable[[dict, int], None]] = {}
+        self._threads: list[threading.Thread] = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def register(self, kind: str, handler: Callable[[dict, int], None]) -> None:
+        """``handler(payload, attempt)`` runs the job; raising schedules a retry."""
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind: str, payload: dict, delay: float = 0) -> str:
+        job_id = f"{uuid.uuid4()}"
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, run_at, created_at, updated_at)"
+                " VALUES (?, ?, ?, 'pending', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), now + delay, now, now),
+            )
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT id, kind, status, attempts, created_at, updated_at, last_error"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs"
+                " WHERE (status = 'pending' AND run_at <= ?)"
+                " OR (status = 'running' AND lease_until < ?)"
+                " ORDER BY run_at LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1,"
+                    " lease_until = ?, updated_at = ? WHERE id = ?",
+                    (now + JOB_LEASE_SECONDS, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None, run_at: float = 0):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, last_error = ?, run_at = MAX(run_at, ?),"
+                " lease_until = NULL, updated_at = ? WHERE id = ?",
+                (status, error, run_at, now, job_id),
+            )
+
+    def run_once(self) -> bool:
+        """Claim and run a single ready job; returns False if there was none."""
+        row = self._claim()
+        if row is None:
+            return False
+
+        attempt = row["attempts"] + 1
+        handler = self._handlers.get(row["kind"])
+        try:
+            if handler is None:
+                raise LookupError(f"no handler registered for {row['kind']!r}")
+            handler(json.loads(row["payload"]), attempt)
+        except Exception as e:
+            log.warning("Job %s (%s) attempt %d failed: %s", row["id"], row["kind"], attempt, e)
+            if attempt >= self.max_attempts:
+                self._finish(row["id"], "failed", str(e))
+            else:
+                delay = JOB_BACKOFF_BASE**attempt * random.uniform(0.5, 1.5)
+                self._finish(row["id"], "pending", str(e), run_at=time.time() + delay)
+        else:
+            self._finish(row["id"], "done")
+        return True
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                log.exception("Job worker error: %s", e)
+            self._wake.wait(JOB_POLL_SECONDS)
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"jobs-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5) -> None:
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
@@ -0,0 +1,245 @@
+"""Live feed of new metric samples, alerts and assessments, for server-sent events.
+
+Publishers call ``feed.publish(user_id, event, data)``. Every event goes to
+the patient's ``user:<id>`` topic and to ``all``, the whole-cohort topic the
+dashboard listens on. Each open ``/api/live`` stream is a ``Subscription``
+to some topics with its own bounded queue. A client that falls
+``LIVE_QUEUE_SIZE`` events behind loses the oldest ones, and the stream then
+sends an ``overflow`` event so it can refetch (cheap with ETag deltas). A slow
+client never blocks a publisher or the other subscribers.
+
+The last ``LIVE_REPLAY`` events are kept, so a reconnecting ``EventSource``
+picks up where it left off from its ``Last-Event-ID``.
+
+Fan-out is in-process. With several server processes (``shared=True``, i.e.
+gunicorn workers), events are appended to a SQLite table instead, and each
+process has a thread that polls it and fans the new rows out to its own
+subscribers. A sample stored by one worker then reaches streams held by all
+of them, at most ``LIVE_POLL_SECONDS`` later.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import closing
+from typing import Iterable, Iterator, Optional
+
+log = logging.getLogger(__name__)
+
+LIVE_DB = os.getenv("LIVE_DB", "./live.db")
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "256"))
+LIVE_REPLAY = int(os.getenv("LIVE_REPLAY", "1024"))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "100"))
+LIVE_POLL_SECONDS = 0.2
+# Comment sent on idle streams so proxies don't time them out
+LIVE_KEEPALIVE_SECONDS = 15.0
+# How long shared events stay in the table
+LIVE_RETENTION_SECONDS = 3600.0
+
+ALL_TOPIC = "all"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class FeedFull(Exception):
+    """Raised when the feed already has LIVE_MAX_SUBSCRIBERS streams open."""
+
+
+def user_topic(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+class Event:
+    def __init__(self, id: int, user_id: str, event: str, data: str):
+        self.id = id
+        self.user_id = user_id
+        self.event = event
+        self.data = data  # JSON
+        self.topics = (ALL_TOPIC, user_topic(user_id))
+
+    def frame(self) -> str:
+        return f"id: {self.id}\nevent: {self.event}\ndata: {self.data}\n\n"
+
+
+class Subscription:
+    def __init__(self, topics: Iterable[str], size: int):
+        self.topics = set(topics)
+        self._queue: deque[Event] = deque(maxlen=size)
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def wants(self, event: Event) -> bool:
+        return not self.topics.isdisjoint(event.topics)
+
+    def put(self, event: Event) -> None:
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(event)
+            self._cond.notify()
+
+    def take(self, timeout: float) -> tuple[list[Event], int]:
+        """Queued events and how many were dropped since the last call."""
+        with self._cond:
+            if not self._queue and not self.closed:
+                self._cond.wait(timeout)
+            events = list(self._queue)
+            self._queue.clear()
+            dropped, self.dropped = self.dropped, 0
+        return events, dropped
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class LiveFeed:
+    def __init__(
+        self,
+        shared: bool = False,
+        path: str = LIVE_DB,
+        queue_size: int = LIVE_QUEUE_SIZE,
+        max_subscribers: int = LIVE_MAX_SUBSCRIBERS,
+    ):
+        self.shared = shared
+        self.path = path
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: set[Subscription] = set()
+        self._recent: deque[Event] = deque(maxlen=LIVE_REPLAY)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._stopping = threading.Event()
+        self.published = 0
+        self.delivered = 0
+
+        if shared:
+            with closing(self._connect()) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def publish(self, user_id: str, event: str, data: dict) -> None:
+        """Send ``event`` to ``user_id``'s subscribers and the cohort's. Never raises."""
+        try:
+            body = json.dumps({"user_id": user_id, **data})
+            if self.shared:
+                with closing(self._connect()) as conn:
+                    conn.execute(
+                        "INSERT INTO events (user_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+                        (user_id, event, body, time.time()),
+                    )
+            else:
+                with self._lock:
+                    self._seq += 1
+                    seq = self._seq
+                self._deliver(Event(seq, user_id, event, body))
+            self.published += 1
+        except Exception as e:
+            log.warning("Failed to publish %s event for %s: %s", event, user_id, e)
+
+    def _deliver(self, event: Event) -> None:
+        with self._lock:
+            self._recent.append(event)
+            subscribers = [s for s in self._subscribers if s.wants(event)]
+        for subscription in subscribers:
+            subscription.put(event)
+        self.delivered += len(subscribers)
+
+    def subscribe(self, topics: Iterable[str], last_event_id: Optional[str] = None) -> Subscription:
+        """Open a subscription, first replaying recent events after ``last_event_id``.
+
+        Raises FeedFull when max_subscribers streams are already open.
+        """
+        subscription = Subscription(topics, self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise FeedFull(f"Live feed has {self.max_subscribers} subscribers")
+            if last_event_id is not None and last_event_id.isdigit():
+                for event in self._recent:
+                    if event.id > int(last_event_id) and subscription.wants(event):
+                        subscription.put(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.close()
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stream(self, subscription: Subscription) -> Iterator[str]:
+        """SSE frames for ``subscription`` until the client goes away."""
+        try:
+            yield "retry: 3000\n\n"
+            while not self._stopping.is_set():
+                events, dropped = subscription.take(LIVE_KEEPALIVE_SECONDS)
+                if subscription.closed:
+                    return
+                if dropped:
+                    yield f"event: overflow\ndata: {json.dumps({'dropped': dropped})}\n\n"
+                if events:
+                    yield "".join(event.frame() for event in events)
+                elif not dropped:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def _relay(self) -> None:
+        """Fan out rows other processes (and this one) appended to the shared table."""
+        with closing(self._connect()) as conn:
+            (last,) = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()
+        pruned_at = time.monotonic()
+        while not self._stopping.wait(LIVE_POLL_SECONDS):
+            try:
+                with closing(self._connect()) as conn:
+                    rows = conn.execute(
+                        "SELECT seq, user_id, event, data FROM events WHERE seq > ? ORDER BY seq",
+                        (last,),
+                    ).fetchall()
+                    if time.monotonic() - pruned_at > LIVE_RETENTION_SECONDS / 10:
+                        pruned_at = time.monotonic()
+                        conn.execute(
+                            "DELETE FROM events WHERE created_at < ?",
+                            (time.time() - LIVE_RETENTION_SECONDS,),
+                        )
+                for row in rows:
+                    self._deliver(Event(*row))
+                    last = row[0]
+            except Exception as e:
+                log.warning("Live feed relay failed: %s", e)
+
+    def start(self) -> None:
+        if self.shared:
+            threading.Thread(target=self._relay, name="live-relay", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscribers = len(self._subscribers)
+        return {
+            "subscribers": subscribers,
+            "published": self.published,
+            "delivered": self.delivered,
+        }
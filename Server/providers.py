@@ -0,0 +1,202 @@
+"""Shared HTTP clients for the upstream AI providers (Mistral, ElevenLabs).
+
+Each provider gets one pooled ``requests.Session`` so calls reuse warm TLS
+connections, a cap on concurrent requests, connect/read timeouts so a hung
+upstream can't hold a worker forever, and jittered exponential backoff on 429
+and 5xx responses (honouring ``Retry-After``). Every call is timed; per-provider
+counts and latencies are available from ``stats()``.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+load_dotenv("./.env")
+
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "5"))
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "3"))
+PROVIDER_BACKOFF_BASE = float(os.getenv("PROVIDER_BACKOFF_BASE", "0.5"))
+PROVIDER_BACKOFF_MAX = float(os.getenv("PROVIDER_BACKOFF_MAX", "8"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ProviderClient:
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        max_concurrency: int = 4,
+        read_timeout: float = 30,
+        connect_timeout: float = PROVIDER_CONNECT_TIMEOUT,
+        max_retries: int = PROVIDER_MAX_RETRIES,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+
+        self.session = self._new_session()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._completed = 0
+        self._errors = 0
+        self._retries = 0
+        self._in_flight = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._last_latency = 0.0
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def post(
+        self,
+        path: str,
+        *,
+        timeout: Optional[tuple[float, float]] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """POST to ``path`` with pooling, a concurrency slot, timeouts and retries.
+
+        Returns the final response (which may still be an error status once
+        retries are exhausted); raises ``requests.RequestException`` if the
+        provider could not be reached at all. For ``stream=True`` the slot is
+        held until the response headers arrive, not while the body is read.
+        """
+        return self.request("POST", path, timeout=timeout, **kwargs)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        timeout: Optional[tuple[float, float]] = None,
+        **kwargs,
+    ) -> requests.Response:
+        url = self.url(path)
+        attempt = 0
+        started = time.monotonic()
+        with self._lock:
+            self._calls += 1
+
+        while True:
+            response: Optional[requests.Response] = None
+            error: Optional[requests.RequestException] = None
+
+            with self._slots:
+                with self._lock:
+                    self._in_flight += 1
+                try:
+                    response = self.session.request(
+                        method, url, timeout=timeout or self.timeout, **kwargs
+                    )
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                finally:
+                    with self._lock:
+                        self._in_flight -= 1
+
+            retryable = error is not None or response.status_code in RETRY_STATUSES
+            if not retryable or attempt >= self.max_retries:
+                self._record(time.monotonic() - started, failed=retryable)
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self._backoff(attempt, response)
+            if response is not None:
+                response.close()
+            attempt += 1
+            with self._lock:
+                self._retries += 1
+            log.info("%s: retrying in %.2fs (attempt %d)", self.name, delay, attempt)
+            time.sleep(delay)
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def reset(self) -> None:
+        """Drop pooled connections and locks inherited across a fork."""
+        self.session = self._new_session()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @staticmethod
+    def _backoff(attempt: int, response: Optional[requests.Response]) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), PROVIDER_BACKOFF_MAX)
+                except ValueError:
+                    pass
+        # "Full jitter": spread retries from many workers across the window.
+        return random.uniform(0, min(PROVIDER_BACKOFF_MAX, PROVIDER_BACKOFF_BASE * 2**attempt))
+
+    def _record(self, latency: float, failed: bool) -> None:
+        with self._lock:
+            self._completed += 1
+            if failed:
+                self._errors += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+            self._last_latency = latency
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "errors": self._errors,
+                "retries": self._retries,
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "latency_avg_s": (
+                    self._latency_total / self._completed if self._completed else 0.0
+                ),
+                "latency_max_s": self._latency_max,
+                "latency_last_s": self._last_latency,
+            }
+
+
+mistral = ProviderClient(
+    "mistral",
+    os.getenv("MISTRAL_API_BASE", "https://api.mistral.ai/v1"),
+    max_concurrency=int(os.getenv("MISTRAL_MAX_CONCURRENCY", "4")),
+    read_timeout=float(os.getenv("MISTRAL_TIMEOUT", "30")),
+)
+
+elevenlabs = ProviderClient(
+    "elevenlabs",
+    os.getenv("ELEVENLABS_API_BASE", "https://api.elevenlabs.io/v1"),
+    max_concurrency=int(os.getenv("ELEVENLABS_MAX_CONCURRENCY", "4")),
+    read_timeout=float(os.getenv("ELEVENLABS_TIMEOUT", "30")),
+)
+
+PROVIDERS = {client.name: client for client in (mistral, elevenlabs)}
+
+
+def stats() -> dict:
+    return {name: client.stats() for name, client in PROVIDERS.items()}
+
+
+def reset() -> None:
+    """Give every provider fresh connections (call in a newly forked worker)."""
+    for client in PROVIDERS.values():
+        client.reset()
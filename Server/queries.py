@@ -0,0 +1,222 @@
+"""Reads against the document store: per-user queries and paged scans.
+
+Every collection that holds patient data carries the owning ``user_id`` in its
+metadata, so the filter is pushed down into the store as a ``where`` clause and
+only that patient's documents cross the wire. Documents written before the
+metadata carried ``user_id`` can't be matched that way; they are found through a
+local secondary index (``user_id -> [doc ids]``) that is built once per
+collection and then fetched by id.
+
+Whole-collection reads go through ``scan_collection``, which pulls the store a
+page at a time so callers can filter and stop early without holding every
+document in memory.
+"""
+
+import base64
+import heapq
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+# Collections whose document id *is* the user id.
+ID_KEYED_COLLECTIONS = {"patients"}
+
+# How many documents to pull from the store per round-trip.
+SCAN_PAGE_SIZE = int(os.getenv("SCAN_PAGE_SIZE", "500"))
+
+# Bounds for /fetch-patient-data pagination.
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# Margin on timestamp prefilters pushed into the store (see iter_window).
+WINDOW_SLACK = timedelta(days=1)
+
+_legacy_index: dict[str, dict[str, list[str]]] = {}
+_index_lock = threading.Lock()
+
+
+def decode_docs(docs: dict) -> list[dict]:
+    """Turn a raw ``collection.get`` result into ``{id, document, metadata}`` rows."""
+    ids = docs.get("ids") or []
+    documents = docs.get("documents") or [None] * len(ids)
+    metadatas = docs.get("metadatas") or [None] * len(ids)
+
+    data = []
+    for doc_id, doc, meta in zip(ids, documents, metadatas):
+        try:
+            document = json.loads(doc) if doc else {}
+        except json.JSONDecodeError:
+            document = {}
+        data.append({"id": doc_id, "document": document, "metadata": meta})
+    return data
+
+
+def _document_user_id(document: dict) -> Optional[str]:
+    user_id = document.get("user_id")
+    if user_id is None and isinstance(document.get("metrics"), dict):
+        user_id = document["metrics"].get("user_id")
+    return user_id
+
+
+def scan_collection(
+    collection, where: Optional[dict] = None, page_size: int = SCAN_PAGE_SIZE
+) -> Iterator[dict]:
+    """Yield decoded rows from ``collection``, reading the store one page at a time."""
+    offset = 0
+    while True:
+        page = collection.get(
+            where=where,
+            limit=page_size,
+            offset=offset,
+            include=["documents", "metadatas"],
+        )
+        rows = decode_docs(page)
+        yield from rows
+
+        if len(rows) < page_size:
+            return
+        offset += page_size
+
+
+def _build_legacy_index(collection) -> dict[str, list[str]]:
+    """Scan the collection once for documents without ``user_id`` metadata."""
+    index: dict[str, list[str]] = {}
+    for row in scan_collection(collection):
+        meta = row["metadata"] or {}
+        if meta.get("user_id"):
+            continue
+        user_id = _document_user_id(row["document"])
+        if user_id:
+            index.setdefault(user_id, []).append(row["id"])
+    return index
+
+
+def legacy_ids(collection, user_id: str) -> list[str]:
+    name = collection.name
+    with _index_lock:
+        if name not in _legacy_index:
+            _legacy_index[name] = _build_legacy_index(collection)
+        return list(_legacy_index[name].get(user_id, []))
+
+
+def fetch_user_documents(client, coll: str, user_id: str) -> list[dict]:
+    """Return only ``user_id``'s documents from ``coll``."""
+    if not user_id:
+        return []
+
+    collection = client.get_or_create_collection(name=coll)
+
+    if coll in ID_KEYED_COLLECTIONS:
+        return decode_docs(collection.get(ids=[user_id]))
+
+    rows = decode_docs(collection.get(where={"user_id": user_id}))
+
+    seen = {row["id"] for row in rows}
+    extra = [doc_id for doc_id in legacy_ids(collection, user_id) if doc_id not in seen]
+    if extra:
+        rows.extend(decode_docs(collection.get(ids=extra)))
+
+    return rows
+
+
+def parse_time(value: str) -> datetime:
+    """Parse an ISO timestamp into the naive local time the server stores.
+
+    Raises ValueError if ``value`` isn't ISO 8601.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def get_timestamp(doc: dict) -> datetime:
+    timestamp = doc.get("document", {}).get("timestamp")
+    if not isinstance(timestamp, str):
+        # If missing or invalid, return an extreme date
+        return datetime.min
+    try:
+        return parse_time(timestamp)
+    except ValueError:
+        # If timestamp is not ISO format, fallback
+        return datetime.min
+
+
+def encode_cursor(doc: dict) -> str:
+    key = [get_timestamp(doc).isoformat(), doc["id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """Raises ValueError on a malformed cursor."""
+    try:
+        timestamp, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(timestamp), str(doc_id)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+
+
+def iter_window(
+    collection,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Iterator[dict]:
+    """Stream rows whose timestamp falls in ``[since, until)``, in store order.
+
+    Stores that index timestamps prefilter on the stored ISO strings; the
+    bounds are widened by a day to allow for UTC offsets, and the exact
+    check below still decides.
+    """
+    where = None
+    if getattr(collection, "indexes_timestamps", False) and (since or until):
+        bounds = {}
+        if since is not None:
+            bounds["$gte"] = (since - WINDOW_SLACK).isoformat()
+        if until is not None:
+            bounds["$lt"] = (until + WINDOW_SLACK).isoformat()
+        where = {"timestamp": bounds}
+
+    for row in scan_collection(collection, where):
+        if since is None and until is None:
+            yield row
+            continue
+        ts = get_timestamp(row)
+        if since is not None and ts < since:
+            continue
+        if until is not None and ts >= until:
+            continue
+        yield row
+
+
+def page_collection(
+    collection,
+    limit: int = DEFAULT_PAGE_LIMIT,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> tuple[list[dict], Optional[str]]:
+    """Return the newest ``limit`` rows older than ``cursor`` and the next cursor.
+
+    The store can't sort, so rows are streamed through a heap that never holds
+    more than ``limit + 1`` entries.
+    """
+    limit = max(1, min(limit, MAX_PAGE_LIMIT))
+    after = decode_cursor(cursor) if cursor else None
+
+    heap: list[tuple[datetime, str, dict]] = []
+    for row in iter_window(collection, since, until):
+        key = (get_timestamp(row), row["id"])
+        if after is not None and key >= after:
+            continue
+        entry = (key[0], key[1], row)
+        if len(heap) <= limit:
+            heapq.heappush(heap, entry)
+        elif key > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+
+    newest = [entry[2] for entry in sorted(heap, key=lambda e: e[:2], reverse=True)]
+    page, rest = newest[:limit], newest[limit:]
+    next_cursor = encode_cursor(page[-1]) if rest else None
+    return page, next_cursor
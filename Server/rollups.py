@@ -0,0 +1,199 @@
+"""Incrementally maintained hourly/daily/weekly rollups of biometric series.
+
+For every (user, metric family, field) the count, sum, min and max of the
+samples in each hour, day and week are kept in SQLite and updated with an
+UPSERT as samples are ingested, so a long-range trend chart reads one row per
+bucket instead of replaying every raw sample.
+
+The store subscribes to the time-series store: appends are folded in, and a
+series that is rebuilt (backfilled) has its rollups recomputed from scratch.
+Buckets are wall-clock (naive) like the timestamps themselves; weeks start on
+Monday.
+"""
+
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from timeseries import FAMILIES, as_decimal, from_micros, to_micros
+
+ROLLUPS_DB = os.getenv("ROLLUPS_DB", "./rollups.db")
+
+HOUR = 3600 * 1_000_000
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+# 1970-01-01 was a Thursday; shift by three days so weeks start on Monday.
+WEEK_OFFSET = 3 * DAY
+
+RESOLUTIONS = ("hour", "day", "week")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    user_id TEXT NOT NULL,
+    family TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    field TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    PRIMARY KEY (user_id, family, resolution, field, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_series (
+    user_id TEXT NOT NULL,
+    family TEXT NOT NULL,
+    PRIMARY KEY (user_id, family)
+);
+"""
+
+UPSERT = """
+INSERT INTO rollups (user_id, family, resolution, field, bucket, count, total, min, max)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, family, resolution, field, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    total = total + excluded.total,
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max)
+"""
+
+
+def bucket_starts(ts: np.ndarray, resolution: str) -> np.ndarray:
+    """Start of the bucket each microsecond timestamp falls into."""
+    if resolution == "hour":
+        return ts // HOUR * HOUR
+    if resolution == "day":
+        return ts // DAY * DAY
+    if resolution == "week":
+        return (ts + WEEK_OFFSET) // WEEK * WEEK - WEEK_OFFSET
+    raise ValueError(f"Unknown resolution: {resolution}")
+
+
+def aggregate(user_id: str, family: str, records: np.ndarray) -> list[tuple]:
+    """UPSERT rows summarizing ``records`` at every resolution."""
+    rows = []
+    if not len(records):
+        return rows
+    for resolution in RESOLUTIONS:
+        buckets, inverse = np.unique(
+            bucket_starts(records["ts"], resolution), return_inverse=True
+        )
+        for field in FAMILIES[family]:
+            values = as_decimal(records[field])
+            valid = ~np.isnan(values)
+            if not valid.any():
+                continue
+            index, values = inverse[valid], values[valid]
+            count = np.bincount(index, minlength=len(buckets))
+            total = np.bincount(index, weights=values, minlength=len(buckets))
+            low = np.full(len(buckets), np.inf)
+            high = np.full(len(buckets), -np.inf)
+            np.minimum.at(low, index, values)
+            np.maximum.at(high, index, values)
+            for i in np.flatnonzero(count):
+                rows.append(
+                    (
+                        user_id,
+                        family,
+                        resolution,
+                        field,
+                        int(buckets[i]),
+                        int(count[i]),
+                        float(total[i]),
+                        float(low[i]),
+                        float(high[i]),
+                    )
+                )
+    return rows
+
+
+class RollupStore:
+    def __init__(self, path: str = ROLLUPS_DB):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def apply(self, user_id: str, family: str, records: np.ndarray, replace: bool) -> None:
+        """Time-series listener: fold in appended records, or rebuild from all of them."""
+        rows = aggregate(user_id, family, records)
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if replace:
+                    conn.execute(
+                        "DELETE FROM rollups WHERE user_id = ? AND family = ?",
+                        (user_id, family),
+                    )
+                    conn.execute(
+                        "INSERT OR IGNORE INTO rollup_series (user_id, family) VALUES (?, ?)",
+                        (user_id, family),
+                    )
+                conn.executemany(UPSERT, rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def is_built(self, user_id: str, family: str) -> bool:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM rollup_series WHERE user_id = ? AND family = ?",
+                (user_id, family),
+            ).fetchone()
+        return row is not None
+
+    def invalidate(self, user_id: str, family: str) -> None:
+        """Force a rebuild before the series' rollups are next read."""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "DELETE FROM rollup_series WHERE user_id = ? AND family = ?",
+                (user_id, family),
+            )
+
+    def query(
+        self,
+        user_id: str,
+        family: str,
+        resolution: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> dict[str, list[dict]]:
+        """``{field: [{bucket, count, mean, min, max}, ...]}``, oldest bucket first.
+
+        ``since`` includes the bucket it falls in; ``until`` is exclusive.
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of: {', '.join(RESOLUTIONS)}")
+        lo = np.iinfo(np.int64).min
+        if since is not None:
+            lo = int(bucket_starts(np.array([to_micros(since)]), resolution)[0])
+        hi = to_micros(until) if until is not None else np.iinfo(np.int64).max
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT field, bucket, count, total, min, max FROM rollups"
+                " WHERE user_id = ? AND family = ? AND resolution = ?"
+                " AND bucket >= ? AND bucket < ? ORDER BY field, bucket",
+                (user_id, family, resolution, int(lo), int(hi)),
+            ).fetchall()
+
+        series: dict[str, list[dict]] = {field: [] for field in FAMILIES[family]}
+        for field, bucket, count, total, low, high in rows:
+            series.setdefault(field, []).append(
+                {
+                    "bucket": from_micros(bucket).isoformat(),
+                    "count": count,
+                    "mean": total / count,
+                    "min": low,
+                    "max": high,
+                }
+            )
+        return series
@@ -0,0 +1,408 @@
+"""Local semantic search over stored conversations.
+
+Each conversation record is split into passages (its summary and each Q&A
+turn), embedded on the CPU and written to SQLite. Search runs against an
+in-memory inverted-file (IVF) index over those vectors: passages are grouped
+under k-means centroids and a query only scores the passages in its
+``SEARCH_PROBES`` nearest groups, so a lookup touches a small fraction of the
+corpus. A search filtered by patient or time probes more groups until the
+filter leaves ``k`` matches. Below ``IVF_MIN_TRAIN`` passages an exact scan is cheaper and is used
+instead.
+
+Embeddings come from ``sentence-transformers`` when it is installed (model
+``EMBEDDING_MODEL``). Without it, or with ``EMBEDDING_MODEL=hashing``, a
+dependency-free hashed bag-of-words embedder is used: it matches on shared
+words rather than meaning, but keeps the pipeline working offline. Passages
+are stored per embedder, so switching models re-embeds on the next backfill
+rather than mixing vector spaces.
+
+Every process loads the passages table into its own index and picks up rows
+written by other processes before each search.
+"""
+
+import html
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from contextlib import closing
+from datetime import datetime
+from typing import Iterable, Optional
+
+import numpy as np
+
+from queries import parse_time
+from timeseries import from_micros, to_micros
+
+log = logging.getLogger(__name__)
+
+SEARCH_DB = os.getenv("SEARCH_DB", "./search.db")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = 64
+HASH_DIM = 1024
+
+# Exact search below this many passages; IVF above it.
+IVF_MIN_TRAIN = int(os.getenv("IVF_MIN_TRAIN", "2048"))
+SEARCH_PROBES = int(os.getenv("SEARCH_PROBES", "8"))
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50000
+
+SNIPPET_CHARS = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS passages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    user_id TEXT,
+    name TEXT,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    timestamp INTEGER,
+    vector BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS passages_record ON passages (model, record_id);
+"""
+
+_TAG = re.compile(r"<[^>]+>")
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def strip_html(text: str) -> str:
+    return re.sub(r"\s+", " ", html.unescape(_TAG.sub(" ", text or ""))).strip()
+
+
+def record_passages(document: dict) -> list[tuple[str, str]]:
+    """``(kind, text)`` passages for one patient_records document."""
+    passages = []
+    summary = strip_html(document.get("summary") or "")
+    if summary:
+        passages.append(("summary", summary))
+    for turn in document.get("history") or []:
+        if not isinstance(turn, dict):
+            continue
+        question = (turn.get("question") or "").strip()
+        answer = (turn.get("answer") or "").strip()
+        if answer:
+            passages.append(("turn", f"Q: {question}\nA: {answer}"))
+    return passages
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and word pairs, L2-normalized."""
+
+    name = f"hashing-{HASH_DIM}"
+    dim = HASH_DIM
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORD.findall(text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        # Dampen repeated words so one long answer doesn't dominate.
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = f"st-{model_name}"
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = self.model.encode(
+            texts,
+            batch_size=EMBED_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        )
+        return vectors.astype(np.float32)
+
+
+def load_embedder():
+    if EMBEDDING_MODEL != "hashing":
+        try:
+            return SentenceTransformerEmbedder(EMBEDDING_MODEL)
+        except Exception as e:
+            log.warning(
+                "Falling back to the hashing embedder; search will match words, not meaning: %s", e
+            )
+    return HashingEmbedder()
+
+
+class SemanticIndex:
+    def __init__(self, path: str = SEARCH_DB, embedder=None):
+        self.path = path
+        self._embedder = embedder
+        self._lock = threading.RLock()
+
+        self._loaded_id = 0
+        self._size = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._timestamps = np.empty(0, dtype=np.int64)
+        self._meta: list[tuple[str, Optional[str], Optional[str], str, str]] = []
+
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: list[list[int]] = []
+        self._trained_size = 0
+
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @property
+    def embedder(self):
+        with self._lock:
+            if self._embedder is None:
+                self._embedder = load_embedder()
+            return self._embedder
+
+    def indexed_records(self) -> set[str]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT record_id FROM passages WHERE model = ?",
+                (self.embedder.name,),
+            ).fetchall()
+        return {record_id for (record_id,) in rows}
+
+    def _existing(self, conn: sqlite3.Connection, record_ids: list[str]) -> set[str]:
+        existing = set()
+        for i in range(0, len(record_ids), 500):
+            chunk = record_ids[i : i + 500]
+            rows = conn.execute(
+                "SELECT DISTINCT record_id FROM passages WHERE model = ?"
+                f" AND record_id IN ({','.join('?' * len(chunk))})",
+                (self.embedder.name, *chunk),
+            ).fetchall()
+            existing.update(record_id for (record_id,) in rows)
+        return existing
+
+    def add_records(self, records: Iterable[tuple[str, dict, dict]]) -> int:
+        """Embed and store ``(record_id, document, metadata)`` records.
+
+        Records that are already indexed under the current embedder are
+        skipped, so a retried job doesn't index a conversation twice. Returns
+        the number of passages added.
+        """
+        embedder = self.embedder
+        records = list(records)
+        with closing(self._connect()) as conn:
+            done = self._existing(conn, [record_id for record_id, _, _ in records])
+
+        rows, texts = [], []
+        for record_id, document, metadata in records:
+            if record_id in done:
+                continue
+            metadata = metadata or {}
+            user_id = metadata.get("user_id") or document.get("user_id")
+            timestamp = None
+            try:
+                timestamp = to_micros(parse_time(document.get("timestamp")))
+            except (TypeError, ValueError):
+                pass
+            for kind, text in record_passages(document):
+                rows.append((record_id, user_id, metadata.get("name"), kind, text, timestamp))
+                texts.append(text)
+        if not rows:
+            return 0
+
+        vectors = np.concatenate(
+            [
+                embedder.embed(texts[i : i + EMBED_BATCH_SIZE])
+                for i in range(0, len(texts), EMBED_BATCH_SIZE)
+            ]
+        )
+
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another worker may have indexed some of these meanwhile.
+                raced = self._existing(conn, list({row[0] for row in rows}))
+                added = [
+                    (embedder.name, *row, vector.tobytes())
+                    for row, vector in zip(rows, vectors)
+                    if row[0] not in raced
+                ]
+                conn.executemany(
+                    "INSERT INTO passages"
+                    " (model, record_id, user_id, name, kind, text, timestamp, vector)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    added,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        self.refresh()
+        return len(added)
+
+    def refresh(self) -> None:
+        """Load passages written since the last refresh (by any process)."""
+        embedder = self.embedder
+        with self._lock:
+            with closing(self._connect()) as conn:
+                rows = conn.execute(
+                    "SELECT id, record_id, user_id, name, kind, text, timestamp, vector"
+                    " FROM passages WHERE model = ? AND id > ? ORDER BY id",
+                    (embedder.name, self._loaded_id),
+                ).fetchall()
+            if not rows:
+                return
+
+            self._loaded_id = rows[-1][0]
+            new = np.stack([np.frombuffer(row[7], dtype=np.float32) for row in rows])
+            self._append(new, rows)
+
+            if self._centroids is None:
+                if self._size >= IVF_MIN_TRAIN:
+                    self._train()
+            elif self._size >= 2 * self._trained_size:
+                self._train()
+            else:
+                start = self._size - len(rows)
+                nearest = np.argmax(new @ self._centroids.T, axis=1)
+                for offset, centroid in enumerate(nearest):
+                    self._lists[centroid].append(start + offset)
+
+    def _append(self, vectors: np.ndarray, rows: list[tuple]) -> None:
+        needed = self._size + len(vectors)
+        if self._vectors is None or needed > len(self._vectors):
+            capacity = max(needed, 2 * (len(self._vectors) if self._vectors is not None else 512))
+            grown = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+            times = np.zeros(capacity, dtype=np.int64)
+            if self._vectors is not None:
+                grown[: self._size] = self._vectors[: self._size]
+                times[: self._size] = self._timestamps[: self._size]
+            self._vectors, self._timestamps = grown, times
+
+        self._vectors[self._size : needed] = vectors
+        self._timestamps[self._size : needed] = [
+            row[6] if row[6] is not None else np.iinfo(np.int64).min for row in rows
+        ]
+        self._meta.extend((row[1], row[2], row[3], row[4], row[5]) for row in rows)
+        self._size = needed
+
+    def _train(self) -> None:
+        """Spherical k-means over (a sample of) the passages, then assign them all."""
+        vectors = self._vectors[: self._size]
+        nlist = int(np.clip(np.sqrt(self._size), 16, 4096))
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(self._size, min(self._size, KMEANS_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            centroids[~empty] = sums[~empty] / norms[~empty]
+
+        assign = np.empty(self._size, dtype=np.int64)
+        for start in range(0, self._size, 8192):
+            block = vectors[start : start + 8192]
+            assign[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        self._lists = [order[bounds[i] : bounds[i + 1]].tolist() for i in range(nlist)]
+        self._centroids = centroids
+        self._trained_size = self._size
+
+    def _filter(
+        self, candidates: np.ndarray, since: Optional[datetime], user_id: Optional[str]
+    ) -> np.ndarray:
+        if since is not None:
+            candidates = candidates[self._timestamps[candidates] >= to_micros(since)]
+        if user_id is not None:
+            candidates = np.array(
+                [i for i in candidates if self._meta[i][1] == user_id], dtype=np.int64
+            )
+        return candidates
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        since: Optional[datetime] = None,
+        user_id: Optional[str] = None,
+    ) -> list[dict]:
+        """Best-matching conversations for ``query``, one hit per record."""
+        self.refresh()
+        q = self.embedder.embed([query])[0]
+
+        with self._lock:
+            if self._size == 0:
+                return []
+            if self._centroids is None:
+                candidates = self._filter(np.arange(self._size), since, user_id)
+            else:
+                ranked = np.argsort(-(self._centroids @ q))
+                probes = SEARCH_PROBES
+                while True:
+                    probed = np.fromiter(
+                        (i for p in ranked[:probes] for i in self._lists[p]), dtype=np.int64
+                    )
+                    candidates = self._filter(probed, since, user_id)
+                    # A filter can leave the nearest lists short of k records;
+                    # probe twice as many until it doesn't (or all are probed)
+                    if (
+                        (since is None and user_id is None)
+                        or probes >= len(ranked)
+                        or len({self._meta[i][0] for i in candidates}) >= k
+                    ):
+                        break
+                    probes *= 2
+            if len(candidates) == 0:
+                return []
+
+            scores = self._vectors[candidates] @ q
+            order = np.argsort(-scores)
+
+            hits, seen = [], set()
+            for position in order:
+                index = candidates[position]
+                record_id, owner, name, kind, text = self._meta[index]
+                if record_id in seen:
+                    continue
+                seen.add(record_id)
+                ts = self._timestamps[index]
+                hits.append(
+                    {
+                        "record_id": record_id,
+                        "user_id": owner,
+                        "name": name,
+                        "kind": kind,
+                        "text": text[:SNIPPET_CHARS],
+                        "timestamp": (
+                            from_micros(ts).isoformat()
+                            if ts != np.iinfo(np.int64).min
+                            else None
+                        ),
+                        "score": float(scores[position]),
+                    }
+                )
+                if len(hits) >= k:
+                    break
+            return hits
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "embedder": self._embedder.name if self._embedder else None,
+                "passages": self._size,
+                "ivf_lists": len(self._lists) if self._centroids is not None else 0,
+            }
@@ -1,57 +1,227 @@
 import base64
+import gc
+import itertools
 import json
+import logging
 import os
+import threading
 import uuid
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from io import BytesIO
-from typing import Optional
+from typing import Callable, Iterable, Iterator, Optional
+from urllib.parse import quote
 
-import chromadb
-import google.generativeai as genai
-import requests
-import whisper
 from dotenv import load_dotenv
-from flask import Flask, Response, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-from twilio.rest import Client
-from ai_analysis import generate_crisis_plan
-
+from components import components
+from ai_analysis import get_crisis_plan
+from audio import decode_audio
+from identity import IdentityIndex
+from detector import AnomalyDetector, threshold_critical
+from jobs import JobQueue
+from live import ALL_TOPIC, FeedFull, LiveFeed, user_topic
+from speech_pipeline import SpeechRelay, speak
+from storage import open_store
+from http_cache import init_compression, not_modified, parse_version, with_etag
+from telemetry import REGISTRY, InstrumentedStore, configure_logging, init_app, span, traced_iter
+from write_buffer import BufferFull, WriteBuffer
+from tts_cache import SpeechCache, cache_key
+from transcription import QueueFull, TranscriptionService
+import providers
+from providers import elevenlabs, mistral
+from queries import (
+    DEFAULT_PAGE_LIMIT,
+    decode_docs,
+    fetch_user_documents,
+    get_timestamp,
+    iter_window,
+    page_collection,
+    parse_time,
+    scan_collection,
+)
+from rollups import RESOLUTIONS, RollupStore
+from semantic_search import SemanticIndex
+from sessions import SessionStore
+from timeseries import (
+    FAMILIES,
+    TimeSeriesStore,
+    as_points,
+    as_rows,
+    encode,
+    is_storable_id,
+    window,
+)
+from versions import VersionLog, VersionedStore
 
-whispr_model = whisper.load_model("base")
 
 app = Flask(__name__)
 CORS(app)
 
+configure_logging()
+# Request ids, access logs and /metrics
+init_app(app)
+# gzip/brotli for large JSON bodies
+init_compression(app)
+log = logging.getLogger(__name__)
+
 load_dotenv("./.env")
 
-CHROMA_API_KEY = os.getenv("CHROMA_API_KEY")
-CHROMA_TENANT = os.getenv("CHROMA_TENANT")
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completion s"
+# Optional Gemini endpoint override (e.g. the local stand-in in bench/)
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE")
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE_ID = os.getenv(
     "ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM"
 )  # default voice ID
+ELEVENLABS_MODEL_ID = "eleven_monolingual_v1"
+ELEVENLABS_VOICE_SETTINGS = {"stability": 0.5, "similarity_boost": 0.5}
+
+# Audio formats a client may ask for with ?codec=. Only MP3 variants are
+# offered because per-sentence clips are concatenated frame by frame.
+DEFAULT_AUDIO_FORMAT = "mp3_44100_128"
+AUDIO_FORMATS = {
+    "mp3_22050_32",
+    "mp3_44100_32",
+    "mp3_44100_64",
+    "mp3_44100_96",
+    "mp3_44100_128",
+    "mp3_44100_192",
+}
+AUDIO_FORMAT_ALIASES = {"compact": "mp3_22050_32", "default": DEFAULT_AUDIO_FORMAT}
+AUDIO_CHUNK_SIZE = 4096
+
+# Spoken to the watch when /alert_status detects a critical state
+ALERT_GREETING = """Hi, I'm an AI therapist. I've noticed that you've been having some mood swings.
+            Can you tell me how you are feeling right now?"""
+
+# Newline-separated prompts to synthesize into the speech cache at startup
+TTS_PREWARM_FILE = os.getenv("TTS_PREWARM_FILE")
+# Warm-up components that serve spoken assessments; the speech cache is
+# prewarmed only alongside them
+SPEECH_COMPONENTS = {"whisper", "gemini"}
+
+# Set by gunicorn.conf.py: this process is a preloading parent that loads the
+# models and then forks the workers (see after_fork)
+PREFORK = os.getenv("PREFORK") == "1"
 
 TWILIO_SID = os.getenv("TWILIO_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
-TWILIO_CLIENT = Client(TWILIO_SID, TWILIO_AUTH_TOKEN)
-
-chroma_client = chromadb.HttpClient(
-    ssl=True,
-    host="api.trychroma.com",
-    tenant=CHROMA_TENANT,
-    database="Treehacks25",
-    headers={"x-chroma-token": CHROMA_API_KEY},
+
+
+def create_twilio_client():
+    from twilio.rest import Client
+
+    return Client(TWILIO_SID, TWILIO_AUTH_TOKEN)
+
+
+def create_gemini_model():
+    import google.generativeai as genai
+
+    if GEMINI_API_BASE:
+        genai.configure(
+            api_key=GEMINI_API_KEY,
+            transport="rest",
+            client_options={"api_endpoint": GEMINI_API_BASE},
+        )
+    else:
+        genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel("gemini-2.0-flash")
+
+
+# Slow-to-build clients and models are created on first use, or up front by
+# the warm-up phase at the bottom of this file (see components.py).
+# No route sends texts yet, so Twilio isn't warmed up (or gating readiness)
+TWILIO_CLIENT = components.register("twilio", create_twilio_client, warm=False)
+gemini_model = components.register("gemini", create_gemini_model)
+
+# Every document written is logged with a version number, so reads can
+# answer 304s and deltas (see versions.py)
+versions = VersionLog()
+
+# Chroma, or the embedded SQLite store (STORAGE_BACKEND=sqlite); every
+# collection call is traced per collection
+store = components.register(
+    "store", lambda: VersionedStore(InstrumentedStore(open_store()), versions)
 )
+# Metric samples are written to the store in batches by a background thread
+write_buffer = WriteBuffer(store)
+
+transcriber = TranscriptionService()
+
+
+def load_whisper() -> TranscriptionService:
+    transcriber.warm(wait=True)
+    return transcriber
+
+
+components.register("whisper", load_whisper)
+
+speech_cache = SpeechCache()
+
+timeseries = TimeSeriesStore()
+rollups = RollupStore()
+detector = AnomalyDetector()
+
+
+def update_rollups(user_id: str, family: str, records, replace: bool) -> None:
+    try:
+        rollups.apply(user_id, family, records, replace)
+    except Exception as e:
+        log.warning("Failed to update %s rollups for %s: %s", family, user_id, e)
+        rollups.invalidate(user_id, family)
+
+
+timeseries.subscribe(update_rollups)
+
+# Server-sent events for the dashboard; shared between gunicorn workers
+feed = LiveFeed(shared=PREFORK)
+
+
+def publish_samples(user_id: str, family: str, records, replace: bool) -> None:
+    # A rebuild re-reads samples that were already published
+    if not replace:
+        feed.publish(
+            user_id, "metric", {"family": family, "samples": as_rows(records, FAMILIES[family])}
+        )
+
+
+timeseries.subscribe(publish_samples)
+
+job_queue = JobQueue()
+
+# Spoken assessments in progress (see sessions.py)
+sessions = SessionStore()
+
+search_index = SemanticIndex()
+
+identity_index = IdentityIndex(store)
+components.register("identity_index", identity_index.warm)
+components.register("embedder", lambda: search_index.embedder)
 
 
 @app.route("/api/health", methods=["GET"])
+@app.route("/api/health/live", methods=["GET"])
 def health() -> tuple[Response, int]:
+    """Liveness: the process is up and serving requests."""
     return jsonify({"message": "Success"}), 200
 
+
+@app.route("/api/health/ready", methods=["GET"])
+def readiness() -> tuple[Response, int]:
+    """Readiness: warm-up has finished and everything it built is usable."""
+    report = components.report()
+    return jsonify({"ready": report["ready"], "components": report["components"]}), (
+        200 if report["ready"] else 503
+    )
+
+
+@app.route("/api/startup", methods=["GET"])
+def startup_report() -> tuple[Response, int]:
+    return jsonify(components.report()), 200
+
 # Generating the crisis plan and saving to ChromaDB
 @app.route("/api/generate-crisis-plan", methods=["POST"])
 def generate_crisis():
@@ -64,8 +234,8 @@ def generate_crisis():
         biometric_data = data["biometric_data"]
         behavioral_summary = data["behavioral_summary"]
 
-        # Generate Crisis Plan
-        crisis_plan = generate_crisis_plan(biometric_data, behavioral_summary)
+        # Generate Crisis Plan (reused while the inputs are unchanged)
+        crisis_plan, cached = get_crisis_plan(biometric_data, behavioral_summary)
 
         # Ensure AI response is valid JSON
         if isinstance(crisis_plan, str):
@@ -76,7 +246,7 @@ def generate_crisis():
                 return jsonify({"error": "Invalid AI-generated JSON response"}), 500
 
         # Store in ChromaDB
-        # collection = chroma_client.get_or_create_collection(name="patient_records")
+        # collection = store.get_or_create_collection(name="patient_records")
         # document_id = f"crisis_plan_{biometric_data['userEmail']}_{datetime.now().isoformat()}"
 
         # collection.add(
@@ -85,81 +255,125 @@ def generate_crisis():
         #     metadatas=[{"userEmail": biometric_data["userEmail"], "timestamp": datetime.now().isoformat()}],
         # )
 
-        return jsonify({"success": True, "crisis_plan": crisis_plan}), 200
+        response = jsonify({"success": True, "crisis_plan": crisis_plan})
+        response.headers["X-Cache"] = "HIT" if cached else "MISS"
+        return response, 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def transcribe(audio_file) -> str:
-    try:
-        # Save the file temporarily
-        temp_filename = f"{uuid.uuid4()}.wav"
-        audio_file.save(temp_filename)
+def transcribe(audio_file, timeout: Optional[float] = None) -> str:
+    """Transcribe an uploaded file on the worker pool.
 
-        # Perform transcription
-        result = whispr_model.transcribe(temp_filename)
+    The upload is decoded in memory; nothing is written to disk. QueueFull and
+    TimeoutError propagate so the caller can shed load, and BrokenProcessPool
+    (the pool died again right after being replaced) so it is reported
+    rather than read as silence; any other failure yields an empty transcript.
+    """
+    with span("transcribe") as current:
+        try:
+            with span("decode_audio"):
+                samples = decode_audio(audio_file.read())
+            # Loads the model here if warm-up skipped it (or is still loading it)
+            components.get("whisper")
+            return transcriber.transcribe(samples, timeout=timeout)
 
-        # Remove temporary file
-        os.remove(temp_filename)
+        except (QueueFull, TimeoutError):
+            raise
+        except BrokenProcessPool:
+            current.failed = True
+            raise
+        except Exception as e:
+            log.exception("Transcription failed: %s", e)
+            current.failed = True
+            return ""
 
-        return result["text"]
 
-    except Exception as e:
-        print(e)
-        return ""
+def prewarm_speech_cache() -> None:
+    prompts = [ALERT_GREETING]
+    if TTS_PREWARM_FILE:
+        try:
+            with open(TTS_PREWARM_FILE) as f:
+                prompts += [line.strip() for line in f if line.strip()]
+        except OSError as e:
+            log.warning("Failed to read TTS prewarm file: %s", e)
+    log.info("Speech cache prewarmed: %d prompts", speech_cache.prewarm(prompts, synthesize_speech))
 
 
-def get_qa_analysis(qa: list[dict]) -> Optional[str]:
-    try:
-        if len(qa) == 0:
-            print("qa is length 0")
-            return None
+@app.route("/api/providers/stats", methods=["GET"])
+def provider_stats() -> tuple[Response, int]:
+    return jsonify(providers.stats()), 200
 
-        conversation = ""
-        for convo in qa:
-            if not convo or not isinstance(convo, dict):
-                continue
 
-            question = convo.get("question", "")
-            answer = convo.get("answer", "")
-            conversation += f"Q: {question}\nA: {answer}\n"
+@app.route("/api/tts-cache/stats", methods=["GET"])
+def tts_cache_stats() -> tuple[Response, int]:
+    return jsonify(speech_cache.stats()), 200
 
-        headers = {
-            "Authorization": f"Bearer {MISTRAL_API_KEY}",
-            "Content-Type": "application/json",
-        }
 
-        payload = {
-            "model": "mistral-small-latest",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a helpful medical assistant. Summarize the patient interview. Provide responses in HTML only without markdown or additional formatting.",
-                },
-                {
-                    "role": "user",
-                    "content": f"Here is a patient interview Q&A:\n{conversation}\n\nPlease summarize it clearly and concisely.\n\nPlease summarize it clearly and concisely in HTML.",
-                },
-            ],
-            "temperature": 0.7,
-            "max_tokens": 300,
-            "top_p": 1,
-            "frequency_penalty": 0,
-            "presence_penalty": 0,
-        }
+@app.route("/api/write-buffer/stats", methods=["GET"])
+def write_buffer_stats() -> tuple[Response, int]:
+    return jsonify(write_buffer.stats()), 200
 
-        response = requests.post(MISTRAL_API_URL, headers=headers, json=payload)
-        response_data = response.json()
 
-        if "choices" in response_data and len(response_data["choices"]) > 0:
-            summary = response_data["choices"][0]["message"]["content"]
-            return summary.strip("```").replace("\n", "").strip("html")
-        else:
-            return None
+@app.route("/api/transcription/stats", methods=["GET"])
+def transcription_stats() -> tuple[Response, int]:
+    return jsonify(transcriber.stats()), 200
 
-    except Exception as e:
-        print(e)
-        return None
+
+def get_qa_analysis(qa: list[dict]) -> Optional[str]:
+    with span("get_qa_analysis") as current:
+        try:
+            if len(qa) == 0:
+                log.warning("get_qa_analysis called with an empty conversation")
+                return None
+
+            conversation = ""
+            for convo in qa:
+                if not convo or not isinstance(convo, dict):
+                    continue
+
+                question = convo.get("question", "")
+                answer = convo.get("answer", "")
+                conversation += f"Q: {question}\nA: {answer}\n"
+
+            headers = {
+                "Authorization": f"Bearer {MISTRAL_API_KEY}",
+                "Content-Type": "application/json",
+            }
+
+            payload = {
+                "model": "mistral-small-latest",
+                "messages": [
+                    {
+                        "role": "system",
+                        "content": "You are a helpful medical assistant. Summarize the patient interview. Provide responses in HTML only without markdown or additional formatting.",
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Here is a patient interview Q&A:\n{conversation}\n\nPlease summarize it clearly and concisely.\n\nPlease summarize it clearly and concisely in HTML.",
+                    },
+                ],
+                "temperature": 0.7,
+                "max_tokens": 300,
+                "top_p": 1,
+                "frequency_penalty": 0,
+                "presence_penalty": 0,
+            }
+
+            response = mistral.post("/chat/completions", headers=headers, json=payload)
+            response_data = response.json()
+
+            if "choices" in response_data and len(response_data["choices"]) > 0:
+                summary = response_data["choices"][0]["message"]["content"]
+                return summary.strip("```").replace("\n", "").strip("html")
+            else:
+                current.failed = True
+                return None
+
+        except Exception as e:
+            log.exception("Conversation summary failed: %s", e)
+            current.failed = True
+            return None
 
 
 def create_or_upload_user(email: str, name: str) -> tuple[str, int]:
@@ -167,114 +381,449 @@ def create_or_upload_user(email: str, name: str) -> tuple[str, int]:
         if not email or not name:
             return "", 404
 
-        docs = fetch_collection("patients")
-
-        collection = chroma_client.get_or_create_collection(name="patients")
-
-        for doc in docs:
-            print("DOOOOOOC:::::::::", doc)
-            print("  ")
-            print("  ")
-            print("  ")
-            # if email == doc["document"]["email"] and name == doc["document"]["name"]:
-            if email == doc["document"].get("email", "jodoe@gmail.com") and name == doc[
-                "document"
-            ].get("name", "John Doe"):
-                return doc["id"], 200
-
-        new_id = f"{uuid.uuid4()}"
-        collection.add(
-            ids=[new_id],
-            documents=[json.dumps({"name": name, "email": email})],
-        )
-
-        return new_id, 201
+        user_id, created = identity_index.resolve(email, name)
+        return user_id, 201 if created else 200
 
     except Exception as e:
-        print("Failed to upload data", e)
+        log.exception("Failed to resolve patient: %s", e)
         return "", 500
 
 
-def upload(history: list[dict], metadata: dict) -> bool:
+def upload(history: list[dict], metadata: dict) -> Optional[str]:
+    """Queue a finished conversation to be summarized and stored.
+
+    Resolves the patient right away (a cached lookup) so ``metadata`` carries
+    the user_id; returns the background job id, or None if nothing was queued.
+    """
     try:
         if not history:
-            return False
-
-        collection = chroma_client.get_or_create_collection(name="patient_records")
-
-        document = {
-            "history": history,
-            "summary": get_qa_analysis(history),
-            "timestamp": datetime.now().isoformat(),
-        }
+            return None
 
         user_id, status = create_or_upload_user(metadata["email"], metadata["name"])
         if status >= 200 and status < 300:
             metadata["user_id"] = user_id
 
-        collection.add(
-            ids=[f"{uuid.uuid4()}"],
-            documents=[json.dumps(document)],
-            metadatas=[metadata],
+        return job_queue.enqueue(
+            "upload_conversation",
+            {
+                "record_id": f"{uuid.uuid4()}",
+                "history": history,
+                "metadata": metadata,
+                "timestamp": datetime.now().isoformat(),
+            },
         )
 
-        return True
-
     except Exception as e:
-        print("Failed to upload data", e)
-        return False
+        log.exception("Failed to queue conversation upload: %s", e)
+        return None
 
 
-def text_to_speech(text: str) -> Optional[str]:
-    """Convert text to speech using 11labs API and return base64 encoded audio"""
+def upload_conversation_job(payload: dict, attempt: int) -> None:
+    """Background half of upload(): summarize with Mistral and write the record."""
+    history = payload["history"]
+    summary = get_qa_analysis(history)
+    if summary is None and attempt < job_queue.max_attempts:
+        raise RuntimeError("conversation summary failed")
+
+    document = {
+        "history": history,
+        "summary": summary,
+        "timestamp": payload["timestamp"],
+    }
+
+    collection = store.get_or_create_collection(name="patient_records")
+    # The record id is fixed when the job is queued, so a retry after a
+    # partial failure can't store the conversation twice.
+    collection.add(
+        ids=[payload["record_id"]],
+        documents=[json.dumps(document)],
+        metadatas=[payload["metadata"]],
+    )
+
     try:
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
+        search_index.add_records([(payload["record_id"], document, payload["metadata"])])
+    except Exception as e:
+        # The backfill job picks up anything that didn't get indexed here.
+        log.warning("Failed to index conversation for search: %s", e)
 
-        headers = {
-            "Accept": "audio/mpeg",
-            "Content-Type": "application/json",
-            "xi-api-key": ELEVENLABS_API_KEY,
-        }
+    if payload["metadata"].get("user_id"):
+        feed.publish(
+            payload["metadata"]["user_id"],
+            "assessment",
+            {
+                "record_id": payload["record_id"],
+                "timestamp": payload["timestamp"],
+                "summary": summary,
+            },
+        )
 
-        data = {
-            "text": text,
-            "model_id": "eleven_monolingual_v1",
-            "voice_settings": {"stability": 0.5, "similarity_boost": 0.5},
-        }
 
-        response = requests.post(url, json=data, headers=headers)
+def index_conversations_job(payload: dict, attempt: int) -> None:
+    """Embed every stored conversation that isn't in the search index yet."""
+    collection = store.get_or_create_collection(name="patient_records")
+    indexed = search_index.indexed_records()
+    batch = []
+    for row in scan_collection(collection):
+        if row["id"] in indexed or not row["document"]:
+            continue
+        batch.append((row["id"], row["document"], row["metadata"]))
+        if len(batch) >= 64:
+            search_index.add_records(batch)
+            batch = []
+    if batch:
+        search_index.add_records(batch)
 
-        if response.status_code == 200:
-            # Convert audio bytes to base64 string
-            audio_bytes = BytesIO(response.content)
-            base64_audio = base64.b64encode(audio_bytes.read()).decode("utf-8")
-            return base64_audio
-        else:
-            print(f"Error from ElevenLabs API: {response.status_code}")
+
+job_queue.register("upload_conversation", upload_conversation_job)
+job_queue.register("index_conversations", index_conversations_job)
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id: str) -> tuple[Response, int]:
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+def _speech_cache_key(text: str, previous_text: Optional[str], output_format: str) -> str:
+    return cache_key(
+        text,
+        ELEVENLABS_VOICE_ID,
+        ELEVENLABS_MODEL_ID,
+        ELEVENLABS_VOICE_SETTINGS,
+        previous_text=previous_text,
+        output_format=output_format,
+    )
+
+
+def _elevenlabs_request(text: str, previous_text: Optional[str]) -> tuple[dict, dict]:
+    headers = {
+        "Accept": "audio/mpeg",
+        "Content-Type": "application/json",
+        "xi-api-key": ELEVENLABS_API_KEY,
+    }
+
+    data = {
+        "text": text,
+        "model_id": ELEVENLABS_MODEL_ID,
+        "voice_settings": ELEVENLABS_VOICE_SETTINGS,
+    }
+    if previous_text:
+        # Keeps intonation continuous when a reply is synthesized per sentence
+        data["previous_text"] = previous_text
+
+    return headers, data
+
+
+def synthesize_speech(
+    text: str,
+    previous_text: Optional[str] = None,
+    output_format: str = DEFAULT_AUDIO_FORMAT,
+) -> Optional[bytes]:
+    """Convert text to speech using 11labs API and return the MP3 bytes"""
+    key = _speech_cache_key(text, previous_text, output_format)
+    return speech_cache.get_or_create(
+        key, lambda: _elevenlabs_tts(text, previous_text, output_format)
+    )
+
+
+def _elevenlabs_tts(
+    text: str,
+    previous_text: Optional[str] = None,
+    output_format: str = DEFAULT_AUDIO_FORMAT,
+) -> Optional[bytes]:
+    with span("text_to_speech") as current:
+        try:
+            headers, data = _elevenlabs_request(text, previous_text)
+
+            response = elevenlabs.post(
+                f"/text-to-speech/{ELEVENLABS_VOICE_ID}",
+                json=data,
+                headers=headers,
+                params={"output_format": output_format},
+            )
+
+            if response.status_code == 200:
+                return response.content
+            else:
+                log.warning("Error from ElevenLabs API: %s", response.status_code)
+                current.failed = True
+                return None
+
+        except Exception as e:
+            log.exception("Error in text_to_speech: %s", e)
+            current.failed = True
             return None
 
-    except Exception as e:
-        print(f"Error in text_to_speech: {str(e)}")
+
+def synthesize_speech_stream(
+    text: str,
+    previous_text: Optional[str] = None,
+    output_format: str = DEFAULT_AUDIO_FORMAT,
+) -> Iterator[bytes]:
+    """Yield MP3 chunks as ElevenLabs produces them, caching the finished clip.
+
+    Raises on an API error so the caller can tell a truncated clip from a short one.
+    """
+    key = _speech_cache_key(text, previous_text, output_format)
+    audio = speech_cache.get(key)
+    if audio is not None:
+        yield audio
+        return
+
+    headers, data = _elevenlabs_request(text, previous_text)
+
+    # Timed until the last chunk arrives (includes time the caller spends
+    # between chunks, which is small next to the upstream latency).
+    with span("text_to_speech", "stream"), elevenlabs.post(
+        f"/text-to-speech/{ELEVENLABS_VOICE_ID}/stream",
+        json=data,
+        headers=headers,
+        params={"output_format": output_format},
+        stream=True,
+    ) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"Error from ElevenLabs API: {response.status_code}")
+
+        received = []
+        for chunk in response.iter_content(chunk_size=AUDIO_CHUNK_SIZE):
+            if chunk:
+                received.append(chunk)
+                yield chunk
+
+    speech_cache.put(key, b"".join(received))
+
+
+def text_to_speech(text: str) -> Optional[str]:
+    """Convert text to speech using 11labs API and return base64 encoded audio"""
+    audio = synthesize_speech(text)
+    if audio is None:
         return None
+    return base64.b64encode(audio).decode("utf-8")
+
+
+def audio_mode() -> str:
+    """How the client wants audio delivered.
+
+    ``json`` (default): base64 MP3 in the ``question`` field, for old clients.
+    ``stream``: the MP3 itself as a chunked response body, other fields in
+    ``X-`` headers. ``multipart``: a ``multipart/mixed`` body with the MP3 part
+    streamed first and the JSON fields in a trailing part. Chosen with
+    ``?audio=`` or, failing that, the Accept header. Responses that carry no
+    audio are always plain JSON.
+    """
+    mode = request.args.get("audio")
+    if mode in ("json", "stream", "multipart"):
+        return mode
+    accept = request.headers.get("Accept", "")
+    if "multipart/mixed" in accept:
+        return "multipart"
+    if "audio/mpeg" in accept:
+        return "stream"
+    return "json"
+
+
+def audio_format() -> str:
+    """The ElevenLabs output format picked with ``?codec=``; raises ValueError."""
+    codec = request.args.get("codec", "default")
+    codec = AUDIO_FORMAT_ALIASES.get(codec, codec)
+    if codec not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported codec: {codec}")
+    return codec
+
+
+def audio_headers(fields: dict) -> dict:
+    """Encode response fields as headers for the binary audio mode."""
+    headers = {}
+    for name, value in fields.items():
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif isinstance(value, bool):
+            value = str(value).lower()
+        headers[f"X-{name.replace('_', '-').title()}"] = quote(str(value), safe="")
+    return headers
+
+
+def multipart_response(audio: Iterable[bytes], trailer: Callable[[], dict]) -> Response:
+    """Stream ``audio`` as the first part and ``trailer()`` as a JSON part after it."""
+    boundary = uuid.uuid4().hex
+
+    def generate():
+        yield f"--{boundary}\r\nContent-Type: audio/mpeg\r\n\r\n".encode()
+        yield from audio
+        yield f"\r\n--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode()
+        yield json.dumps(trailer()).encode()
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    return Response(generate(), mimetype=f"multipart/mixed; boundary={boundary}")
 
 
 def fetch_collection(coll: str) -> list[dict]:
+    with span("fetch_collection", coll) as current:
+        try:
+            collection = store.get_or_create_collection(name=coll)
+            return list(scan_collection(collection))
+        except Exception as e:
+            log.exception("Failed to fetch %s: %s", coll, e)
+            current.failed = True
+            return [{}]
+
+
+def user_documents(coll: str, user_id: str) -> list[dict]:
+    """user_id's documents, including writes still waiting in the write buffer."""
+    rows = fetch_user_documents(store, coll, user_id)
+    seen = {row["id"] for row in rows}
+    rows.extend(row for row in write_buffer.pending(coll, user_id) if row["id"] not in seen)
+    return rows
+
+
+def fetch_user_collection(coll: str, user_id: str) -> list[dict]:
+    """Like fetch_collection, but only pulls the documents owned by user_id."""
+    with span("fetch_user_collection", coll) as current:
+        try:
+            return user_documents(coll, user_id)
+        except Exception as e:
+            log.exception("Failed to fetch %s for %s: %s", coll, user_id, e)
+            current.failed = True
+            return []
+
+
+def metric_samples(docs: list[dict]) -> list[tuple[datetime, dict]]:
+    """``(timestamp, metrics)`` of metric documents, skipping undated ones."""
+    samples = []
+    for doc in docs:
+        try:
+            timestamp = parse_time(doc["document"].get("timestamp"))
+        except ValueError:
+            continue
+        samples.append((timestamp, doc["document"].get("metrics", {})))
+    return samples
+
+
+def load_series_samples(family: str, user_id: str) -> list[tuple[datetime, dict]]:
+    """A user's samples for one metric family, read from the document store."""
+    return metric_samples(user_documents(METRIC_COLLECTIONS[family], user_id))
+
+
+def backfill_series(family: str, user_id: str) -> None:
     try:
-        collection = chroma_client.get_or_create_collection(name=coll)
-        docs = collection.get()
+        timeseries.rebuild(user_id, family, lambda: load_series_samples(family, user_id))
+    except Exception as e:
+        log.exception("Failed to backfill %s series for %s: %s", family, user_id, e)
+
+
+def patient_exists(user_id: str) -> bool:
+    return bool(fetch_user_documents(store, "patients", user_id))
+
+
+def read_series(
+    family: str,
+    user_id: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """Range-read a metric series, backfilling it from the document store once.
+
+    Only known patients are backfilled, so a read of an arbitrary id never
+    creates files; other ids are read straight from the document store.
+    """
+    if is_storable_id(user_id):
+        if timeseries.is_backfilled(user_id, family):
+            return timeseries.range(user_id, family, since, until)
+        if patient_exists(user_id):
+            backfill_series(family, user_id)
+            return timeseries.range(user_id, family, since, until)
+    return window(encode(family, load_series_samples(family, user_id)), since, until)
 
-        data = []
-        for doc_id, doc, meta in zip(docs["ids"], docs["documents"], docs["metadatas"]):
-            data.append({"id": doc_id, "document": json.loads(doc), "metadata": meta})
-        return data
+
+def append_series(family: str, user_id: str, samples: list[tuple[str, dict]]) -> None:
+    """Mirror freshly stored metric samples into the time-series store."""
+    try:
+        timeseries.append(
+            user_id, family, [(parse_time(ts), data) for ts, data in samples]
+        )
     except Exception as e:
-        print(e)
-        return [{}]
+        log.warning("Failed to append %s samples for %s: %s", family, user_id, e)
+        # The document store has the samples; rebuild from there on the next read.
+        try:
+            timeseries.invalidate(user_id, family)
+        except Exception:
+            pass
+
+
+def patient_record(doc: dict) -> dict:
+    # doc["document"] has "history", "summary", "timestamp"
+    return {
+        "timestamp": doc["document"].get("timestamp", ""),
+        "history": doc["document"].get("history", []),
+        "summary": doc["document"].get("summary", ""),
+        "id": doc["id"],
+    }
+
+
+def user_delta(user_id: str, since: int, until: int) -> Optional[dict]:
+    """The /get-user fields written after version ``since``, in the same shape.
+
+    ``name``/``email`` are only present if they changed. Returns None if the
+    version log can't diff against ``since``.
+    """
+    changed = {}
+    for coll in ("patients", "patient_records", *METRIC_COLLECTIONS.values()):
+        ids = versions.changes(coll, since, until, user_id=user_id)
+        if ids is None:
+            return None
+        changed[coll] = ids
+
+    def changed_docs(coll: str) -> list[dict]:
+        if not changed[coll]:
+            return []
+        return decode_docs(store.get_or_create_collection(name=coll).get(ids=changed[coll]))
+
+    delta = {"user_id": user_id}
+    for doc in changed_docs("patients"):
+        delta["name"] = doc["document"].get("name", "")
+        delta["email"] = doc["document"].get("email", "")
+    delta["patient_records"] = [patient_record(doc) for doc in changed_docs("patient_records")]
+
+    heart = encode("heart_rate", metric_samples(changed_docs(METRIC_COLLECTIONS["heart_rate"])))
+    delta["agitation"] = as_points(heart, "agitation")
+    delta["hrv"] = as_points(heart, "hrv")
+    for family, key in (("sleep", "sleep_metrics"), ("activity", "activity_metrics")):
+        records = encode(family, metric_samples(changed_docs(METRIC_COLLECTIONS[family])))
+        delta[key] = as_rows(records, FAMILIES[family])
+    return delta
 
 
 @app.route("/get-user/<user_id>", methods=["GET"])
 def fetch_one_user_data(user_id: str):
+    """Everything the dashboard shows for one patient.
+
+    ``?since=`` / ``?until=`` (ISO timestamps) narrow the metric window.
+    Responses carry the patient's ``version`` and a matching weak ETag for
+    304s. ``?since=<version>`` returns only what was written after that
+    version (``"delta": true``); merge it into the earlier response by record
+    id and sample timestamp. Samples shown before they were flushed to the
+    store can appear in a delta again. While the patient has writes still in
+    the write buffer, which the version doesn't count yet, the full response
+    is always sent.
+    """
     try:
+        # The version is read before any data, as in fetch_data
+        version = versions.user_version(user_id)
+        tag = versions.tag(version)
+        buffered = write_buffer.has_pending(user_id)
+        unchanged = None if buffered else not_modified(tag)
+        if unchanged is not None:
+            return unchanged
+
+        since_version = parse_version(request.args.get("since"))
+        if since_version is not None and not buffered:
+            delta = user_delta(user_id, since_version, version)
+            if delta is not None:
+                body = {"success": True, "data": delta, "version": version, "delta": True}
+                return with_etag(jsonify(body), tag), 200
+
         # =========================================================
         # 1. Initialize the aggregated response structure
         # =========================================================
@@ -292,179 +841,278 @@ def fetch_one_user_data(user_id: str):
         # =========================================================
         # 2. Fetch 'patients' collection to get name/email for this user_id
         # =========================================================
-        patients_data = fetch_collection("patients")
+        patients_data = fetch_user_collection("patients", user_id)
         for doc in patients_data:
-            # doc["document"] might look like {"name": "...", "email": "..."}
-            # or doc["metadata"] might have user_id
-            # since you only store doc with name,email, no "metadata"?
-            # Adjust to your actual structure
-            # We do NOT have user_id in doc["document"], so let's see if doc["metadata"]
-            # or doc["document"] has it
-            # If "user_id" is in doc["metadata"], or doc["document"] ...
-
-            # If your 'patients' collection has "document" = { name, email }
-            # and no user_id, you might store user_id in doc["id"] or doc["metadata"]
-            # Example assumption:
-            # doc["metadata"] = {"user_id": "..."} or doc["document"]["user_id"]
-
-            # We'll guess doc["metadata"] might be null. So let's unify by email or name or do a special approach
-            # For demonstration, let's say doc["document"] is {name, email, user_id}:
-            doc_user_id = doc["id"]
-            if doc_user_id == user_id:
-                all_one_patient_data["name"] = doc["document"].get("name", "")
-                all_one_patient_data["email"] = doc["document"].get("email", "")
+            # patients are keyed by user_id; document = {name, email}
+            all_one_patient_data["name"] = doc["document"].get("name", "")
+            all_one_patient_data["email"] = doc["document"].get("email", "")
 
         # =========================================================
         # 3. Fetch 'patient_records' for conversation data
         #    document = { "history": [...], "summary": "...", "timestamp": "..." }
         #    metadata = { "metadata": {...} }, with "metadata": { "user_id": "..." }
         # =========================================================
-        pr_data = fetch_collection("patient_records")
+        pr_data = fetch_user_collection("patient_records", user_id)
         for doc in pr_data:
-            meta = doc["metadata"] or {}
-            doc_user_id = meta.get("user_id")
-            if doc_user_id == user_id:
-                # doc["document"] has "history", "summary", "timestamp"
-                rec = {
-                    "timestamp": doc["document"].get("timestamp", ""),
-                    "history": doc["document"].get("history", []),
-                    "summary": doc["document"].get("summary", ""),
-                    "id": doc["id"],
-                }
-                all_one_patient_data["patient_records"].append(rec)
+            all_one_patient_data["patient_records"].append(patient_record(doc))
 
         # =========================================================
-        # 4. Fetch 'user_metrics' for agitation, hrv, etc.
-        #    document = {
-        #       "metrics": { "agitation": ..., "hrv": ..., "user_id": ... },
-        #       "timestamp": "...",
-        #       "user_id": "..."
-        #    }
+        # 4-6. Agitation/HRV, sleep and activity come from the time-series
+        #      store: one slice per metric family instead of a JSON decode
+        #      per sample. ?since= / ?until= narrow the window.
         # =========================================================
-        um_data = fetch_collection("user_metrics")
-        for doc in um_data:
-            meta = doc["metadata"] or {}
-            # doc["document"]["user_id"] or doc["document"]["metrics"]["user_id"]?
-            doc_user_id = doc["document"].get("user_id")
-            if doc_user_id == user_id:
-                # doc["document"] => { metrics: {agitation,hrv}, timestamp, user_id }
-                metrics = doc["document"].get("metrics", {})
-                tstamp = doc["document"].get("timestamp", "")
-                # "agitation": {timestamp: agitation}
-                all_one_patient_data["agitation"][tstamp] = metrics.get("agitation")
-                all_one_patient_data["hrv"][tstamp] = metrics.get("hrv")
+        since = (
+            parse_time(request.args["since"])
+            if request.args.get("since") and since_version is None
+            else None
+        )
+        until = parse_time(request.args["until"]) if request.args.get("until") else None
 
-        # =========================================================
-        # 5. Fetch 'user_sleep_metrics'
-        #    document = {
-        #      "metrics": {
-        #         "remSleepHours", "deepSleepHours", "awakeTime", "sleepQualityScore",
-        #         "user_id", ...
-        #      },
-        #      "timestamp": "...",
-        #      "user_id": "...",
-        #      "metric_type": "sleep"
-        #    }
-        # =========================================================
-        us_data = fetch_collection("user_sleep_metrics")
-        for doc in us_data:
-            doc_user_id = doc["document"].get("user_id")
-            if doc_user_id == user_id:
-                tstamp = doc["document"].get("timestamp", "")
-                m = doc["document"].get("metrics", {})
-                entry = {
-                    "timestamp": tstamp,
-                    "remSleepHours": m.get("remSleepHours"),
-                    "deepSleepHours": m.get("deepSleepHours"),
-                    "awakeTime": m.get("awakeTime"),
-                    "sleepQualityScore": m.get("sleepQualityScore"),
-                    "totalSleepHours": m.get("totalSleepHours"),
-                }
-                all_one_patient_data["sleep_metrics"].append(entry)
+        heart = read_series("heart_rate", user_id, since, until)
+        all_one_patient_data["agitation"] = as_points(heart, "agitation")
+        all_one_patient_data["hrv"] = as_points(heart, "hrv")
 
-        # =========================================================
-        # 6. Fetch 'user_activity_metrics'
-        #    document = {
-        #      "metrics": {
-        #         "steps", "caloriesBurned", "activityScore", "user_id", ...
-        #      },
-        #      "timestamp": "...",
-        #      "user_id": "...",
-        #      "metric_type": "activity"
-        #    }
-        # =========================================================
-        ua_data = fetch_collection("user_activity_metrics")
-        for doc in ua_data:
-            doc_user_id = doc["document"].get("user_id")
-            if doc_user_id == user_id:
-                tstamp = doc["document"].get("timestamp", "")
-                m = doc["document"].get("metrics", {})
-                entry = {
-                    "timestamp": tstamp,
-                    "steps": m.get("steps"),
-                    "caloriesBurned": m.get("caloriesBurned"),
-                    "activityScore": m.get("activityScore"),
-                }
-                all_one_patient_data["activity_metrics"].append(entry)
+        sleep = read_series("sleep", user_id, since, until)
+        all_one_patient_data["sleep_metrics"] = as_rows(sleep, FAMILIES["sleep"])
+
+        activity = read_series("activity", user_id, since, until)
+        all_one_patient_data["activity_metrics"] = as_rows(activity, FAMILIES["activity"])
 
         # =========================================================
         # Return the aggregated data
         # =========================================================
 
-        return jsonify({"success": True, "data": all_one_patient_data}), 200
+        body = {"success": True, "data": all_one_patient_data, "version": version}
+        if since_version is not None:
+            body["delta"] = False
+        return with_etag(jsonify(body), tag), 200
 
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
-        print(e)
+        log.exception("Request failed: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
-def get_timestamp(doc):
-    timestamp = doc.get("document", {}).get("timestamp")
-    if not isinstance(timestamp, str):
-        # If missing or invalid, return an extreme date
-        return datetime.min
+@app.route("/api/rollups/<user_id>", methods=["GET"])
+def user_rollups(user_id: str) -> tuple[Response, int]:
+    """Per-bucket count/mean/min/max of a patient's metrics, for trend charts.
+
+    Query parameters (all optional):
+      resolution  hour, day (default) or week
+      metric      heart_rate, sleep or activity (default: all three)
+      since       ISO timestamp; the bucket containing it is included
+      until       ISO timestamp, exclusive
+
+    An id with no patient record gets a 404.
+    """
     try:
-        return datetime.fromisoformat(timestamp)
-    except ValueError:
-        # If timestamp is not ISO format, fallback
-        return datetime.min
+        resolution = request.args.get("resolution", "day")
+        if resolution not in RESOLUTIONS:
+            return jsonify(
+                {"success": False, "error": f"resolution must be one of: {', '.join(RESOLUTIONS)}"}
+            ), 400
+        metric = request.args.get("metric")
+        if metric is not None and metric not in FAMILIES:
+            return jsonify({"success": False, "error": "Invalid metric type"}), 400
+        since = parse_time(request.args["since"]) if request.args.get("since") else None
+        until = parse_time(request.args["until"]) if request.args.get("until") else None
+
+        # Backfilling writes the series to disk; only do that for real patients
+        if not is_storable_id(user_id) or not patient_exists(user_id):
+            return jsonify({"success": False, "error": "Patient not found"}), 404
+
+        data = {}
+        for family in [metric] if metric else FAMILIES:
+            if not timeseries.is_backfilled(user_id, family):
+                backfill_series(family, user_id)
+            elif not rollups.is_built(user_id, family):
+                timeseries.reindex(user_id, family)
+            data[family] = rollups.query(user_id, family, resolution, since, until)
+
+        return jsonify(
+            {"success": True, "user_id": user_id, "resolution": resolution, "data": data}
+        ), 200
+
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        log.exception("Request failed: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/search", methods=["GET"])
+def search() -> tuple[Response, int]:
+    """Semantic search over conversation summaries and answers.
+
+    Query parameters:
+      q        the search text (required)
+      k        number of conversations to return (default 10, max 100)
+      since    ISO timestamp; only conversations from then on
+      user_id  restrict to one patient
+    """
+    try:
+        query = (request.args.get("q") or "").strip()
+        if not query:
+            return jsonify({"success": False, "error": "Missing q"}), 400
+        k = min(max(int(request.args.get("k", 10)), 1), 100)
+        since = parse_time(request.args["since"]) if request.args.get("since") else None
+
+        hits = search_index.search(query, k, since, request.args.get("user_id"))
+        return jsonify({"success": True, "query": query, "results": hits}), 200
+
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        log.exception("Request failed: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/search/backfill", methods=["POST"])
+def search_backfill() -> tuple[Response, int]:
+    """Queue a job that indexes conversations stored before search existed."""
+    job_id = job_queue.enqueue("index_conversations", {})
+    return jsonify({"success": True, "job_id": job_id}), 202
+
+
+@app.route("/api/search/stats", methods=["GET"])
+def search_stats() -> tuple[Response, int]:
+    return jsonify(search_index.stats()), 200
 
 
 @app.route("/fetch-patient-data/<collection>", methods=["GET"])
 def fetch_data(collection: str):
+    """List a collection, newest first.
+
+    Query parameters (all optional):
+      limit   page size; enables cursor pagination
+      cursor  ``next_cursor`` from the previous page
+      since   ISO timestamp, inclusive lower bound; or the ``version`` of an
+              earlier response to get only the documents written since
+      until   ISO timestamp, exclusive upper bound
+      format  ``ndjson`` to stream one document per line
+
+    With none of limit/cursor/since/until the whole collection is returned, as
+    before. NDJSON without a limit streams the window in store order so memory
+    stays bounded regardless of collection size.
+
+    JSON responses include the collection's ``version``, and every response
+    has it in a weak ETag, so ``If-None-Match`` gets a 304 while nothing was
+    written. A ``?since=<version>`` response has ``"delta": true`` and lists
+    just the new documents (newest first, no paging); if the version is too
+    old to diff against it has ``"delta": false`` and the whole collection.
+    """
     try:
-        data = fetch_collection(collection)
+        args = request.args
+        # Read the version before the data: at worst the data is newer than
+        # the version and the client fetches it once more.
+        version = versions.version(collection)
+        tag = versions.tag(version)
+        unchanged = not_modified(tag)
+        if unchanged is not None:
+            return unchanged
+
+        since_version = parse_version(args.get("since"))
+        paginate = any(key in args for key in ("limit", "cursor", "until")) or (
+            "since" in args and since_version is None
+        )
+        try:
+            limit = int(args.get("limit", DEFAULT_PAGE_LIMIT))
+            since = (
+                parse_time(args["since"])
+                if "since" in args and since_version is None
+                else None
+            )
+            until = parse_time(args["until"]) if "until" in args else None
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        coll = store.get_or_create_collection(name=collection)
+
+        if since_version is not None:
+            changed = versions.changes(collection, since_version, version)
+            if changed is not None:
+                rows = decode_docs(coll.get(ids=changed)) if changed else []
+                if collection != "patients":
+                    rows.sort(key=get_timestamp, reverse=True)
+                body = {"success": True, "data": rows, "version": version, "delta": True}
+                return with_etag(jsonify(body), tag), 200
+
+        if args.get("format") == "ndjson":
+            if "limit" in args or "cursor" in args:
+                rows, next_cursor = page_collection(
+                    coll, limit, args.get("cursor"), since, until
+                )
+            else:
+                rows, next_cursor = iter_window(coll, since, until), None
+
+            def generate():
+                for row in rows:
+                    yield json.dumps(row) + "\n"
+                if next_cursor:
+                    yield json.dumps({"next_cursor": next_cursor}) + "\n"
+
+            response = Response(
+                stream_with_context(generate()), mimetype="application/x-ndjson"
+            )
+            return with_etag(response, tag)
 
-        if collection != "patients":
+        if paginate:
+            rows, next_cursor = page_collection(
+                coll, limit, args.get("cursor"), since, until
+            )
+            body = {"success": True, "data": rows, "next_cursor": next_cursor, "version": version}
+            return with_etag(jsonify(body), tag), 200
 
-            def get_timestamp(doc):
-                timestamp = doc.get("document", {}).get("timestamp")
-                if not isinstance(timestamp, str):
-                    return datetime.min
-                try:
-                    return datetime.fromisoformat(timestamp)
-                except ValueError:
-                    return datetime.min
+        data = fetch_collection(collection)
 
+        if collection != "patients":
             sorted_data = sorted(data, key=get_timestamp, reverse=True)
         else:
             sorted_data = data
 
-        return jsonify({"success": True, "data": sorted_data}), 200
+        body = {"success": True, "data": sorted_data, "version": version}
+        if since_version is not None:
+            body["delta"] = False
+        return with_etag(jsonify(body), tag), 200
 
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
-        print(e)
+        log.exception("Request failed: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/api/live", methods=["GET"])
+def live_feed():
+    """Server-sent events as patients' data arrives.
+
+    ``?user_id=`` (repeatable) limits the stream to those patients; without
+    it every patient's events are sent. Each event's data is JSON with the
+    ``user_id``:
+
+      metric      {family, samples: [{timestamp, field: value, ...}]}
+      alert       {timestamp, agitation, hrv}: the detector flagged a sample
+      assessment  {record_id, timestamp, summary}: a conversation was stored
+      overflow    {dropped}: this client fell behind and missed events
+
+    Reconnecting with ``Last-Event-ID`` replays recent events it missed.
+    """
+    topics = [user_topic(user_id) for user_id in request.args.getlist("user_id")]
+    try:
+        subscription = feed.subscribe(topics or [ALL_TOPIC], request.headers.get("Last-Event-ID"))
+    except FeedFull as e:
+        return jsonify({"error": str(e)}), 503
+    return Response(
+        feed.stream(subscription),
+        mimetype="text/event-stream",
+        # X-Accel-Buffering stops nginx from holding events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/assessment", methods=["POST"])
 def assessment() -> tuple[Response, int]:
-    # ==============================================
-    #  MODEL HERE
-    # ==============================================
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    model = genai.GenerativeModel("gemini-2.0-flash")
-
     try:
         # ==============================================
         # QUESTIONS AND PROMPTS
@@ -505,7 +1153,7 @@ def assessment() -> tuple[Response, int]:
         # CONVERSATION
         # ==============================================
         data = request.form
-        print("REQUEST:", data, "\n\n")
+        log.debug("Assessment request: %s", data.to_dict())
 
         # Validate input format
         # if not all(
@@ -521,42 +1169,77 @@ def assessment() -> tuple[Response, int]:
         # ):
         #     return jsonify({"error": "Invalid input format"}), 400
 
-        # Format the conversation history
-        num = int(data.get("num", 0))
-        chat_history = json.loads(data.get("history", "[]"))
-        # ai_question_audio = data["question"]
         end = data.get("end", "false").lower() == "true"
-        ai_question_text = data.get("question_text", "")
-        meta = json.loads(data.get("metadata", "{}"))
         audio_file = request.files["answer_audio"]  # audio response sent by watch
-
-        if audio_file.filename == "" or ai_question_text == "" or len(meta) == 0:
-            return jsonify({"error": "invalid input"}), 400
-
-        answer_text = transcribe(audio_file)
-
-        print("TRANSCRIBED AUDIO:", answer_text, "\n\n")
-
-        chat_history.append({"question": ai_question_text, "answer": answer_text})
+        mode = audio_mode()
+        output_format = audio_format()
+
+        # A watch with a session_id (from /alert_status or an earlier turn)
+        # sends only its answer; the conversation is kept here. Without one,
+        # the conversation so far comes in the form, as before, and a session
+        # is started from it.
+        legacy = "session_id" not in data
+        if legacy:
+            num = int(data.get("num", 0))
+            chat_history = json.loads(data.get("history", "[]"))
+            ai_question_text = data.get("question_text", "")
+            meta = json.loads(data.get("metadata", "{}"))
+            if audio_file.filename == "" or ai_question_text == "" or len(meta) == 0:
+                return jsonify({"error": "invalid input"}), 400
+            session = sessions.create(meta, ai_question_text, chat_history, num)
+        else:
+            session = sessions.get(data["session_id"])
+            if session is None:
+                return jsonify({"error": "Unknown or expired session"}), 404
+            if audio_file.filename == "":
+                return jsonify({"error": "invalid input"}), 400
+        num = session.num
+
+        def session_fields() -> dict:
+            fields = {"session_id": session.id}
+            if legacy:
+                fields.update(history=session.history, metadata=session.metadata)
+            return fields
+
+        # Optional per-request deadline from the watch, in milliseconds
+        deadline_ms = data.get("deadline_ms")
+        timeout = int(deadline_ms) / 1000 if deadline_ms else None
+
+        try:
+            answer_text = transcribe(audio_file, timeout=timeout)
+        except (QueueFull, BrokenProcessPool) as e:
+            return jsonify({"error": str(e)}), 503
+        except TimeoutError as e:
+            return jsonify({"error": str(e)}), 504
+
+        log.debug("Transcribed answer: %s", answer_text)
 
         # If conversation is ended, upload to database
         if end or num >= 2:
-            print("UPLOADING", "\n\n")
-            upload(
-                chat_history,
-                metadata=meta,
+            log.info("Assessment finished after %d questions; uploading", num + 1)
+            job_id = upload(
+                [*session.history, {"question": session.question, "answer": answer_text}],
+                metadata=session.metadata,
             )
+            # Keep the session until the upload is queued, so the watch can
+            # retry the final answer
+            if job_id is None:
+                return jsonify({"error": "Failed to save the assessment", **session_fields()}), 503
+            session.record(answer_text, None)
+            sessions.delete(session.id)
             return jsonify(
                 {
+                    "job_id": job_id,
                     "num": num,
-                    "history": chat_history,
                     "question_text": None,
                     "question": None,
                     "end": True,
-                    "metadata": meta,
+                    **session_fields(),
                 }
             ), 200
 
+        # The answer is only recorded once the next question exists, so a
+        # turn that fails can be retried with the same audio.
         prompt = f"""
         ----- INSTRUCTIONS -----
 
@@ -564,7 +1247,7 @@ def assessment() -> tuple[Response, int]:
 
         ----- CURRENT CONVERSATION -----
 
-        history: {chat_history}
+        {session.context(answer_text)}
         
         ----- TASK -----
 
@@ -574,24 +1257,80 @@ def assessment() -> tuple[Response, int]:
         covered.
         """
 
-        # Generate response
-        response = model.generate_content(prompt).text
-        audio_base64 = text_to_speech(response)
-        if audio_base64 is None:
+        def advance(question_text: str) -> None:
+            session.record(answer_text, question_text)
+            sessions.save(session)
+
+        # Generate response, synthesizing each sentence as soon as it is complete
+        stream = gemini_model.generate_content(prompt, stream=True)
+        chunks = traced_iter((chunk.text for chunk in stream), "generate_reply", "gemini")
+
+        if mode != "json":
+            relay = SpeechRelay(
+                chunks,
+                lambda text, previous_text=None: synthesize_speech_stream(
+                    text, previous_text, output_format
+                ),
+            )
+            result = {"num": num + 1, "end": False, "session_id": session.id}
+            if legacy:
+                result["metadata"] = session.metadata
+
+            if mode == "stream":
+                # Headers go out first, so wait for the text; audio for the
+                # early sentences is already being synthesized meanwhile.
+                question_text = relay.text()
+                headers = audio_headers(
+                    {**result, "question_text": question_text, "answer_text": answer_text}
+                )
+
+                def audio():
+                    # There's no trailer to report a failed sentence in, so
+                    # abort the response and leave the session for a retry
+                    yield from relay.audio(strict=True)
+                    advance(question_text)
+
+                return Response(audio(), mimetype="audio/mpeg", headers=headers)
+
+            def trailer():
+                fields = {**result, "question": None}
+                try:
+                    fields["question_text"] = relay.text()
+                    advance(fields["question_text"])
+                except Exception as e:
+                    fields["error"] = str(e)
+                if legacy:
+                    fields["history"] = session.history
+                if relay.synthesis_error is not None:
+                    fields["error"] = "Failed to generate audio"
+                return fields
+
+            return multipart_response(relay.audio(), trailer)
+
+        response, audio = speak(
+            chunks,
+            lambda text, previous_text=None: synthesize_speech(
+                text, previous_text, output_format
+            ),
+        )
+        if audio is None:
             # If ElevenLabs fails, send a proper error response
             return jsonify({"error": "Failed to generate audio"}), 500
+        audio_base64 = base64.b64encode(audio).decode("utf-8")
+        advance(response)
 
         return jsonify(
             {
                 "num": num + 1,
-                "history": chat_history,
                 "question": audio_base64,  # This will now be real audio data
                 "question_text": response,
                 "end": False,
-                "metadata": meta,
+                **session_fields(),
             }
         ), 200
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -646,8 +1385,9 @@ def chat() -> tuple[Response, int]:
         "presence_penalty": 0,
     }
 
-    response = requests.post(MISTRAL_API_URL, headers=headers, json=payload)
-    print(response)
+    with span("chat", "mistral"):
+        response = mistral.post("/chat/completions", headers=headers, json=payload)
+    log.debug("Mistral chat response: %s", response.status_code)
     response_data = response.json()
 
     if "choices" in response_data and len(response_data["choices"]) > 0:
@@ -657,10 +1397,121 @@ def chat() -> tuple[Response, int]:
         return jsonify({"error": "Failed to get a response from Mistral"}), 500
 
 
+# Metric sample collections by the metric_type used in the routes
+METRIC_COLLECTIONS = {
+    "heart_rate": "user_metrics",
+    "sleep": "user_sleep_metrics",
+    "activity": "user_activity_metrics",
+}
+
+# Largest number of samples accepted in one batch request
+MAX_BATCH_SIZE = 5000
+
+
+def metric_record(
+    data: dict, user_id: str, timestamp: str, metric_type: Optional[str] = None
+) -> tuple[dict, dict]:
+    """Build the (document, metadata) pair stored for one metric sample."""
+    document = {"metrics": data, "timestamp": timestamp, "user_id": user_id}
+    metadata = {
+        "email": data["userEmail"],
+        "name": data["userName"],
+        "timestamp": timestamp,
+        "user_id": user_id,
+    }
+    if metric_type is not None:
+        document["metric_type"] = metric_type
+        metadata["metric_type"] = metric_type
+    return document, metadata
+
+
+def is_critical(user_id: str, samples: list[tuple[str, dict]]) -> bool:
+    """Run samples through the patient's baseline detector; True if it alerts.
+
+    Falls back to the fixed agitation threshold on the newest sample if the
+    detector can't be reached.
+    """
+    try:
+        decision = detector.observe(
+            user_id, [(parse_time(ts), sample) for ts, sample in samples]
+        )
+        return decision["critical"]
+    except Exception as e:
+        log.warning("Anomaly detector failed for %s: %s", user_id, e)
+        _, newest = max(samples, key=lambda item: item[0])
+        return threshold_critical(newest)
+
+
+def publish_alert(user_id: str, samples: list[tuple[str, dict]]) -> None:
+    timestamp, newest = max(samples, key=lambda item: item[0])
+    feed.publish(
+        user_id,
+        "alert",
+        {"timestamp": timestamp, "agitation": newest.get("agitation"), "hrv": newest.get("hrv")},
+    )
+
+
+def alert_response(
+    critical: bool,
+    mode: str,
+    output_format: str,
+    extra: Optional[dict] = None,
+    session_id: Optional[str] = None,
+):
+    """The /alert_status reply: the spoken greeting if critical, else nothing.
+
+    ``extra`` fields are added to JSON bodies (and the multipart JSON part);
+    the binary stream mode only carries the alert fields in its headers.
+    ``session_id`` is the assessment session the greeting opens, if any.
+    """
+    extra = extra or {}
+    if session_id is not None:
+        extra = {**extra, "session_id": session_id}
+    if not critical:
+        return jsonify(
+            {"critical": False, "question_text": "", "question": None, **extra}
+        ), 200
+
+    # message = TWILIO_CLIENT.messages.create(
+    #     from_=TWILIO_PHONE_NUMBER, body="Alert! Mood swing!", to="+16047806112"
+    # )
+    # print(message.sid)
+
+    # Initiate the conversation with the watch
+    question_text = ALERT_GREETING
+
+    if mode != "json":
+        audio = synthesize_speech_stream(question_text, output_format=output_format)
+        # Pull the first chunk here so an ElevenLabs failure is still a 500
+        audio = itertools.chain([next(audio)], audio)
+        fields = {"critical": True, "question_text": question_text}
+        if session_id is not None:
+            fields["session_id"] = session_id
+        if mode == "stream":
+            return Response(audio, mimetype="audio/mpeg", headers=audio_headers(fields))
+        return multipart_response(audio, lambda: {**fields, **extra})
+
+    # Convert text to speech
+    audio = synthesize_speech(question_text, output_format=output_format)
+    if audio is None:
+        return jsonify({"error": "Failed to generate audio", **extra}), 500
+
+    return jsonify(
+        {
+            "critical": True,
+            "question_text": question_text,
+            "question": base64.b64encode(audio).decode("utf-8"),
+            **extra,
+        }
+    ), 200
+
+
 @app.route("/alert_status", methods=["POST"])
 def alert_status():
     try:
         data = request.get_json()
+        mode = audio_mode()
+        output_format = audio_format()
 
         # First, ensure user exists/create if needed
         user_id, status = create_or_upload_user(data["userEmail"], data["userName"])
@@ -671,56 +1522,36 @@ def alert_status():
         # Add user_id to the metrics
         data["user_id"] = user_id
 
-        # Store the entire payload in ChromaDB
-        collection = chroma_client.get_or_create_collection(name="user_metrics")
-
+        # Queue the entire payload for the document store
         current_time = datetime.now().isoformat()
-        document = {"metrics": data, "timestamp": current_time, "user_id": user_id}
+        document, metadata = metric_record(data, user_id, current_time)
 
-        collection.add(
+        write_buffer.add(
+            "user_metrics",
             ids=[f"{uuid.uuid4()}"],
             documents=[json.dumps(document)],
-            metadatas=[
-                {
-                    "email": data["userEmail"],
-                    "name": data["userName"],
-                    "timestamp": current_time,
-                    "user_id": user_id,
-                }
-            ],
+            metadatas=[metadata],
         )
+        append_series("heart_rate", user_id, [(current_time, data)])
 
         # Check for critical state
-        is_critical = data["agitation"] > 50
-
-        if is_critical:
-            # message = TWILIO_CLIENT.messages.create(
-            #     from_=TWILIO_PHONE_NUMBER, body="Alert! Mood swing!", to="+16047806112"
-            # )
-            # print(message.sid)
-
-            # Initiate the conversation with the watch
-            question_text = """Hi, I'm an AI therapist. I've noticed that you've been having some mood swings.
-            Can you tell me how you are feeling right now?"""
-
-            # Convert text to speech
-            audio_base64 = text_to_speech(question_text)
-            if audio_base64 is None:
-                return jsonify({"error": "Failed to generate audio"}), 500
-        else:
-            question_text = ""
-            audio_base64 = None
-
-        return jsonify(
-            {
-                "critical": is_critical,
-                "question_text": question_text,
-                "question": audio_base64,
-            }
-        ), 200
+        critical = is_critical(user_id, [(current_time, data)])
+        session_id = None
+        if critical:
+            publish_alert(user_id, [(current_time, data)])
+            # The watch answers the greeting with /assessment and this session_id
+            session = sessions.create(
+                {"name": data["userName"], "email": data["userEmail"]}, ALERT_GREETING
+            )
+            session_id = session.id
+        return alert_response(critical, mode, output_format, session_id=session_id)
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except BufferFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        print("Error storing metrics:", e)
+        log.exception("Error storing metrics: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -742,40 +1573,237 @@ def health_metrics(metric_type):
         # Add user_id to the metrics
         data["user_id"] = user_id
 
-        # Store the entire payload in ChromaDB
-        collection_name = f"user_{metric_type}_metrics"
-        collection = chroma_client.get_or_create_collection(name=collection_name)
-
+        # Queue the entire payload for the document store
         current_time = datetime.now().isoformat()
-        document = {
-            "metrics": data,
-            "timestamp": current_time,
-            "user_id": user_id,
-            "metric_type": metric_type,
-        }
+        document, metadata = metric_record(data, user_id, current_time, metric_type)
 
-        collection.add(
+        write_buffer.add(
+            METRIC_COLLECTIONS[metric_type],
             ids=[f"{uuid.uuid4()}"],
             documents=[json.dumps(document)],
-            metadatas=[
-                {
-                    "email": data["userEmail"],
-                    "name": data["userName"],
-                    "timestamp": current_time,
-                    "user_id": user_id,
-                    "metric_type": metric_type,
-                }
-            ],
+            metadatas=[metadata],
         )
+        append_series(metric_type, user_id, [(current_time, data)])
 
         return jsonify(
             {"success": True, "message": f"{metric_type} metrics recorded successfully"}
         ), 200
 
+    except BufferFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        print(f"Error storing {metric_type} metrics:", e)
+        log.exception("Error storing %s metrics: %s", metric_type, e)
         return jsonify({"error": str(e)}), 500
 
 
+def batch_samples(body) -> list[dict]:
+    """Samples from a batch body: a bare list, or ``{userEmail, userName, samples}``."""
+    if isinstance(body, list):
+        return body
+    if not isinstance(body, dict) or not isinstance(body.get("samples"), list):
+        raise ValueError("Expected a list of samples or an object with 'samples'")
+    shared = {key: body[key] for key in ("userEmail", "userName") if key in body}
+    return [{**shared, **sample} if isinstance(sample, dict) else sample for sample in body["samples"]]
+
+
+def store_batch(
+    samples: list[dict], metric_type: str, required: tuple[str, ...]
+) -> tuple[list[dict], list[tuple[int, dict]]]:
+    """Validate, resolve and bulk-store a batch of samples.
+
+    Each distinct patient is resolved once and the whole batch is written with
+    one add. Samples may carry their own ISO ``timestamp`` (e.g. buffered while
+    the watch was offline); otherwise the arrival time is used. Returns per-item
+    results (in request order) and the ``(index, sample)`` pairs that were stored.
+    """
+    results: list[dict] = [{}] * len(samples)
+    users: dict[tuple[str, str], tuple[str, int]] = {}
+    ids, documents, metadatas, stored = [], [], [], []
+    now = datetime.now().isoformat()
+    stored_type = None if metric_type == "heart_rate" else metric_type
+
+    for index, sample in enumerate(samples):
+        try:
+            if not isinstance(sample, dict):
+                raise ValueError("sample must be an object")
+            missing = [key for key in ("userEmail", "userName", *required) if key not in sample]
+            if missing:
+                raise ValueError(f"missing fields: {', '.join(missing)}")
+            for key in required:
+                if isinstance(sample[key], bool) or not isinstance(sample[key], (int, float)):
+                    raise ValueError(f"{key} must be a number")
+
+            timestamp = now
+            if sample.get("timestamp"):
+                timestamp = parse_time(sample["timestamp"]).isoformat()
+
+            identity = (sample["userEmail"], sample["userName"])
+            if identity not in users:
+                users[identity] = create_or_upload_user(*identity)
+            user_id, status = users[identity]
+            if status >= 400:
+                raise LookupError("Failed to process user")
+
+            data = {**sample, "user_id": user_id}
+            data.pop("timestamp", None)
+            document, metadata = metric_record(data, user_id, timestamp, stored_type)
+
+            doc_id = f"{uuid.uuid4()}"
+            ids.append(doc_id)
+            documents.append(json.dumps(document))
+            metadatas.append(metadata)
+            stored.append((index, {**data, "timestamp": timestamp}))
+            results[index] = {"index": index, "status": "ok", "id": doc_id}
+        except (ValueError, TypeError, LookupError) as e:
+            results[index] = {"index": index, "status": "error", "error": str(e)}
+
+    if ids:
+        write_buffer.add(
+            METRIC_COLLECTIONS[metric_type], ids=ids, documents=documents, metadatas=metadatas
+        )
+
+        by_user: dict[str, list[tuple[str, dict]]] = {}
+        for _, data in stored:
+            by_user.setdefault(data["user_id"], []).append((data["timestamp"], data))
+        for user_id, series in by_user.items():
+            append_series(metric_type, user_id, series)
+
+    return results, stored
+
+
+@app.route("/alert_status/batch", methods=["POST"])
+def alert_status_batch():
+    """Store many agitation/HRV samples at once and run them through the detector.
+
+    Every flagged patient's alert goes to the live feed, but the caller only
+    gets the spoken greeting when the whole batch is one patient's: a batch
+    that mixes patients has no one at the watch to greet.
+    """
+    try:
+        samples = batch_samples(request.get_json())
+        if len(samples) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"Batch larger than {MAX_BATCH_SIZE} samples"}), 413
+        mode = audio_mode()
+        output_format = audio_format()
+
+        results, stored = store_batch(samples, "heart_rate", ("agitation", "hrv"))
+
+        by_user: dict[str, list[tuple[str, dict]]] = {}
+        for _, data in stored:
+            by_user.setdefault(data["user_id"], []).append((data["timestamp"], data))
+        flagged = []
+        for user_id, samples in by_user.items():
+            if is_critical(user_id, samples):
+                publish_alert(user_id, samples)
+                flagged.append(user_id)
+        critical = len(by_user) == 1 and bool(flagged)
+        session_id = None
+        if critical:
+            _, newest = max(by_user[flagged[0]], key=lambda item: item[0])
+            # The watch answers the greeting with /assessment and this session_id
+            session = sessions.create(
+                {"name": newest["userName"], "email": newest["userEmail"]}, ALERT_GREETING
+            )
+            session_id = session.id
+
+        return alert_response(
+            critical, mode, output_format, {"results": results}, session_id=session_id
+        )
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except BufferFull as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        log.exception("Error storing metrics batch: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/health-metrics/<metric_type>/batch", methods=["POST"])
+def health_metrics_batch(metric_type):
+    try:
+        if metric_type not in ["sleep", "activity"]:
+            return jsonify({"error": "Invalid metric type"}), 400
+
+        samples = batch_samples(request.get_json())
+        if len(samples) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"Batch larger than {MAX_BATCH_SIZE} samples"}), 413
+
+        results, stored = store_batch(samples, metric_type, ())
+
+        return jsonify(
+            {
+                "success": len(stored) == len(samples),
+                "message": f"{len(stored)} of {len(samples)} {metric_type} samples recorded",
+                "results": results,
+            }
+        ), 200
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except BufferFull as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        log.exception("Error storing %s metrics batch: %s", metric_type, e)
+        return jsonify({"error": str(e)}), 500
+
+
+REGISTRY.stats("treehacks_transcription", transcriber.stats)
+REGISTRY.stats("treehacks_provider", providers.stats, label="provider")
+REGISTRY.stats("treehacks_write_buffer", write_buffer.stats)
+REGISTRY.stats("treehacks_tts_cache", speech_cache.stats)
+REGISTRY.stats("treehacks_jobs", job_queue.stats)
+REGISTRY.stats("treehacks_search", search_index.stats)
+REGISTRY.stats("treehacks_live", feed.stats)
+REGISTRY.stats("treehacks_sessions", sessions.stats)
+
+
+
+def start_background() -> None:
+    """Start this process's background threads and the warm-up phase."""
+    job_queue.start()
+    write_buffer.start()
+    feed.start()
+
+    # Build the WARMUP components off the import path; /api/health/ready
+    # turns 200 once they are done.
+    warmup = components.resolve()
+    components.warm_in_background(warmup)
+    # Synthesizing the prompts calls ElevenLabs, so only when this process
+    # warms the speech stack too
+    if SPEECH_COMPONENTS & set(warmup):
+        threading.Thread(target=prewarm_speech_cache, name="tts-prewarm", daemon=True).start()
+
+
+def after_fork(torch_threads: Optional[int] = None) -> None:
+    """Set up a worker forked from a PREFORK parent (called from gunicorn.conf.py).
+
+    Threads and network connections don't survive a fork, so clients built
+    in the parent are dropped and rebuilt on first use here, and the
+    worker's own background threads are started. The model weights loaded
+    by the parent are kept and shared.
+    """
+    components.reset("store", "twilio", "gemini")
+    components.after_fork()
+    providers.reset()
+    transcriber.after_fork(torch_threads)
+    start_background()
+
+
+# Transcription pool workers (forkserver/spawn) import the server script as
+# __mp_main__ when it is run directly; they only need the model, not this.
+if __name__ != "__mp_main__":
+    if PREFORK:
+        # Load the models once, here in the parent. Workers forked from it
+        # share the weights copy-on-write instead of each loading a copy.
+        # gc.freeze() keeps the collector from touching (and so copying) the
+        # parent's objects.
+        transcriber.preload()
+        search_index.embedder  # loads the embedding model
+        gc.freeze()
+    else:
+        start_background()
+    components.mark_booted()
+
 if __name__ == "__main__":
-    app.run(port=8080, debug=True)
\ No newline at end of file
+    app.run(port=8080, debug=True)
@@ -0,0 +1,253 @@
+"""Server-side state for spoken assessments.
+
+A session holds one assessment: the patient's metadata, the turns so far and
+the question the watch is currently playing. The watch sends its
+``session_id`` with each answer, so a turn uploads just the audio, however
+long the conversation has run.
+
+Each turn also adds one line to the session's prompt context, with an
+estimated token count. Once the context passes ``SESSION_TOKEN_BUDGET``, the
+oldest turns drop out of the prompt. They stay in ``history``, which is what
+gets stored when the assessment ends. Tokens are estimated at four characters
+each, which is close enough for budgeting without a tokenizer.
+
+Sessions live in memory and expire ``SESSION_TTL`` seconds after their last
+turn; at most ``SESSION_MAX`` are kept, least recently used first out. With
+``SESSIONS_DB`` set they are also written to SQLite on every turn. They then
+survive restarts and can move between server processes: ``get`` reloads a
+session whenever another process has saved a newer turn.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import closing
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "2000"))
+# Unset keeps sessions in memory only
+SESSIONS_DB = os.getenv("SESSIONS_DB")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    turn INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at);
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def context_line(question: str, answer: str) -> str:
+    return f"AI: {question}\nUser: {answer}"
+
+
+class Session:
+    def __init__(
+        self,
+        session_id: str,
+        metadata: dict,
+        question: str,
+        history: Optional[list[dict]] = None,
+        num: int = 0,
+        budget: int = SESSION_TOKEN_BUDGET,
+    ):
+        self.id = session_id
+        self.metadata = metadata
+        self.question = question  # the question the watch is answering
+        self.history: list[dict] = []
+        self.num = num
+        self.turn = 0  # save counter
+        self.updated_at = time.time()
+        self.budget = budget
+        self._context: deque[tuple[str, int]] = deque()
+        self._context_tokens = 0
+        self.omitted = 0
+        for entry in history or []:
+            self._append(entry.get("question", ""), entry.get("answer", ""))
+
+    def _append(self, question: str, answer: str) -> None:
+        self.history.append({"question": question, "answer": answer})
+        line = context_line(question, answer)
+        tokens = estimate_tokens(line)
+        self._context.append((line, tokens))
+        self._context_tokens += tokens
+        while self._context_tokens > self.budget and len(self._context) > 1:
+            _, dropped = self._context.popleft()
+            self._context_tokens -= dropped
+            self.omitted += 1
+
+    def record(self, answer: str, next_question: Optional[str]) -> None:
+        """Add the answer to the current question and move on to ``next_question``."""
+        self._append(self.question, answer)
+        self.question = next_question
+        self.num += 1
+
+    def context(self, answer: Optional[str] = None) -> str:
+        """The conversation for the prompt, within budget.
+
+        ``answer`` is an answer to the current question that hasn't been
+        recorded yet.
+        """
+        lines = list(self._context)
+        tokens = self._context_tokens
+        if answer is not None:
+            line = context_line(self.question, answer)
+            lines.append((line, estimate_tokens(line)))
+            tokens += lines[-1][1]
+        omitted = self.omitted
+        while tokens > self.budget and len(lines) > 1:
+            tokens -= lines.pop(0)[1]
+            omitted += 1
+
+        text = "\n".join(line for line, _ in lines)
+        if omitted:
+            text = f"({omitted} earlier exchanges omitted)\n{text}"
+        return text or "(no conversation yet)"
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "metadata": self.metadata,
+                "question": self.question,
+                "history": self.history,
+                "num": self.num,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, session_id: str, turn: int, data: str, budget: int) -> "Session":
+        fields = json.loads(data)
+        session = cls(session_id, fields["metadata"], fields["question"], fields["history"], budget=budget)
+        session.num = fields["num"]
+        session.turn = turn
+        return session
+
+
+class SessionStore:
+    def __init__(
+        self,
+        ttl: float = SESSION_TTL,
+        max_sessions: int = SESSION_MAX,
+        path: Optional[str] = SESSIONS_DB,
+        budget: int = SESSION_TOKEN_BUDGET,
+    ):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.path = path
+        self.budget = budget
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+        if path:
+            with closing(self._connect()) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _expire(self, now: float) -> None:
+        # Least recently used first, so stop at the first live session
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.updated_at + self.ttl > now:
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def create(
+        self,
+        metadata: dict,
+        question: str,
+        history: Optional[list[dict]] = None,
+        num: int = 0,
+    ) -> Session:
+        session = Session(uuid.uuid4().hex, metadata, question, history, num, self.budget)
+        self.save(session)
+        with self._lock:
+            self.created += 1
+        if self.path:
+            try:
+                with closing(self._connect()) as conn:
+                    conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+            except sqlite3.Error as e:
+                log.warning("Failed to prune expired sessions: %s", e)
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """The live session, or None if it never existed, ended or expired."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+        if not self.path:
+            return session
+
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT turn, data, expires_at FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None or row[2] < now:
+            # Ended or expired, possibly in another process
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            return None
+        if session is None or session.turn < row[0]:
+            session = Session.from_json(session_id, row[0], row[1], self.budget)
+            with self._lock:
+                self._sessions[session_id] = session
+        return session
+
+    def save(self, session: Session) -> None:
+        session.turn += 1
+        session.updated_at = time.time()
+        if self.path:
+            with closing(self._connect()) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (id, turn, data, expires_at) VALUES (?, ?, ?, ?)",
+                    (session.id, session.turn, session.to_json(), session.updated_at + self.ttl),
+                )
+        with self._lock:
+            self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            self._expire(session.updated_at)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        if self.path:
+            with closing(self._connect()) as conn:
+                conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,194 @@
+"""Overlap LLM generation with text-to-speech, one sentence at a time.
+
+Instead of waiting for the whole reply before synthesizing it, the streamed
+model output is cut at sentence boundaries and each sentence is sent to TTS as
+soon as it is complete, while later sentences are still being generated. Audio
+comes back in sentence order; MP3 frames concatenate cleanly, so the pieces can
+be joined into one clip or relayed to the client as they arrive.
+"""
+
+import contextvars
+import logging
+import os
+import queue
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+
+log = logging.getLogger(__name__)
+
+TTS_PARALLELISM = int(os.getenv("TTS_PARALLELISM", "3"))
+
+# Don't send fragments shorter than this on their own ("Hi." / "Okay."): they
+# cost a full TTS round-trip and sound choppy.
+MIN_SENTENCE_CHARS = 40
+
+END_MARKER = "[CONVERSATION ENDED]"
+
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+")
+
+_executor = ThreadPoolExecutor(max_workers=TTS_PARALLELISM, thread_name_prefix="tts")
+
+
+def split_sentences(chunks: Iterable[str]) -> Iterator[str]:
+    """Re-chunk a stream of text fragments into whole sentences."""
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        for match in _SENTENCE_END.finditer(buffer):
+            if match.end() - start < MIN_SENTENCE_CHARS:
+                continue
+            yield buffer[start : match.end()].strip()
+            start = match.end()
+        buffer = buffer[start:]
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def speak_sentences(
+    chunks: Iterable[str],
+    synthesize: Callable[..., Optional[bytes]],
+) -> Iterator[tuple[str, Future]]:
+    """Yield ``(sentence, future)`` pairs, submitting each sentence to TTS immediately.
+
+    ``synthesize(text, previous_text=...)`` returns MP3 bytes or None. The
+    previous text is passed along so the voice keeps its intonation across
+    sentence boundaries.
+    """
+    for sentence, speech, previous_text in _speakable(chunks):
+        if speech:
+            # Carry the request context (and so its request id) into the pool
+            future = _executor.submit(
+                contextvars.copy_context().run, synthesize, speech, previous_text=previous_text
+            )
+        else:
+            future = Future()
+            future.set_result(b"")
+        yield sentence, future
+
+
+def _speakable(chunks: Iterable[str]) -> Iterator[tuple[str, str, Optional[str]]]:
+    """Yield ``(sentence, text to speak, previously spoken text)`` triples."""
+    spoken = ""
+    for sentence in split_sentences(chunks):
+        speech = sentence.replace(END_MARKER, "").strip()
+        yield sentence, speech, spoken or None
+        spoken = f"{spoken} {speech}".strip()
+
+
+def speak(
+    chunks: Iterable[str],
+    synthesize: Callable[..., Optional[bytes]],
+) -> tuple[str, Optional[bytes]]:
+    """Return the full generated text and the joined audio.
+
+    The audio is None if synthesis failed for any sentence.
+    """
+    raw: list[str] = []
+
+    def tee():
+        for chunk in chunks:
+            raw.append(chunk)
+            yield chunk
+
+    futures = [future for _, future in speak_sentences(tee(), synthesize)]
+    parts = [future.result() for future in futures]
+
+    text = "".join(raw)
+    if any(part is None for part in parts):
+        return text, None
+    return text, b"".join(parts)
+
+
+class SpeechRelay:
+    """Stream synthesized audio, in sentence order, while the reply is generated.
+
+    A background thread consumes the model stream and starts a streaming TTS
+    call per sentence; ``audio()`` yields each sentence's bytes as soon as the
+    TTS provider sends them, moving on to the next sentence when one finishes.
+    ``synthesize_stream(text, previous_text=...)`` must return an iterator of
+    audio chunks and raise on failure.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[str],
+        synthesize_stream: Callable[..., Iterable[bytes]],
+    ):
+        self._synthesize_stream = synthesize_stream
+        self._sentences: queue.Queue = queue.Queue()
+        self._parts: list[str] = []
+        self._done = threading.Event()
+        self.generation_error: Optional[Exception] = None
+        self.synthesis_error: Optional[Exception] = None
+
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._produce, chunks),
+            name="speech-relay",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _produce(self, chunks: Iterable[str]) -> None:
+        def tee():
+            for chunk in chunks:
+                self._parts.append(chunk)
+                yield chunk
+
+        try:
+            for _, speech, previous_text in _speakable(tee()):
+                if not speech:
+                    continue
+                audio: queue.Queue = queue.Queue()
+                self._sentences.put(audio)
+                _executor.submit(contextvars.copy_context().run, self._pump, speech, previous_text, audio)
+        except Exception as e:
+            log.warning("Failed to generate reply: %s", e)
+            self.generation_error = e
+        finally:
+            self._sentences.put(None)
+            self._done.set()
+
+    def _pump(self, text: str, previous_text: Optional[str], audio: queue.Queue) -> None:
+        try:
+            for chunk in self._synthesize_stream(text, previous_text=previous_text):
+                audio.put(chunk)
+        except Exception as e:
+            log.warning("Failed to synthesize sentence: %s", e)
+            self.synthesis_error = e
+        finally:
+            audio.put(None)
+
+    def text(self, timeout: Optional[float] = None) -> str:
+        """Wait for generation to finish and return the full reply text.
+
+        Raises the generation error, if there was one.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError("reply generation did not finish in time")
+        if self.generation_error is not None:
+            raise self.generation_error
+        return "".join(self._parts)
+
+    def audio(self, strict: bool = False) -> Iterator[bytes]:
+        """The reply's audio, sentence by sentence.
+
+        A sentence that fails to synthesize is skipped (see
+        ``synthesis_error``), or with ``strict`` its error is raised, so a
+        response streaming the audio aborts instead of ending cleanly.
+        """
+        while True:
+            sentence = self._sentences.get()
+            if sentence is None:
+                return
+            while True:
+                chunk = sentence.get()
+                if chunk is None:
+                    break
+                yield chunk
+            if strict and self.synthesis_error is not None:
+                raise self.synthesis_error
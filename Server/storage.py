@@ -0,0 +1,254 @@
+"""Document storage backends.
+
+The server talks to its document store through a small, Chroma-shaped
+interface: ``client.get_or_create_collection(name)`` returning a collection
+with ``name``, ``add``, ``get``, ``count`` and ``delete``. Two backends
+implement it, chosen with ``STORAGE_BACKEND``:
+
+``chroma`` (default)
+    The hosted Chroma database, as before.
+
+``sqlite``
+    An embedded store in one SQLite file (``STORAGE_PATH``). Every collection
+    shares one table, indexed by ``(collection, user_id)`` and
+    ``(collection, timestamp)``, so per-user reads and time windows are index
+    lookups on local disk instead of WAN round-trips. ``get`` understands
+    Chroma's ``where`` filters (``$eq``, ``$ne``, ``$gt``, ``$gte``, ``$lt``,
+    ``$lte``, ``$in``, ``$nin``, ``$and``, ``$or``) on metadata fields.
+    Like Chroma, adding an id that already exists keeps the original.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "chroma")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "./storage.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    document TEXT,
+    metadata TEXT,
+    user_id TEXT,
+    timestamp TEXT,
+    UNIQUE (collection, id)
+);
+CREATE INDEX IF NOT EXISTS documents_user ON documents (collection, user_id);
+CREATE INDEX IF NOT EXISTS documents_time ON documents (collection, timestamp);
+"""
+
+# Metadata fields stored in their own indexed columns
+INDEXED_FIELDS = ("user_id", "timestamp")
+
+_OPERATORS = {
+    "$eq": "=",
+    "$ne": "!=",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+}
+
+
+def _field(name: str) -> tuple[str, list]:
+    if name in INDEXED_FIELDS:
+        return name, []
+    return "json_extract(metadata, ?)", [f'$."{name}"']
+
+
+def where_sql(where: dict) -> tuple[str, list]:
+    """Translate a Chroma ``where`` filter into a SQL expression and parameters."""
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(sub) for sub in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            for _, sub_params in parts:
+                params.extend(sub_params)
+            continue
+
+        column, column_params = _field(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op in _OPERATORS:
+                clauses.append(f"{column} {_OPERATORS[op]} ?")
+                params.extend([*column_params, value])
+            elif op in ("$in", "$nin"):
+                negate = "NOT " if op == "$nin" else ""
+                marks = ", ".join("?" * len(value))
+                clauses.append(f"{column} {negate}IN ({marks})")
+                params.extend([*column_params, *value])
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+    return " AND ".join(clauses) or "1", params
+
+
+def _indexed_values(document: Optional[str], metadata: dict) -> tuple:
+    """user_id and timestamp for the index columns, from metadata or the document."""
+    values = {field: metadata.get(field) for field in INDEXED_FIELDS}
+    if any(value is None for value in values.values()) and document:
+        try:
+            body = json.loads(document)
+        except json.JSONDecodeError:
+            body = {}
+        if isinstance(body, dict):
+            for field in INDEXED_FIELDS:
+                if values[field] is None and isinstance(body.get(field), str):
+                    values[field] = body[field]
+    return tuple(values[field] for field in INDEXED_FIELDS)
+
+
+class SQLiteCollection:
+    # Tells queries.iter_window it may push time windows down into ``get``.
+    indexes_timestamps = True
+
+    def __init__(self, store: "SQLiteStore", name: str):
+        self._store = store
+        self.name = name
+
+    def add(
+        self,
+        ids: list[str],
+        documents: Optional[list[str]] = None,
+        metadatas: Optional[list[dict]] = None,
+        **_,
+    ) -> None:
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        rows = [
+            (
+                self.name,
+                doc_id,
+                document,
+                json.dumps(metadata or {}),
+                *_indexed_values(document, metadata or {}),
+            )
+            for doc_id, document, metadata in zip(ids, documents, metadatas)
+        ]
+        with self._store.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO documents"
+                " (collection, id, document, metadata, user_id, timestamp)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def _select(self, ids, where) -> tuple[str, list]:
+        sql, params = "collection = ?", [self.name]
+        if ids is not None:
+            sql += f" AND id IN ({', '.join('?' * len(ids))})"
+            params.extend(ids)
+        if where:
+            clause, where_params = where_sql(where)
+            sql += f" AND {clause}"
+            params.extend(where_params)
+        return sql, params
+
+    def get(
+        self,
+        ids: Optional[list[str]] = None,
+        where: Optional[dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[list[str]] = None,
+        **_,
+    ) -> dict:
+        include = include if include is not None else ["documents", "metadatas"]
+        sql, params = self._select(ids, where)
+        sql = f"SELECT id, document, metadata FROM documents WHERE {sql} ORDER BY rowid"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit if limit is not None else -1, offset or 0])
+
+        rows = self._store.connection().execute(sql, params).fetchall()
+        return {
+            "ids": [row[0] for row in rows],
+            "documents": [row[1] for row in rows] if "documents" in include else None,
+            "metadatas": (
+                [json.loads(row[2]) if row[2] else None for row in rows]
+                if "metadatas" in include
+                else None
+            ),
+        }
+
+    def count(self) -> int:
+        return self._store.connection().execute(
+            "SELECT COUNT(*) FROM documents WHERE collection = ?", (self.name,)
+        ).fetchone()[0]
+
+    def delete(self, ids: Optional[list[str]] = None, where: Optional[dict] = None) -> None:
+        sql, params = self._select(ids, where)
+        with self._store.transaction() as conn:
+            conn.execute(f"DELETE FROM documents WHERE {sql}", params)
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class SQLiteStore:
+    """Embedded stand-in for the Chroma client (see module docstring)."""
+
+    def __init__(self, path: str = STORAGE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._collections: dict[str, SQLiteCollection] = {}
+        self._lock = threading.Lock()
+
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection (SQLite connections can't be shared across threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self) -> _Transaction:
+        return _Transaction(self.connection())
+
+    def get_or_create_collection(self, name: str, **_) -> SQLiteCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = SQLiteCollection(self, name)
+            return self._collections[name]
+
+    def list_collections(self) -> list[str]:
+        rows = self.connection().execute("SELECT DISTINCT collection FROM documents").fetchall()
+        return [name for (name,) in rows]
+
+
+def open_store(backend: str = STORAGE_BACKEND):
+    """The configured document store client."""
+    if backend == "sqlite":
+        return SQLiteStore()
+    if backend != "chroma":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+    import chromadb
+
+    return chromadb.HttpClient(
+        ssl=True,
+        host=os.getenv("CHROMA_HOST", "api.trychroma.com"),
+        tenant=os.getenv("CHROMA_TENANT"),
+        database="Treehacks25",
+        headers={"x-chroma-token": os.getenv("CHROMA_API_KEY")},
+    )
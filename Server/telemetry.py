@@ -0,0 +1,372 @@
+"""Request IDs, structured logs, tracing spans and Prometheus metrics.
+
+Every request gets an id (the caller's ``X-Request-ID`` if it sent one, else a
+fresh one), echoed back in the response header and attached to every log line
+written while handling it. Logs are one JSON object per line
+(``LOG_FORMAT=text`` for plain lines during development).
+
+``span(name)`` times a stage of work: the duration goes into the
+``treehacks_span_duration_seconds`` histogram and failures into
+``treehacks_span_errors_total``, both labelled with the span name and an
+optional target (e.g. the collection a store call touched). ``init_app``
+adds per-route request latency and status counts, and serves everything in
+the Prometheus text format on ``/metrics``. Metrics are per process; scrape
+each worker separately.
+"""
+
+import contextvars
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "request_id", default=None
+)
+
+log = logging.getLogger(__name__)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [per-bucket counts, sum, count]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class StatsGauges:
+    """Exposes the numeric fields of an existing ``stats()`` dict as gauges.
+
+    ``stats`` may return ``{field: number}`` or, with ``label`` set,
+    ``{label value: {field: number}}`` (e.g. per-provider stats).
+    """
+
+    def __init__(self, prefix: str, stats: Callable[[], dict], label: Optional[str] = None):
+        self.prefix = prefix
+        self.stats = stats
+        self.label = label
+
+    def render(self) -> list[str]:
+        try:
+            stats = self.stats()
+        except Exception as e:
+            log.warning("Failed to collect %s stats: %s", self.prefix, e)
+            return []
+        groups = stats.items() if self.label else [(None, stats)]
+        fields: dict[str, list[str]] = {}
+        for group, values in groups:
+            labels = _labels((self.label,), (group,)) if self.label else ""
+            for field, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                fields.setdefault(field, []).append(f"{self.prefix}_{field}{labels} {_number(value)}")
+        lines = []
+        for field, samples in sorted(fields.items()):
+            lines.append(f"# TYPE {self.prefix}_{field} gauge")
+            lines.extend(samples)
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, **kwargs))
+
+    def stats(self, prefix: str, stats: Callable[[], dict], label: Optional[str] = None) -> StatsGauges:
+        return self.register(StatsGauges(prefix, stats, label))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+SPAN_SECONDS = REGISTRY.histogram(
+    "treehacks_span_duration_seconds", "Time spent in each traced stage", ("span", "target")
+)
+SPAN_ERRORS = REGISTRY.counter(
+    "treehacks_span_errors_total", "Traced stages that failed", ("span", "target")
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "treehacks_http_request_duration_seconds",
+    "Time to produce each HTTP response (streamed bodies excluded)",
+    ("method", "route"),
+)
+HTTP_RESPONSES = REGISTRY.counter(
+    "treehacks_http_responses_total", "HTTP responses by status", ("method", "route", "status")
+)
+
+
+class Span:
+    def __init__(self, name: str, target: str = ""):
+        self.name = name
+        self.target = target
+        self.failed = False
+
+
+@contextmanager
+def span(name: str, target: str = "") -> Iterator[Span]:
+    """Time the enclosed block; an exception (or ``failed = True``) counts as an error."""
+    current = Span(name, target)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        # A closed generator isn't a failure of the work it was doing.
+        if not isinstance(e, GeneratorExit):
+            current.failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        SPAN_SECONDS.observe(elapsed, span=name, target=target)
+        if current.failed:
+            SPAN_ERRORS.inc(span=name, target=target)
+        log.debug(
+            "span %s",
+            name,
+            extra={"span": name, "target": target, "duration_ms": round(elapsed * 1000, 2), "failed": current.failed},
+        )
+
+
+def traced_iter(items: Iterable, name: str, target: str = "") -> Iterator:
+    """Yield from ``items``, timing from the first pull until it is exhausted."""
+    with span(name, target):
+        yield from items
+
+
+class InstrumentedCollection:
+    def __init__(self, inner):
+        self._inner = inner
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def _call(self, method: str, *args, **kwargs):
+        with span(f"store.{method}", self._inner.name):
+            return getattr(self._inner, method)(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        return self._call("add", *args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._call("get", *args, **kwargs)
+
+    def count(self):
+        return self._call("count")
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", *args, **kwargs)
+
+
+class InstrumentedStore:
+    """A document store client whose collection calls are traced per collection."""
+
+    def __init__(self, inner):
+        self._inner = inner
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def get_or_create_collection(self, name: str, **kwargs) -> InstrumentedCollection:
+        return InstrumentedCollection(self._inner.get_or_create_collection(name=name, **kwargs))
+
+
+_RESERVED = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = request_id_var.get()
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        request_id = request_id_var.get()
+        return f"{line} [{request_id}]" if request_id else line
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Send all logs to stderr in the configured format (once per process)."""
+    root = logging.getLogger()
+    if any(getattr(handler, "_treehacks", False) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler._treehacks = True
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+
+def init_app(app) -> None:
+    """Request ids, access logs, request metrics and the /metrics route."""
+    from flask import Response, g, request
+
+    access_log = logging.getLogger("access")
+
+    @app.before_request
+    def start_request():
+        request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        g.request_id = request_id[:128]
+        g.request_token = request_id_var.set(g.request_id)
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_request(response):
+        started = g.pop("request_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_SECONDS.observe(elapsed, method=request.method, route=route)
+        HTTP_RESPONSES.inc(method=request.method, route=route, status=str(response.status_code))
+        response.headers["X-Request-ID"] = g.request_id
+        access_log.info(
+            "%s %s %s",
+            request.method,
+            request.path,
+            response.status_code,
+            extra={
+                "method": request.method,
+                "route": route,
+                "status": response.status_code,
+                "duration_ms": round(elapsed * 1000, 2),
+            },
+        )
+        return response
+
+    @app.teardown_request
+    def end_request(_):
+        token = g.pop("request_token", None)
+        if token is not None:
+            try:
+                request_id_var.reset(token)
+            except ValueError:
+                # Torn down from another context (e.g. after a streamed body)
+                request_id_var.set(None)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,315 @@
+"""Columnar, append-only storage for biometric time series.
+
+Each (user, metric family) series lives in its own directory as a sequence of
+segment files. A segment is a flat array of fixed-size records: an int64
+timestamp (wall-clock microseconds since 1970-01-01, no timezone, matching the
+naive ISO timestamps the server records) followed by one float32 column per
+field. Segments are memory-mapped for reads, so a range query is a binary
+search plus a slice rather than thousands of JSON decodes.
+
+Records within a segment are kept in timestamp order: an append that would go
+back in time starts a new segment, and reads merge the overlapping segments.
+Missing values are stored as NaN and come back as None.
+
+Other stores that derive from the series (rollups, detectors) can
+``subscribe`` to appends and rebuilds.
+"""
+
+import fcntl
+import logging
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+TIMESERIES_DIR = os.getenv("TIMESERIES_DIR", "./timeseries")
+
+# Records per segment file before a new one is started.
+SEGMENT_RECORDS = 65536
+
+# Metric families and the float columns stored for each.
+FAMILIES = {
+    "heart_rate": ("agitation", "hrv"),
+    "sleep": (
+        "remSleepHours",
+        "deepSleepHours",
+        "awakeTime",
+        "sleepQualityScore",
+        "totalSleepHours",
+    ),
+    "activity": ("steps", "caloriesBurned", "activityScore"),
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+# Marks a series that already holds everything from the document store.
+BACKFILLED_MARKER = ".backfilled"
+
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def to_micros(ts: datetime) -> int:
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(us: int) -> datetime:
+    return EPOCH + timedelta(microseconds=int(us))
+
+
+def record_dtype(family: str) -> np.dtype:
+    return np.dtype([("ts", "<i8")] + [(field, "<f4") for field in FAMILIES[family]])
+
+
+def _value(value) -> float:
+    if isinstance(value, bool) or value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def encode(family: str, samples: Iterable[tuple[datetime, dict]]) -> np.ndarray:
+    """``(timestamp, {field: value})`` samples as records sorted by timestamp."""
+    fields = FAMILIES[family]
+    rows = [
+        (to_micros(ts), *(_value(values.get(field)) for field in fields))
+        for ts, values in samples
+    ]
+    records = np.array(rows, dtype=record_dtype(family))
+    return records[np.argsort(records["ts"], kind="stable")]
+
+
+class TimeSeriesStore:
+    def __init__(self, root: str = TIMESERIES_DIR):
+        self.root = root
+        self._locks: dict[tuple[str, str], threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._listeners: list[Callable[[str, str, np.ndarray, bool], None]] = []
+
+    def subscribe(self, listener: Callable[[str, str, np.ndarray, bool], None]) -> None:
+        """Call ``listener(user_id, family, records, replace)`` on every change.
+
+        ``replace`` is False for appended records and True when ``records`` is
+        the whole (rebuilt) series. Listeners run while the series is locked,
+        so they see changes in the order they were written.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, user_id: str, family: str, records: np.ndarray, replace: bool) -> None:
+        for listener in self._listeners:
+            try:
+                listener(user_id, family, records, replace)
+            except Exception as e:
+                log.warning("Time-series listener failed for %s/%s: %s", user_id, family, e)
+
+    def _dir(self, user_id: str, family: str) -> str:
+        if family not in FAMILIES:
+            raise ValueError(f"Unknown metric family: {family}")
+        if not is_storable_id(user_id):
+            raise ValueError(f"Invalid user id: {user_id!r}")
+        return os.path.join(self.root, user_id, family)
+
+    @contextmanager
+    def _lock(self, user_id: str, family: str) -> Iterator[None]:
+        """Hold the series against other threads and other server processes.
+
+        The lock file sits next to the series directory rather than in it,
+        since ``rebuild`` swaps the directory out.
+        """
+        with self._locks_guard:
+            lock = self._locks.setdefault((user_id, family), threading.Lock())
+        with lock:
+            parent = os.path.dirname(self._dir(user_id, family))
+            os.makedirs(parent, exist_ok=True)
+            with open(os.path.join(parent, f".{family}.lock"), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _segments(directory: str) -> list[str]:
+        try:
+            names = sorted(n for n in os.listdir(directory) if n.endswith(".bin"))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(directory, n) for n in names]
+
+    def _write(self, directory: str, family: str, records: np.ndarray) -> None:
+        """Append sorted ``records``, rolling segments when full or out of order."""
+        dtype = record_dtype(family)
+        os.makedirs(directory, exist_ok=True)
+        segments = self._segments(directory)
+
+        while len(records):
+            path, room = None, 0
+            if segments:
+                last = segments[-1]
+                count = os.path.getsize(last) // dtype.itemsize
+                room = SEGMENT_RECORDS - count
+                if room > 0 and count:
+                    with open(last, "rb") as f:
+                        f.seek((count - 1) * dtype.itemsize)
+                        last_ts = np.frombuffer(f.read(dtype.itemsize), dtype=dtype)["ts"][0]
+                    if records["ts"][0] < last_ts:
+                        room = 0
+                if room > 0:
+                    path = last
+
+            if path is None:
+                index = len(segments)
+                path = os.path.join(directory, f"seg-{index:06d}.bin")
+                segments.append(path)
+                room = SEGMENT_RECORDS
+
+            chunk, records = records[:room], records[room:]
+            with open(path, "ab") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(chunk.tobytes())
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, user_id: str, family: str, samples: list[tuple[datetime, dict]]) -> None:
+        """Store ``(timestamp, {field: value})`` samples for one user and family."""
+        if not samples:
+            return
+        directory = self._dir(user_id, family)
+        records = encode(family, samples)
+        with self._lock(user_id, family):
+            self._write(directory, family, records)
+            self._notify(user_id, family, records, replace=False)
+
+    def rebuild(
+        self,
+        user_id: str,
+        family: str,
+        load: Callable[[], list[tuple[datetime, dict]]],
+    ) -> None:
+        """Rewrite a series from ``load()`` and mark it backfilled.
+
+        ``load`` runs while the series is locked, so appends from any process
+        wait for the rebuild instead of landing in the directory being replaced.
+        """
+        directory = self._dir(user_id, family)
+        staging = f"{directory}.rebuild"
+        with self._lock(user_id, family):
+            samples = load()
+            records = encode(family, samples)
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            if len(records):
+                self._write(staging, family, records)
+            open(os.path.join(staging, BACKFILLED_MARKER), "w").close()
+
+            retired = f"{directory}.old"
+            shutil.rmtree(retired, ignore_errors=True)
+            if os.path.exists(directory):
+                os.replace(directory, retired)
+            os.replace(staging, directory)
+            shutil.rmtree(retired, ignore_errors=True)
+            self._notify(user_id, family, records, replace=True)
+
+    def reindex(self, user_id: str, family: str) -> None:
+        """Replay the whole series to the listeners (e.g. to build a new rollup)."""
+        with self._lock(user_id, family):
+            self._notify(user_id, family, self.range(user_id, family), replace=True)
+
+    def invalidate(self, user_id: str, family: str) -> None:
+        """Force the next read to rebuild the series (e.g. after a failed append)."""
+        try:
+            os.remove(os.path.join(self._dir(user_id, family), BACKFILLED_MARKER))
+        except FileNotFoundError:
+            pass
+
+    def is_backfilled(self, user_id: str, family: str) -> bool:
+        return os.path.exists(os.path.join(self._dir(user_id, family), BACKFILLED_MARKER))
+
+    def range(
+        self,
+        user_id: str,
+        family: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> np.ndarray:
+        """Records with ``start <= ts < end``, sorted by timestamp."""
+        dtype = record_dtype(family)
+        lo = to_micros(start) if start is not None else np.iinfo(np.int64).min
+        hi = to_micros(end) if end is not None else np.iinfo(np.int64).max
+
+        parts = []
+        for path in self._segments(self._dir(user_id, family)):
+            count = os.path.getsize(path) // dtype.itemsize
+            if count == 0:
+                continue
+            records = np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+            ts = records["ts"]
+            if ts[0] >= hi or ts[-1] < lo:
+                continue
+            i, j = np.searchsorted(ts, [lo, hi], side="left")
+            if j > i:
+                parts.append(np.array(records[i:j]))
+
+        if not parts:
+            return np.empty(0, dtype=dtype)
+        if len(parts) == 1:
+            return parts[0]
+        merged = np.concatenate(parts)
+        return merged[np.argsort(merged["ts"], kind="stable")]
+
+
+def is_storable_id(user_id: Optional[str]) -> bool:
+    """Whether ``user_id`` can name a series directory (ids the server issues always can)."""
+    return bool(_SAFE_ID.match(user_id or ""))
+
+
+def window(
+    records: np.ndarray, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> np.ndarray:
+    """The sorted ``records`` with ``start <= ts < end``, like ``range`` on a store."""
+    lo = to_micros(start) if start is not None else np.iinfo(np.int64).min
+    hi = to_micros(end) if end is not None else np.iinfo(np.int64).max
+    i, j = np.searchsorted(records["ts"], [lo, hi], side="left")
+    return records[i:j]
+
+
+def timestamps(records: np.ndarray) -> list[str]:
+    return [from_micros(us).isoformat() for us in records["ts"]]
+
+
+def as_decimal(values: np.ndarray) -> np.ndarray:
+    """Stored float32 values as the float64s they were ingested as.
+
+    Goes through the shortest decimal that round-trips each float32, so a
+    stored 7.81 comes back as 7.81 rather than 7.809999942779541.
+    """
+    return values.astype(str).astype(np.float64)
+
+
+def column(records: np.ndarray, field: str) -> list[Optional[float]]:
+    values = as_decimal(records[field])
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def as_points(records: np.ndarray, field: str) -> dict[str, Optional[float]]:
+    """``{timestamp: value}`` for one field, the shape /get-user returns."""
+    return dict(zip(timestamps(records), column(records, field)))
+
+
+def as_rows(records: np.ndarray, fields: Iterable[str]) -> list[dict]:
+    """One ``{timestamp, field: value, ...}`` dict per record."""
+    fields = list(fields)
+    columns = [column(records, field) for field in fields]
+    return [
+        {"timestamp": ts, **{field: col[i] for field, col in zip(fields, columns)}}
+        for i, ts in enumerate(timestamps(records))
+    ]
@@ -0,0 +1,269 @@
+"""Whisper transcription off the request thread.
+
+A fixed pool of worker processes each load the Whisper model once and then
+serve jobs from a bounded queue. A request that would overflow the queue is
+rejected immediately rather than piling up behind slow decodes, and every job
+carries a deadline: if it is still waiting when the deadline passes, the worker
+skips it and the caller gets a ``TimeoutError``.
+
+Set ``TRANSCRIBE_WORKERS=0`` to run jobs on a single in-process thread instead
+(handy for local development; the model is then loaded in the server process).
+
+``preload()`` loads the model into the calling process without starting any
+workers. Every process forked from it afterwards (pool workers with the
+``fork`` start method, or WSGI workers forked from a preloading parent, see
+``gunicorn.conf.py``) inherits the weights copy-on-write instead of loading
+its own copy.
+
+Pool workers are started with ``forkserver`` (``spawn`` where that is
+unavailable) by default: forking the already multithreaded server can copy a
+lock some other thread holds and hang the child. Under the prefork parent
+(``PREFORK=1``) the default is ``fork``, so pool workers share the preloaded
+weights. ``TRANSCRIBE_START_METHOD`` overrides either. If a pool worker dies
+(out of memory, a crash) the whole pool is unusable; it is then replaced and
+the job retried once.
+"""
+
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "2"))
+TRANSCRIBE_QUEUE_SIZE = int(os.getenv("TRANSCRIBE_QUEUE_SIZE", "8"))
+TRANSCRIBE_TIMEOUT = float(os.getenv("TRANSCRIBE_TIMEOUT", "60"))
+TRANSCRIBE_START_METHOD = os.getenv("TRANSCRIBE_START_METHOD") or (
+    "fork"
+    if os.getenv("PREFORK") == "1"
+    else "forkserver"
+    if "forkserver" in multiprocessing.get_all_start_methods()
+    else "spawn"
+)
+
+# The model held by this process (a pool worker, or the server in inline mode).
+_model = None
+
+
+class QueueFull(Exception):
+    """Raised when the transcription queue has no free slot."""
+
+
+def _init_worker(model_name: str) -> None:
+    global _model
+    if _model is None:
+        import whisper
+
+        _model = whisper.load_model(model_name)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _run_job(audio, deadline: float) -> tuple[Optional[str], float]:
+    """Transcribe ``audio`` unless ``deadline`` already passed.
+
+    Returns ``(text, started_at)``; ``text`` is None for a skipped job.
+    """
+    started_at = time.time()
+    if started_at > deadline:
+        return None, started_at
+    result = _model.transcribe(audio)
+    return result["text"], started_at
+
+
+class TranscriptionService:
+    def __init__(
+        self,
+        model_name: str = WHISPER_MODEL,
+        workers: int = TRANSCRIBE_WORKERS,
+        queue_size: int = TRANSCRIBE_QUEUE_SIZE,
+        start_method: str = TRANSCRIBE_START_METHOD,
+    ):
+        self.model_name = model_name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.start_method = start_method
+
+        # Running jobs plus queued jobs never exceed this many.
+        self.capacity = max(workers, 1) + queue_size
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._restarts = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._last_wait = 0.0
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.workers > 0:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(self.start_method),
+                        initializer=_init_worker,
+                        initargs=(self.model_name,),
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=1,
+                        thread_name_prefix="whisper",
+                        initializer=_init_worker,
+                        initargs=(self.model_name,),
+                    )
+            return self._executor
+
+    def _discard(self, executor: Executor) -> None:
+        """Drop a broken pool so the next job starts a new one."""
+        with self._lock:
+            if self._executor is not executor:
+                return  # another thread already replaced it
+            self._executor = None
+            self._restarts += 1
+        log.warning("Transcription pool broke (a worker died); starting a new one")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def preload(self) -> None:
+        """Load the model into this process so processes forked later share it.
+
+        Torch is held to one thread here: a parent that has started its
+        OpenMP thread pool can hang the children it forks. Forked processes
+        set their own thread count in ``after_fork``.
+        """
+        import torch
+
+        torch.set_num_threads(1)
+        _init_worker(self.model_name)
+
+    def after_fork(self, torch_threads: Optional[int] = None) -> None:
+        """Reset per-process state in a child forked from a process using this service."""
+        # Executor threads and pool pipes belong to the parent.
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._in_flight = 0
+        if torch_threads and "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(torch_threads)
+
+    def warm(self, wait: bool = False) -> None:
+        """Start every worker now so each has its model loaded before traffic.
+
+        With ``wait``, block until the workers have answered (and so have
+        finished loading the model).
+        """
+        executor = self._get_executor()
+        try:
+            pings = [executor.submit(_ping) for _ in range(max(self.workers, 1))]
+            if wait:
+                for ping in pings:
+                    ping.result()
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    def transcribe(self, audio, timeout: Optional[float] = None) -> str:
+        """Transcribe ``audio`` (a path or float32 samples) within ``timeout`` seconds.
+
+        Raises QueueFull when the queue is saturated and TimeoutError when the
+        deadline passes before the transcript is ready.
+        """
+        timeout = TRANSCRIBE_TIMEOUT if timeout is None else timeout
+        submitted_at = time.time()
+        deadline = submitted_at + timeout
+
+        try:
+            text, started_at = self._run(audio, deadline, timeout)
+        except BrokenProcessPool:
+            # _run replaced the pool; the job itself may be fine
+            text, started_at = self._run(audio, deadline, timeout)
+
+        wait = max(started_at - submitted_at, 0.0)
+        with self._lock:
+            self._waited += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._last_wait = wait
+            if text is None:
+                self._timed_out += 1
+            else:
+                self._completed += 1
+
+        if text is None:
+            raise TimeoutError(f"transcription waited past its {timeout:.1f}s deadline")
+        return text
+
+    def _run(self, audio, deadline: float, timeout: float) -> tuple[Optional[str], float]:
+        """Submit one job and wait for it; raises BrokenProcessPool after discarding the pool."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise QueueFull(f"transcription queue is full ({self.capacity} jobs)")
+
+        with self._lock:
+            self._in_flight += 1
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_run_job, audio, deadline)
+        except Exception as e:
+            self._release()
+            if isinstance(e, BrokenProcessPool):
+                self._discard(executor)
+            raise
+        future.add_done_callback(lambda _: self._release())
+
+        try:
+            return future.result(timeout=max(deadline - time.time(), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise TimeoutError(f"transcription did not finish within {timeout:.1f}s")
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = min(self._in_flight, max(self.workers, 1))
+            return {
+                "model": self.model_name,
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "in_flight": self._in_flight,
+                "queue_depth": self._in_flight - running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "restarts": self._restarts,
+                "wait_avg_s": self._wait_total / self._waited if self._waited else 0.0,
+                "wait_max_s": self._wait_max,
+                "wait_last_s": self._last_wait,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,192 @@
+"""Change log of document store writes, for cheap "has anything changed?" reads.
+
+Every document written through ``VersionedStore`` is appended to a log with a
+global, increasing sequence number. A collection's version is the newest
+sequence number written to it, and a patient's version is the newest one
+written to any of their documents, so:
+
+* a read can answer ``304 Not Modified`` by comparing versions, without
+  touching the store, and
+* ``changes(collection, since)`` lists the ids written after a version a
+  client already has, so it can fetch only those.
+
+The log lives in SQLite and is shared by all server processes. Only the
+newest ``VERSION_LOG_SIZE`` entries are kept. A client whose version is
+older than that gets a full response again. Documents written before the
+log existed are at version 0. ETags also carry a random id of the log
+(``tag()``), so a client can't match an old tag against a recreated log.
+
+Read the version *before* reading the data it describes. A write that lands
+in between then only makes the data newer than its version, which costs one
+extra refetch. It can never leave a stale body cached under a new version.
+"""
+
+import os
+import sqlite3
+import uuid
+from contextlib import closing
+from typing import Optional
+
+VERSIONS_DB = os.getenv("VERSIONS_DB", "./versions.db")
+VERSION_LOG_SIZE = int(os.getenv("VERSION_LOG_SIZE", "1000000"))
+# Check the log size every this many writes
+PRUNE_EVERY = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    user_id TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_collection ON changes (collection, seq);
+CREATE INDEX IF NOT EXISTS changes_user ON changes (user_id, seq);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# Collections whose document ids are user ids
+USER_KEYED_COLLECTIONS = {"patients"}
+
+
+def document_owner(collection: str, doc_id: str, metadata: Optional[dict]) -> Optional[str]:
+    if collection in USER_KEYED_COLLECTIONS:
+        return doc_id
+    return (metadata or {}).get("user_id")
+
+
+class VersionLog:
+    def __init__(self, path: str = VERSIONS_DB, max_entries: int = VERSION_LOG_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._writes = 0
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)",
+                (uuid.uuid4().hex[:8],),
+            )
+            (self.epoch,) = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def record(self, collection: str, entries: list[tuple[str, Optional[str]]]) -> int:
+        """Log ``(doc_id, user_id)`` writes to ``collection``; returns the new version."""
+        if not entries:
+            return self.version(collection)
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO changes (collection, doc_id, user_id) VALUES (?, ?, ?)",
+                    [(collection, doc_id, user_id) for doc_id, user_id in entries],
+                )
+                (version,) = conn.execute("SELECT MAX(seq) FROM changes").fetchone()
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        self._writes += len(entries)
+        if self._writes >= PRUNE_EVERY:
+            self._writes = 0
+            self.prune()
+        return version
+
+    def prune(self) -> None:
+        """Drop all but the newest ``max_entries`` log entries."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                (newest,) = conn.execute("SELECT MAX(seq) FROM changes").fetchone()
+                cutoff = (newest or 0) - self.max_entries
+                if cutoff > 0:
+                    conn.execute("DELETE FROM changes WHERE seq <= ?", (cutoff,))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES ('pruned_through', ?)",
+                        (str(cutoff),),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def tag(self, version: int) -> str:
+        """ETag value for ``version``; differs between version logs."""
+        return f"{self.epoch}-{version}"
+
+    def version(self, collection: str) -> int:
+        with closing(self._connect()) as conn:
+            (version,) = conn.execute(
+                "SELECT MAX(seq) FROM changes WHERE collection = ?", (collection,)
+            ).fetchone()
+        return version or 0
+
+    def user_version(self, user_id: str) -> int:
+        with closing(self._connect()) as conn:
+            (version,) = conn.execute(
+                "SELECT MAX(seq) FROM changes WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return version or 0
+
+    def changes(
+        self,
+        collection: str,
+        since: int,
+        until: int,
+        user_id: Optional[str] = None,
+    ) -> Optional[list[str]]:
+        """Ids written to ``collection`` after version ``since``, up to ``until``.
+
+        Returns None if the log no longer reaches back to ``since``, or
+        ``since`` is 0 or newer than ``until``; the caller should send
+        everything instead.
+        """
+        sql = "SELECT DISTINCT doc_id FROM changes WHERE collection = ? AND seq > ? AND seq <= ?"
+        params: list = [collection, since, until]
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            params.append(user_id)
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'pruned_through'").fetchone()
+            if since <= 0 or since > until or (row is not None and since < int(row[0])):
+                return None
+            return [doc_id for (doc_id,) in conn.execute(sql, params).fetchall()]
+
+
+class VersionedCollection:
+    def __init__(self, inner, log: VersionLog):
+        self._inner = inner
+        self._log = log
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def add(self, ids: list[str], documents=None, metadatas=None, **kwargs):
+        # The store ignores ids it already has (e.g. a retried write), and
+        # those mustn't bump the version
+        seen = set(self._inner.get(ids=list(ids), include=[])["ids"])
+        result = self._inner.add(ids=ids, documents=documents, metadatas=metadatas, **kwargs)
+        metadatas = metadatas or [None] * len(ids)
+        entries = []
+        for doc_id, metadata in zip(ids, metadatas):
+            if doc_id not in seen:
+                seen.add(doc_id)
+                entries.append((doc_id, document_owner(self._inner.name, doc_id, metadata)))
+        self._log.record(self._inner.name, entries)
+        return result
+
+
+class VersionedStore:
+    """A document store client that logs every add to a ``VersionLog``."""
+
+    def __init__(self, inner, log: VersionLog):
+        self._inner = inner
+        self._log = log
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def get_or_create_collection(self, name: str, **kwargs) -> VersionedCollection:
+        return VersionedCollection(self._inner.get_or_create_collection(name=name, **kwargs), self._log)
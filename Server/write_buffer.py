@@ -0,0 +1,229 @@
+"""Write-behind buffering of document store adds.
+
+Ingest routes hand their writes to a ``WriteBuffer`` instead of calling
+``collection.add`` inside the request. A background thread groups them per
+collection and writes each group with one bulk add once it holds
+``WRITE_BATCH_SIZE`` entries or its oldest entry is ``WRITE_FLUSH_SECONDS``
+old, so a fleet of watches posting every few seconds costs the store one add
+per collection per flush instead of one per sample.
+
+When ``WRITE_BUFFER_MAX`` entries are waiting (e.g. the store is down) new
+writes block for up to ``WRITE_BUFFER_TIMEOUT`` seconds and then fail with
+``BufferFull``, pushing back on clients instead of growing without bound.
+Failed flushes are retried with backoff. Everything still buffered is flushed
+when the process exits normally; writes buffered at the moment of a crash are
+lost, like any write-behind cache.
+
+``pending(collection, user_id)`` returns a user's not-yet-written entries so
+reads can overlay them and a patient always sees their own latest samples.
+They aren't in the version log yet, so ``has_pending(user_id)`` tells
+versioned reads not to answer from it.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "256"))
+WRITE_FLUSH_SECONDS = float(os.getenv("WRITE_FLUSH_SECONDS", "0.5"))
+WRITE_BUFFER_MAX = int(os.getenv("WRITE_BUFFER_MAX", "20000"))
+WRITE_BUFFER_TIMEOUT = float(os.getenv("WRITE_BUFFER_TIMEOUT", "5"))
+WRITE_RETRY_MAX = 30.0
+
+
+class BufferFull(Exception):
+    pass
+
+
+class WriteBuffer:
+    def __init__(
+        self,
+        client,
+        batch_size: int = WRITE_BATCH_SIZE,
+        flush_seconds: float = WRITE_FLUSH_SECONDS,
+        max_pending: int = WRITE_BUFFER_MAX,
+    ):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+
+        # collection -> {id: (document, metadata, enqueued_at)}
+        self._queued: dict[str, OrderedDict[str, tuple]] = {}
+        self._in_flight: dict[str, dict[str, tuple]] = {}
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._failures = 0
+        self._retry_at = 0.0
+
+        self.flushes = 0
+        self.written = 0
+        self.errors = 0
+
+    def add(
+        self,
+        collection: str,
+        ids: list[str],
+        documents: list[str],
+        metadatas: list[dict],
+        timeout: float = WRITE_BUFFER_TIMEOUT,
+    ) -> None:
+        """Queue a bulk add; blocks while the buffer is full, then raises BufferFull."""
+        deadline = time.monotonic() + timeout
+        now = time.time()
+        with self._cond:
+            # An oversized batch is still let in once the buffer has drained.
+            while self._size and self._size + len(ids) > self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BufferFull(f"{self._size} writes already waiting for the store")
+                self._cond.wait(remaining)
+
+            queued = self._queued.setdefault(collection, OrderedDict())
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                if doc_id not in queued:
+                    self._size += 1
+                queued[doc_id] = (document, metadata, now)
+            self._cond.notify_all()
+
+    def pending(self, collection: str, user_id: str) -> list[dict]:
+        """Decoded ``{id, document, metadata}`` rows not yet in the store."""
+        with self._cond:
+            entries = [
+                (doc_id, entry)
+                for source in (self._in_flight, self._queued)
+                for doc_id, entry in source.get(collection, {}).items()
+                if (entry[1] or {}).get("user_id") == user_id
+            ]
+        rows = []
+        for doc_id, (document, metadata, _) in entries:
+            try:
+                decoded = json.loads(document) if document else {}
+            except json.JSONDecodeError:
+                decoded = {}
+            rows.append({"id": doc_id, "document": decoded, "metadata": metadata})
+        return rows
+
+    def has_pending(self, user_id: str) -> bool:
+        """Whether any of the user's entries, in any collection, aren't in the store yet."""
+        with self._cond:
+            return any(
+                (entry[1] or {}).get("user_id") == user_id
+                for source in (self._in_flight, self._queued)
+                for entries in source.values()
+                for entry in entries.values()
+            )
+
+    def _due(self) -> tuple[list[str], Optional[float]]:
+        """Collections ready to flush, and how long until the next one will be."""
+        now = time.time()
+        if now < self._retry_at:
+            return [], self._retry_at - now
+        due, wait = [], None
+        for name, queued in self._queued.items():
+            if not queued:
+                continue
+            oldest = next(iter(queued.values()))[2]
+            age = now - oldest
+            if self._stopping or len(queued) >= self.batch_size or age >= self.flush_seconds:
+                due.append(name)
+            else:
+                left = self.flush_seconds - age
+                wait = left if wait is None else min(wait, left)
+        return due, wait
+
+    def _flush_one(self, name: str) -> bool:
+        with self._cond:
+            queued = self._queued.get(name)
+            if not queued:
+                return True
+            batch = []
+            while queued and len(batch) < self.batch_size:
+                batch.append(queued.popitem(last=False))
+            self._in_flight.setdefault(name, {}).update(batch)
+
+        try:
+            self.client.get_or_create_collection(name=name).add(
+                ids=[doc_id for doc_id, _ in batch],
+                documents=[entry[0] for _, entry in batch],
+                metadatas=[entry[1] for _, entry in batch],
+            )
+        except Exception as e:
+            log.warning("Failed to flush %d writes to %s: %s", len(batch), name, e)
+            with self._cond:
+                for doc_id, _ in batch:
+                    self._in_flight[name].pop(doc_id, None)
+                # Put them back at the front, ahead of newer writes.
+                self._queued[name] = OrderedDict(batch + list(self._queued[name].items()))
+                self.errors += 1
+                self._failures += 1
+                self._retry_at = time.time() + min(2**self._failures * 0.5, WRITE_RETRY_MAX)
+            return False
+
+        with self._cond:
+            for doc_id, _ in batch:
+                self._in_flight[name].pop(doc_id, None)
+            self._size -= len(batch)
+            self.flushes += 1
+            self.written += len(batch)
+            self._failures = 0
+            self._retry_at = 0.0
+            self._cond.notify_all()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                due, wait = self._due()
+                while not due:
+                    if self._stopping and not any(self._queued.values()):
+                        return
+                    self._cond.wait(wait if wait is not None else self.flush_seconds)
+                    due, wait = self._due()
+            for name in due:
+                self._flush_one(name)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def flush(self) -> bool:
+        """Write everything queued now; returns False if any flush failed."""
+        ok = True
+        for name in list(self._queued):
+            while self._queued.get(name):
+                if not self._flush_one(name):
+                    ok = False
+                    break
+        return ok
+
+    def stop(self, timeout: float = 10) -> None:
+        with self._cond:
+            self._stopping = True
+            self._retry_at = 0.0
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if any(self._queued.values()) and not self.flush():
+            log.error("Write buffer stopped with %d writes unflushed", self._size)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pending": self._size,
+                "flushes": self.flushes,
+                "written": self.written,
+                "errors": self.errors,
+                "avg_batch": self.written / self.flushes if self.flushes else 0.0,
+            }